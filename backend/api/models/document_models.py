@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import List
+from collections import Counter
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Any, Dict, List, Optional
 
 class DocumentCheckResult(BaseModel):
     is_valid: bool
@@ -9,6 +10,9 @@ class DocumentCheckResult(BaseModel):
 class QuestionRequest(BaseModel):
     question: str
     gender: str
+    stream: bool = False
+    # Continues a conversation; the ID is returned in the X-Session-Id header
+    session_id: Optional[str] = None
 
 class DocumentRequest(BaseModel):
     document_type: str
@@ -21,3 +25,136 @@ class FunctionCallResultMessage(BaseModel):
     role: str
     content: str
     tool_call_id: str
+
+class MatchRequest(BaseModel):
+    user_id: str
+    intentions: Optional[dict] = None
+    preferences: Optional[dict] = None
+    # Bounded so a request cannot slice lists from the end or serialize the whole population
+    k: int = Field(10, ge=1, le=100)
+    explain: bool = False
+
+class MatchCandidate(BaseModel):
+    user_id: str
+    score: float
+    explanation: Optional[str] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    created_at: float
+    updated_at: float
+    result: Optional[Any] = None
+    error: Optional[str] = None
+
+class IngestItem(BaseModel):
+    item_id: int
+    name: str
+    user_id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+class IngestBatchStatus(BaseModel):
+    batch_id: str
+    status: str
+    created_at: float
+    updated_at: float
+    counts: Dict[str, int]
+    # Throughput of the latest run, over the images it sent through the pipeline
+    images_per_second: Optional[float] = None
+    items: Optional[List[IngestItem]] = None
+
+
+def _clean_value(value):
+    """Drops empty values and the "<value>" placeholders the vision model sometimes echoes back."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text or text.lower() in ("<value>", "unknown", "n/a", "none", "null"):
+        return None
+    return text
+
+def _most_common(values: List[Optional[str]]) -> Optional[str]:
+    present = [value for value in values if value is not None]
+    if not present:
+        return None
+    # Case-insensitive vote; ties go to the earliest page
+    counts = Counter(value.lower() for value in present)
+    best = max(counts.values())
+    return next(value for value in present if counts[value.lower()] == best)
+
+class HairDetails(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    color: Optional[str] = None
+    texture: Optional[str] = None
+    length: Optional[str] = None
+
+    _clean = field_validator("color", "texture", "length", mode="before")(_clean_value)
+
+class EyeDetails(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    color: Optional[str] = None
+    shape: Optional[str] = None
+
+    _clean = field_validator("color", "shape", mode="before")(_clean_value)
+
+class VisionAttributes(BaseModel):
+    """Attributes extracted from one image by the vision model."""
+    model_config = ConfigDict(extra="ignore")
+
+    face_shape: Optional[str] = None
+    hair_details: HairDetails = HairDetails()
+    eye_details: EyeDetails = EyeDetails()
+    skin_tone: Optional[str] = None
+    other_features: List[str] = []
+
+    _clean = field_validator("face_shape", "skin_tone", mode="before")(_clean_value)
+
+    @field_validator("hair_details", "eye_details", mode="before")
+    @classmethod
+    def _empty_details(cls, value):
+        return value if isinstance(value, (dict, BaseModel)) else {}
+
+    @field_validator("other_features", mode="before")
+    @classmethod
+    def _feature_list(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            value = [value]
+        return [text for text in (_clean_value(item) for item in value) if text]
+
+    @classmethod
+    def merge(cls, pages: List["VisionAttributes"]) -> "VisionAttributes":
+        """Merges per-page attributes: majority vote for single values, ordered union for features."""
+        features, seen = [], set()
+        for page in pages:
+            for feature in page.other_features:
+                if feature.lower() not in seen:
+                    seen.add(feature.lower())
+                    features.append(feature)
+        return cls(
+            face_shape=_most_common([page.face_shape for page in pages]),
+            hair_details=HairDetails(
+                color=_most_common([page.hair_details.color for page in pages]),
+                texture=_most_common([page.hair_details.texture for page in pages]),
+                length=_most_common([page.hair_details.length for page in pages]),
+            ),
+            eye_details=EyeDetails(
+                color=_most_common([page.eye_details.color for page in pages]),
+                shape=_most_common([page.eye_details.shape for page in pages]),
+            ),
+            skin_tone=_most_common([page.skin_tone for page in pages]),
+            other_features=features,
+        )
+
+class DocumentContext(BaseModel):
+    """Compact, canonical context handed from vision extraction to the text model."""
+    pages: int
+    attributes: VisionAttributes
+    notes: List[str] = []
+
+    def to_prompt_json(self) -> str:
+        return self.model_dump_json(exclude_none=True, exclude_defaults=True)
@@ -1,14 +1,22 @@
-from fastapi import APIRouter, UploadFile, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List
-from api.services.openai_service import process_image_with_grok, process_document_with_text_model, generate_response
-from api.utils.image_utils import encode_image_to_base64, convert_pdf_to_images, pil_image_to_base64
-from api.models.document_models import DocumentCheckResult, QuestionRequest, DocumentRequest, DocumentResponse, FunctionCallResultMessage
+from typing import List, Optional
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from api.services.openai_service import process_images_with_grok, process_page_stream_with_grok, process_document_with_text_model_async, generate_response, open_response_stream, summarize_conversation
+from api.services.session_service import get_session_manager
+import json
+from api.utils.image_utils import preprocess_image_file, iter_pdf_pages_preprocessed, check_upload_size, copy_upload_to_file, ResourceLimitError
+from api.services.job_service import get_job_manager, JobQueueFullError, WebhookURLError
+from api.services.ingest_service import get_ingest_manager, IngestBatchRunningError
+from api.models.document_models import DocumentCheckResult, QuestionRequest, DocumentRequest, DocumentResponse, FunctionCallResultMessage, MatchRequest, MatchCandidate, JobStatus, IngestBatchStatus
 import tempfile
 import logging
 import os
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Mock database containing document information
 DOCUMENTS_DB = {
@@ -20,41 +28,248 @@ DOCUMENTS_DB = {
 
 # API endpoint for document validation
 @router.post("/validate-document")
-async def validate_document(file: UploadFile):
+async def validate_document(
+    file: UploadFile,
+    max_image_bytes: Optional[int] = Query(None, ge=1),
+    max_image_pixels: Optional[int] = Query(None, ge=1),
+    grayscale: bool = False,
+):
     if file.content_type not in ["image/jpeg", "image/png", "application/pdf"]:
         raise HTTPException(status_code=400, detail="Unsupported file type. Only JPEG, PNG, and PDF are allowed.")
 
     try:
-        base64_images = []
+        check_upload_size(file.file)
 
         if file.content_type == "application/pdf":
             with tempfile.NamedTemporaryFile(delete=True, suffix=".pdf") as temp_pdf:
-                temp_pdf.write(file.file.read())
-                temp_pdf.flush()
-                images = convert_pdf_to_images(temp_pdf.name)
-                base64_images = [pil_image_to_base64(image) for image in images]
+                await run_in_threadpool(copy_upload_to_file, file.file, temp_pdf)
+                # Pages are rasterized and encoded one at a time in the threadpool;
+                # page N+1 renders while page N is with the vision model
+                pages = iterate_in_threadpool(iter_pdf_pages_preprocessed(
+                    temp_pdf.name,
+                    max_bytes=max_image_bytes,
+                    max_pixels=max_image_pixels,
+                    grayscale=grayscale or None,
+                ))
+                aggregated_results = await process_page_stream_with_grok(pages)
         else:
-            base64_image = encode_image_to_base64(file.file)
-            base64_images = [base64_image]
-
-        # Process image with Grok Vision Model
-        aggregated_results = [process_image_with_grok(base64_image) for base64_image in base64_images]
+            image = await run_in_threadpool(
+                preprocess_image_file,
+                file.file,
+                max_bytes=max_image_bytes,
+                max_pixels=max_image_pixels,
+                grayscale=grayscale,
+            )
+            aggregated_results = await process_images_with_grok([image])
 
         # Further processing with the Grok Text model
-        response = process_document_with_text_model(aggregated_results)
+        response = await process_document_with_text_model_async(aggregated_results)
         return response
 
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing the document: {str(e)}")
 
+# API endpoint for submitting document validation as a background job
+@router.post("/validate-document/jobs", response_model=JobStatus, status_code=202)
+async def submit_validation_job(
+    file: UploadFile,
+    max_image_bytes: Optional[int] = Query(None, ge=1),
+    max_image_pixels: Optional[int] = Query(None, ge=1),
+    grayscale: bool = False,
+    webhook_url: Optional[str] = None,
+):
+    """
+    Queues the upload for validation and returns a job ID immediately.
+    Poll GET /jobs/{job_id}, or pass webhook_url to receive the finished job as a POST.
+    """
+    if file.content_type not in ["image/jpeg", "image/png", "application/pdf"]:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Only JPEG, PNG, and PDF are allowed.")
+
+    try:
+        check_upload_size(file.file)
+        kind = "pdf" if file.content_type == "application/pdf" else "image"
+        # The job owns this file and deletes it when it finishes
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf" if kind == "pdf" else ".img") as temp_file:
+            await run_in_threadpool(copy_upload_to_file, file.file, temp_file)
+        options = {"max_bytes": max_image_bytes, "max_pixels": max_image_pixels, "grayscale": grayscale}
+        try:
+            return await get_job_manager().submit(kind, temp_file.name, options, webhook_url)
+        except Exception:
+            os.remove(temp_file.name)
+            raise
+
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except WebhookURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error submitting the document: {str(e)}")
+
+# API endpoint for job queue and worker pool statistics
+@router.get("/jobs/stats")
+def job_stats():
+    return get_job_manager().stats()
+
+# API endpoint for polling a document validation job
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_validation_job(job_id: str):
+    job = await get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+# API endpoint for importing profile photos in bulk
+@router.post("/ingest/batches", response_model=IngestBatchStatus, response_model_exclude_none=True, status_code=202)
+async def submit_ingest_batch(files: List[UploadFile]):
+    """
+    Queues many profile photos, for many users, for attribute extraction.
+
+    Send JPEG/PNG files or zip/tar archives of them. Each image belongs to
+    the user named by its file, "<user_id>.jpg" or "<user_id>/<photo>.jpg";
+    a user's photos are merged into one set of characteristics. Poll
+    GET /ingest/batches/{batch_id} for per-item status.
+    """
+    manager = get_ingest_manager()
+    try:
+        manifest = await run_in_threadpool(
+            manager.stage_batch, [(file.filename, file.content_type, file.file) for file in files]
+        )
+        return await manager.start(manifest)
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error submitting the batch: {str(e)}")
+
+# API endpoint for polling an ingest batch
+@router.get("/ingest/batches/{batch_id}", response_model=IngestBatchStatus, response_model_exclude_none=True)
+async def get_ingest_batch(batch_id: str, items: bool = False):
+    batch = await get_ingest_manager().get(batch_id, include_items=items)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return batch
+
+# API endpoint for re-running the items of a batch that did not make it
+@router.post("/ingest/batches/{batch_id}/resume", response_model=IngestBatchStatus, response_model_exclude_none=True, status_code=202)
+async def resume_ingest_batch(batch_id: str):
+    try:
+        batch = await get_ingest_manager().resume(batch_id)
+    except IngestBatchRunningError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return batch
+
 # API endpoint for generating responses
 @router.post("/generate-response", response_model=List[str])
-def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest, response: Response, background_tasks: BackgroundTasks):
     """
     Responds to user's question, potentially including document links.
+
+    Every answer belongs to a conversation session whose ID is returned in
+    the X-Session-Id header; sending it back as "session_id" continues the
+    conversation with its history.
+
+    With "stream": true the answer is sent as server-sent events, one
+    "data:" event per token chunk, followed by "data: [DONE]".
     """
+    sessions = get_session_manager()
+    session = await run_in_threadpool(sessions.open, request.session_id, request.gender)
+    session_id = session["session_id"]
+    history = sessions.history_messages(session)
+
+    if request.stream:
+        # Waits for the first token, so failures before it get a proper status instead of an in-band error
+        tokens = await open_response_stream(request.dict(), history)
+        answer: List[str] = []
+        return StreamingResponse(
+            _sse_events(tokens, answer),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Session-Id": session_id},
+            # Runs once the stream is finished; the collected answer is empty if it failed
+            background=BackgroundTask(_finish_turn, session_id, request.question, answer),
+        )
+
     try:
-        response = generate_response(request.dict())
-        return [response]
+        answer = await run_in_threadpool(generate_response, request.dict(), history)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing the request: {str(e)}")
+    response.headers["X-Session-Id"] = session_id
+    # History is updated and compacted after the response has been sent
+    background_tasks.add_task(_finish_turn, session_id, request.question, answer)
+    return [answer]
+
+
+def _finish_turn(session_id: str, question: str, answer):
+    if isinstance(answer, list):
+        answer = "".join(answer)
+    if not answer:
+        return
+    sessions = get_session_manager()
+    if sessions.record_turn(session_id, question, answer) is not None:
+        sessions.compact(session_id, summarize_conversation)
+
+
+async def _sse_events(tokens, answer: Optional[List[str]] = None):
+    collected = []
+    try:
+        async for token in tokens:
+            collected.append(token)
+            yield f"data: {json.dumps(token)}\n\n"
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        # Headers are already sent, so errors after the first token are reported in-band
+        logger.error("Error streaming response: %s", str(e))
+        yield f"event: error\ndata: {json.dumps(f'Error processing the request: {str(e)}')}\n\n"
+        return
+    if answer is not None:
+        answer.extend(collected)
+
+
+@router.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    """Forgets a conversation session and its history."""
+    await run_in_threadpool(get_session_manager().delete, session_id)
+    return Response(status_code=204)
+
+# API endpoint for ranking the whole population against one user
+@router.post("/match/top-k", response_model=List[MatchCandidate])
+async def match_top_k(request: MatchRequest):
+    """
+    Returns the best matching users, scored in a single vectorized pass.
+    """
+    # NumPy is only loaded once matching is actually used
+    from api.services.matching_service import find_top_matches
+    from api.services.match_list_service import MATCH_LISTS_ENABLED, get_fresh_match_list
+
+    try:
+        # Plain requests are served from the materialized list when it is up to date with the profile
+        if MATCH_LISTS_ENABLED and not (request.intentions or request.preferences or request.explain):
+            candidates = await get_fresh_match_list(request.user_id, request.k)
+            if candidates is not None:
+                return candidates
+
+        return await find_top_matches(
+            request.user_id,
+            intentions=request.intentions,
+            preferences=request.preferences,
+            k=request.k,
+            explain=request.explain,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error matching users: {str(e)}")
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Union
+from api.utils.metrics import REGISTRY, sample_lines
+
+logger = logging.getLogger(__name__)
+
+# Vision result cache settings
+VISION_CACHE_ENABLED = os.getenv("VISION_CACHE_ENABLED", "true").lower() == "true"
+VISION_CACHE_TTL_SECONDS = int(os.getenv("VISION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+VISION_CACHE_MEMORY_BYTES = int(os.getenv("VISION_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+# Shared by every uvicorn worker on the host; set to an empty string to keep the cache in memory only
+VISION_CACHE_PATH = os.getenv("VISION_CACHE_PATH", "vision_cache.sqlite3")
+
+
+def make_cache_key(*parts: Union[str, Iterable[bytes]]) -> str:
+    """
+    Builds a content-addressed key from the given parts.
+
+    A part can also be an iterable of byte chunks, hashed as it is produced,
+    so large payloads need not be joined into one string first.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(part.encode("utf-8"))
+        else:
+            for chunk in part:
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for upstream results: an in-process LRU bounded by the
+    total size of stored values, backed by an optional SQLite file.
+
+    Values are strings (serialized results). Entries expire after ttl_seconds
+    in both tiers.
+    """
+
+    def __init__(self, path: Optional[str], max_memory_bytes: int, ttl_seconds: int):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (value, expires_at), least recently used first
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                self._remove_from_memory(key)
+                self._stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._store_in_memory(key, value, expires_at)
+                        self._stats["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store_in_memory(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+
+    def purge_expired(self) -> int:
+        """Drops expired entries from the disk tier; returns how many were removed."""
+        if self._db is None:
+            return 0
+        with self._lock:
+            return self._db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, memory_entries=len(self._memory), memory_bytes=self._memory_bytes)
+
+    def _store_in_memory(self, key: str, value: str, expires_at: float) -> None:
+        size = len(value)
+        if size > self.max_memory_bytes:
+            return
+        self._remove_from_memory(key)
+        self._memory[key] = (value, expires_at)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            evicted_key, (evicted_value, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted_value)
+            self._stats["evictions"] += 1
+
+    def _remove_from_memory(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0])
+
+
+_vision_cache: Optional[ResultCache] = None
+_vision_cache_lock = threading.Lock()
+
+
+def get_vision_cache() -> Optional[ResultCache]:
+    """Returns the shared vision result cache, or None when caching is disabled."""
+    global _vision_cache
+    if not VISION_CACHE_ENABLED:
+        return None
+    if _vision_cache is None:
+        with _vision_cache_lock:
+            if _vision_cache is None:
+                try:
+                    _vision_cache = ResultCache(VISION_CACHE_PATH, VISION_CACHE_MEMORY_BYTES, VISION_CACHE_TTL_SECONDS)
+                except sqlite3.Error as e:
+                    logger.warning("Vision cache disk tier unavailable, using memory only: %s", str(e))
+                    _vision_cache = ResultCache(None, VISION_CACHE_MEMORY_BYTES, VISION_CACHE_TTL_SECONDS)
+    return _vision_cache
+
+
+def _collect_vision_cache_metrics() -> List[str]:
+    cache = _vision_cache
+    if cache is None:
+        return []
+    stats = cache.stats()
+    events = {key: stats[key] for key in ("memory_hits", "disk_hits", "misses", "evictions", "expired")}
+    return (
+        sample_lines("app_vision_cache_events_total", "Vision cache events since worker start.", events, "event", "counter")
+        + sample_lines(
+            "app_vision_cache_memory",
+            "Vision cache memory tier occupancy.",
+            {"entries": stats["memory_entries"], "bytes": stats["memory_bytes"]},
+            "unit",
+        )
+    )
+
+
+REGISTRY.add_collector(_collect_vision_cache_metrics)
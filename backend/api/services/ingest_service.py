@@ -0,0 +1,626 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+from collections import defaultdict
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from api.services.job_service import JOB_CPU_WORKERS, get_job_manager
+from api.utils.image_utils import COPY_CHUNK_SIZE, MAX_UPLOAD_BYTES, ResourceLimitError, preprocess_image_path, upload_size
+from api.utils.metrics import REGISTRY, clear_request_timings, record_payload, sample_lines, track_stage
+
+logger = logging.getLogger(__name__)
+
+# Batch ingestion settings
+INGEST_WORK_DIR = os.getenv("INGEST_WORK_DIR", os.path.join(tempfile.gettempdir(), "ai_date_ingest"))
+INGEST_MAX_ITEMS = int(os.getenv("INGEST_MAX_ITEMS", "5000"))
+INGEST_MAX_UPLOAD_BYTES = int(os.getenv("INGEST_MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Capacity of each queue between pipeline stages; bounds the images held in memory per batch
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+INGEST_PREPROCESS_WORKERS = int(os.getenv("INGEST_PREPROCESS_WORKERS", str(JOB_CPU_WORKERS)))
+# Vision calls in flight across all batches. Ingest has its own cap, below VISION_GLOBAL_CONCURRENCY,
+# so a large batch leaves upstream capacity for interactive uploads
+INGEST_VISION_CONCURRENCY = int(os.getenv("INGEST_VISION_CONCURRENCY", "2"))
+# Users are written to MongoDB in one bulk write per this many, or per interval, whichever comes first
+INGEST_PERSIST_BATCH = int(os.getenv("INGEST_PERSIST_BATCH", "200"))
+INGEST_PERSIST_INTERVAL_SECONDS = float(os.getenv("INGEST_PERSIST_INTERVAL_SECONDS", "1.0"))
+INGEST_CONCURRENT_BATCHES = int(os.getenv("INGEST_CONCURRENT_BATCHES", "1"))
+INGEST_BATCH_TTL_SECONDS = int(os.getenv("INGEST_BATCH_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Item states, in pipeline order
+PENDING, PREPROCESSED, EXTRACTED, SAVED, FAILED = "pending", "preprocessed", "extracted", "saved", "failed"
+# Batch states
+QUEUED, RUNNING, SUCCEEDED, COMPLETED_WITH_ERRORS, INTERRUPTED = "queued", "running", "succeeded", "completed_with_errors", "interrupted"
+
+IMAGE_EXTENSIONS = {".jpg": ".jpg", ".jpeg": ".jpg", ".png": ".png"}
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+ARCHIVE_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed", "application/x-tar", "application/gzip", "application/x-gzip"}
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.@-]{1,128}$")
+BATCH_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+MANIFEST_NAME = "manifest.json"
+CLAIM_NAME = "run.lock"
+
+
+class IngestBatchRunningError(RuntimeError):
+    """Raised when resuming a batch that is still running, in this worker or another one."""
+
+
+def user_id_for(name: str) -> Optional[str]:
+    """
+    Derives the user an image belongs to from its name.
+
+    "<user_id>.jpg" holds one photo; "<user_id>/<any name>.jpg" lets a user
+    have several, whose attributes are merged.
+    """
+    parts = [part for part in name.replace("\\", "/").split("/") if part]
+    if not parts:
+        return None
+    user_id = parts[-2] if len(parts) >= 2 else os.path.splitext(parts[-1])[0]
+    return user_id if USER_ID_PATTERN.match(user_id) else None
+
+
+def is_archive(filename: Optional[str], content_type: Optional[str]) -> bool:
+    return (filename or "").lower().endswith(ARCHIVE_SUFFIXES) or content_type in ARCHIVE_CONTENT_TYPES
+
+
+def _skipped_member(name: str) -> bool:
+    # Directory entries are filtered by the callers; these are archiver metadata
+    return any(part.startswith(".") or part == "__MACOSX" for part in name.split("/"))
+
+
+def _copy_limited(source: BinaryIO, path: str, limit: int) -> int:
+    """Copies source to path in chunks, raising ResourceLimitError past limit bytes."""
+    written = 0
+    with open(path, "wb") as destination:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > limit:
+                raise ResourceLimitError(f"Image is larger than the {limit} byte limit.")
+            destination.write(chunk)
+    return written
+
+
+def _write_manifest(batch_dir: str, text: str) -> None:
+    # Written to a temporary file and renamed, so a crash never leaves a torn manifest
+    temporary = os.path.join(batch_dir, MANIFEST_NAME + ".tmp")
+    with open(temporary, "w") as manifest_file:
+        manifest_file.write(text)
+    os.replace(temporary, os.path.join(batch_dir, MANIFEST_NAME))
+
+
+def _read_manifest(batch_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(batch_dir, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _claim_batch(batch_dir: str) -> Optional[int]:
+    """
+    Takes a batch's run claim: an exclusive flock on a file in its directory.
+
+    Every worker sharing INGEST_WORK_DIR sees the same lock, and the kernel
+    drops it if the worker holding it dies, so a crashed run never blocks a
+    resume. Closing the returned descriptor releases the claim.
+
+    :return: The claim's file descriptor, or None if the batch directory does not exist
+    :raises IngestBatchRunningError: If another run holds the claim
+    """
+    try:
+        fd = os.open(os.path.join(batch_dir, CLAIM_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise IngestBatchRunningError(f"Batch {os.path.basename(batch_dir)} is still running.")
+    return fd
+
+
+def summarize_batch(manifest: dict, include_items: bool = False) -> dict:
+    """Status of a batch: per-state item counts, latest run throughput and optionally every item."""
+    counts = {state: 0 for state in (PENDING, PREPROCESSED, EXTRACTED, SAVED, FAILED)}
+    for item in manifest["items"]:
+        counts[item["status"]] += 1
+    counts["total"] = len(manifest["items"])
+    run = manifest.get("run") or {}
+    images_per_second = None
+    if run.get("finished_at") and run.get("images"):
+        images_per_second = round(run["images"] / max(run["finished_at"] - run["started_at"], 1e-9), 2)
+    summary = {
+        "batch_id": manifest["batch_id"],
+        "status": manifest["status"],
+        "created_at": manifest["created_at"],
+        "updated_at": manifest["updated_at"],
+        "counts": counts,
+        "images_per_second": images_per_second,
+    }
+    if include_items:
+        summary["items"] = [
+            {key: item.get(key) for key in ("item_id", "name", "user_id", "status", "error")}
+            for item in manifest["items"]
+        ]
+    return summary
+
+
+class IngestManager:
+    """
+    Imports profile photos in bulk: many files per request, for many users.
+
+    Uploads are unpacked into a per-batch directory next to a JSON manifest
+    that records every item's state. A batch then runs as a pipeline of
+    stages joined by bounded queues:
+
+        preprocess (process pool) -> vision extraction -> persist
+
+    Decoding and preprocessing run together in the job manager's process
+    pool, vision calls run concurrently on the event loop under ingest's own
+    concurrency cap (not the one interactive uploads use), and users are upserted in bulk writes once all of their photos
+    are extracted. The queues keep at most a few images per stage in memory,
+    so a slow stage holds the earlier ones back instead of letting work pile
+    up. A failed item is marked in the manifest and the batch carries on;
+    resuming a batch re-runs only the items that did not make it. A batch
+    runs in one worker at a time: each run holds a claim on the batch
+    directory, so a resume sent to another worker is refused while it runs.
+    """
+
+    def __init__(
+        self,
+        work_dir: str,
+        queue_size: int,
+        preprocess_workers: int,
+        vision_concurrency: int,
+        persist_batch: int,
+        persist_interval: float,
+        concurrent_batches: int,
+        ttl_seconds: int,
+        persist: Optional[Callable[[Dict[str, dict]], Awaitable[int]]] = None,
+    ):
+        self.work_dir = work_dir
+        self.queue_size = queue_size
+        self.preprocess_workers = preprocess_workers
+        self.vision_concurrency = vision_concurrency
+        self.persist_batch = persist_batch
+        self.persist_interval = persist_interval
+        self.concurrent_batches = concurrent_batches
+        self.ttl_seconds = ttl_seconds
+        self._persist = persist
+        # Manifests of the batches queued or running in this worker; finished ones are read from disk
+        self._batches: Dict[str, dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Run claims held by this worker, released when the batch's run ends
+        self._claims: Dict[str, int] = {}
+        self._queues: Dict[str, Tuple[asyncio.Queue, ...]] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._vision_slots: Optional[asyncio.Semaphore] = None
+        os.makedirs(work_dir, exist_ok=True)
+
+    def stage_batch(self, uploads: List[Tuple[Optional[str], Optional[str], BinaryIO]]) -> dict:
+        """
+        Unpacks uploaded images and archives into a new batch directory.
+
+        Blocking; run it in the threadpool.
+
+        :param uploads: (filename, content_type, file) of each uploaded part
+        :return: The batch manifest, with every item pending or failed
+        """
+        self._expire_batches()
+        batch_id = uuid.uuid4().hex
+        batch_dir = os.path.join(self.work_dir, batch_id)
+        os.makedirs(os.path.join(batch_dir, "items"))
+        items: List[dict] = []
+        try:
+            total = sum(upload_size(file) for _, _, file in uploads)
+            record_payload("ingest_upload", total)
+            if total > INGEST_MAX_UPLOAD_BYTES:
+                raise ResourceLimitError(f"Upload of {total} bytes exceeds the {INGEST_MAX_UPLOAD_BYTES} byte limit.")
+            # Archives are counted by what they unpack to, so a small zip cannot fill the disk
+            staged = 0
+            with track_stage("ingest_stage"):
+                for filename, content_type, file in uploads:
+                    if is_archive(filename, content_type):
+                        for name, member in _archive_members(file, filename or ""):
+                            staged += self._stage_item(batch_dir, items, name, member, INGEST_MAX_UPLOAD_BYTES - staged)
+                    else:
+                        staged += self._stage_item(batch_dir, items, filename or "", file, INGEST_MAX_UPLOAD_BYTES - staged)
+            record_payload("ingest_staged", staged)
+        except Exception:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            raise
+
+        now = time.time()
+        manifest = {"batch_id": batch_id, "status": QUEUED, "created_at": now, "updated_at": now, "run": None, "items": items}
+        _write_manifest(batch_dir, json.dumps(manifest))
+        logger.info("Staged ingest batch %s with %s items", batch_id, len(items))
+        return manifest
+
+    def _stage_item(self, batch_dir: str, items: List[dict], name: str, source: BinaryIO, budget: int) -> int:
+        """
+        Adds one image to the batch, or a failed item if it cannot be used.
+
+        :param budget: Bytes the batch may still unpack; running past it fails the whole batch
+        :return: Bytes written for the item
+        """
+        if len(items) >= INGEST_MAX_ITEMS:
+            raise ResourceLimitError(f"Batch has more than {INGEST_MAX_ITEMS} items.")
+        item = {"item_id": len(items), "name": name, "user_id": user_id_for(name), "path": None, "status": PENDING, "error": None, "attributes": None}
+        items.append(item)
+        extension = IMAGE_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+        if extension is None:
+            item.update(status=FAILED, error="Unsupported file type. Only JPEG and PNG images are allowed.")
+            return 0
+        if item["user_id"] is None:
+            item.update(status=FAILED, error="Cannot derive a user ID; name files <user_id>.jpg or <user_id>/<photo>.jpg.")
+            return 0
+        # Stored under a generated name; archive member names are never used as paths
+        path = os.path.join("items", f"{item['item_id']:06d}{extension}")
+        try:
+            written = _copy_limited(source, os.path.join(batch_dir, path), min(MAX_UPLOAD_BYTES, budget))
+        except ResourceLimitError as e:
+            os.remove(os.path.join(batch_dir, path))
+            if budget <= MAX_UPLOAD_BYTES:
+                raise ResourceLimitError(f"Batch unpacks to more than the {INGEST_MAX_UPLOAD_BYTES} byte limit.")
+            item.update(status=FAILED, error=str(e))
+            return 0
+        item["path"] = path
+        return written
+
+    def _expire_batches(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for batch_id in os.listdir(self.work_dir):
+            if batch_id in self._tasks:
+                continue
+            batch_dir = os.path.join(self.work_dir, batch_id)
+            manifest = _read_manifest(batch_dir)
+            if manifest is None or manifest["updated_at"] < cutoff:
+                # A directory without a manifest is a staging that crashed, unless it is still being staged
+                if manifest is None and os.path.getmtime(batch_dir) > cutoff:
+                    continue
+                # Batches running in another worker are left alone
+                try:
+                    claim = _claim_batch(batch_dir) if manifest is not None else None
+                except IngestBatchRunningError:
+                    continue
+                shutil.rmtree(batch_dir, ignore_errors=True)
+                if claim is not None:
+                    os.close(claim)
+
+    async def start(self, manifest: dict, claim: Optional[int] = None) -> dict:
+        """
+        Queues a staged batch to run in this worker and returns its status.
+
+        :param claim: The batch's run claim if the caller already holds it; otherwise it is taken here
+        """
+        batch_id = manifest["batch_id"]
+        if batch_id in self._tasks:
+            raise IngestBatchRunningError(f"Batch {batch_id} is already running.")
+        if claim is None:
+            claim = await asyncio.to_thread(_claim_batch, os.path.join(self.work_dir, batch_id))
+            if claim is None:
+                raise ValueError(f"Batch {batch_id} has no staging directory.")
+        self._claims[batch_id] = claim
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrent_batches)
+            self._vision_slots = asyncio.Semaphore(self.vision_concurrency)
+        manifest.update(status=QUEUED, updated_at=time.time())
+        self._batches[batch_id] = manifest
+        self._tasks[batch_id] = asyncio.create_task(self._run(manifest))
+        return summarize_batch(manifest)
+
+    async def get(self, batch_id: str, include_items: bool = False) -> Optional[dict]:
+        manifest = self._batches.get(batch_id)
+        if manifest is None:
+            manifest = await asyncio.to_thread(self._load, batch_id)
+        return summarize_batch(manifest, include_items) if manifest else None
+
+    async def resume(self, batch_id: str) -> Optional[dict]:
+        """
+        Runs a batch again, skipping every item already saved.
+
+        :return: The batch status, or None if the batch is unknown or expired
+        """
+        if batch_id in self._tasks:
+            raise IngestBatchRunningError(f"Batch {batch_id} is still running.")
+        if not BATCH_ID_PATTERN.match(batch_id):
+            return None
+        # Claimed before the manifest is read, so the state it resumes from is the last run's final one
+        claim = await asyncio.to_thread(_claim_batch, os.path.join(self.work_dir, batch_id))
+        if claim is None:
+            return None
+        manifest = await asyncio.to_thread(self._load, batch_id)
+        if manifest is None:
+            os.close(claim)
+            return None
+        return await self.start(manifest, claim)
+
+    def _load(self, batch_id: str) -> Optional[dict]:
+        if not BATCH_ID_PATTERN.match(batch_id):
+            return None
+        return _read_manifest(os.path.join(self.work_dir, batch_id))
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "batches": len(self._tasks),
+            "preprocess_queue": 0,
+            "vision_queue": 0,
+            "persist_queue": 0,
+        }
+        for queues in list(self._queues.values()):
+            for name, queue in zip(("preprocess_queue", "vision_queue", "persist_queue"), queues):
+                stats[name] += queue.qsize()
+        return stats
+
+    async def shutdown(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _save_manifest(self, manifest: dict) -> None:
+        manifest["updated_at"] = time.time()
+        # Serialized on the loop so the snapshot is consistent; written in a thread
+        await asyncio.to_thread(_write_manifest, os.path.join(self.work_dir, manifest["batch_id"]), json.dumps(manifest))
+
+    async def _run(self, manifest: dict) -> None:
+        batch_id = manifest["batch_id"]
+        # The batch outlives the request that started it; don't collect into its timings
+        clear_request_timings()
+        try:
+            async with self._slots:
+                manifest.update(status=RUNNING, run={"started_at": time.time(), "finished_at": None, "images": 0})
+                await self._save_manifest(manifest)
+                with track_stage("ingest_batch"):
+                    await self._pipeline(manifest)
+                manifest["run"]["finished_at"] = time.time()
+                failed = any(item["status"] != SAVED for item in manifest["items"])
+                manifest["status"] = COMPLETED_WITH_ERRORS if failed else SUCCEEDED
+        except asyncio.CancelledError:
+            manifest["status"] = INTERRUPTED
+            raise
+        except Exception as e:
+            logger.error("Ingest batch %s failed: %s", batch_id, str(e))
+            manifest["status"] = INTERRUPTED
+        finally:
+            try:
+                await asyncio.shield(self._save_manifest(manifest))
+            finally:
+                self._tasks.pop(batch_id, None)
+                self._batches.pop(batch_id, None)
+                self._queues.pop(batch_id, None)
+                claim = self._claims.pop(batch_id, None)
+                if claim is not None:
+                    os.close(claim)
+            summary = summarize_batch(manifest)
+            logger.info(
+                "Ingest batch %s %s: %s (%s images/s)",
+                batch_id, manifest["status"], summary["counts"], summary["images_per_second"],
+            )
+
+    async def _pipeline(self, manifest: dict) -> None:
+        from api.services.openai_service import (
+            LOCAL_REJECT_PHOTO_KINDS,
+            LocalVisionResult,
+            build_document_context,
+            extract_image_async,
+        )
+        from api.models.document_models import VisionAttributes
+
+        batch_dir = os.path.join(self.work_dir, manifest["batch_id"])
+        jobs = get_job_manager()
+        by_user: Dict[str, List[dict]] = defaultdict(list)
+        for item in manifest["items"]:
+            if item["user_id"] is not None:
+                by_user[item["user_id"]].append(item)
+
+        # Items still needing extraction; failures without a staged file (bad type or name) are final
+        to_run = [item for item in manifest["items"] if item["status"] in (PENDING, PREPROCESSED, FAILED) and item["path"]]
+        remaining: Dict[str, int] = defaultdict(int)
+        for item in to_run:
+            item.update(status=PENDING, error=None)
+            remaining[item["user_id"]] += 1
+        # Users with extracted but unsaved items go straight to the persist stage
+        unsaved = {item["user_id"] for item in manifest["items"] if item["status"] == EXTRACTED}
+        manifest["run"]["images"] = len(to_run)
+
+        preprocess_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        vision_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        persist_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues[manifest["batch_id"]] = (preprocess_queue, vision_queue, persist_queue)
+
+        async def finish_item(item: dict) -> None:
+            remaining[item["user_id"]] -= 1
+            if remaining[item["user_id"]] == 0:
+                await persist_queue.put(item["user_id"])
+
+        async def fail_item(item: dict, e: Exception) -> None:
+            item.update(status=FAILED, error=getattr(e, "detail", None) or str(e))
+            await finish_item(item)
+
+        async def produce() -> None:
+            for user_id in unsaved - set(remaining):
+                await persist_queue.put(user_id)
+            for item in to_run:
+                await preprocess_queue.put(item)
+
+        async def preprocess_worker() -> None:
+            while (item := await preprocess_queue.get()) is not None:
+                try:
+                    with track_stage("ingest_preprocess"):
+                        image = await jobs.run_in_pool(preprocess_image_path, os.path.join(batch_dir, item["path"]))
+                except Exception as e:
+                    await fail_item(item, e)
+                    continue
+                item["status"] = PREPROCESSED
+                await vision_queue.put((item, image))
+
+        async def vision_worker() -> None:
+            while (entry := await vision_queue.get()) is not None:
+                item, image = entry
+                del entry
+                try:
+                    with track_stage("ingest_vision"):
+                        result = await extract_image_async(image, LOCAL_REJECT_PHOTO_KINDS, self._vision_slots)
+                    # Blank, tiny and non-photo uploads are rejected on the CPU, without a vision call
+                    if isinstance(result, LocalVisionResult):
+                        raise ValueError(result.reason)
+                    context = build_document_context([result])
+                    if context.notes:
+                        raise ValueError(f"Vision output had no attributes: {context.notes[0]}")
+                except Exception as e:
+                    await fail_item(item, e)
+                    continue
+                finally:
+                    del image
+                item.update(status=EXTRACTED, attributes=context.attributes.model_dump(exclude_none=True))
+                await finish_item(item)
+
+        async def persist_worker() -> None:
+            done = False
+            while not done:
+                user_id = await persist_queue.get()
+                if user_id is None:
+                    break
+                users = [user_id]
+                deadline = time.monotonic() + self.persist_interval
+                # Collects a bulk write's worth of users, or whatever arrived within the interval
+                while len(users) < self.persist_batch:
+                    try:
+                        user_id = await asyncio.wait_for(persist_queue.get(), max(0.0, deadline - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        break
+                    if user_id is None:
+                        done = True
+                        break
+                    users.append(user_id)
+                await persist_users(users)
+
+        async def persist_users(users: List[str]) -> None:
+            characteristics_by_user = {}
+            for user_id in users:
+                extracted = [item for item in by_user[user_id] if item["status"] in (EXTRACTED, SAVED) and item["attributes"] is not None]
+                if extracted:
+                    pages = [VisionAttributes.model_validate(item["attributes"]) for item in extracted]
+                    characteristics_by_user[user_id] = VisionAttributes.merge(pages).model_dump(exclude_none=True)
+            if characteristics_by_user:
+                try:
+                    with track_stage("ingest_persist"):
+                        await self._save_many(characteristics_by_user)
+                except Exception as e:
+                    logger.error("Saving %s ingested users failed: %s", len(characteristics_by_user), str(e))
+                    for user_id in characteristics_by_user:
+                        for item in by_user[user_id]:
+                            if item["status"] == EXTRACTED:
+                                item["error"] = f"Error saving characteristics to DB: {str(e)}"
+                    await self._save_manifest(manifest)
+                    return
+                for user_id in characteristics_by_user:
+                    for item in by_user[user_id]:
+                        if item["status"] == EXTRACTED:
+                            item.update(status=SAVED, error=None)
+                            # Saved photos are not needed to resume the batch
+                            try:
+                                os.remove(os.path.join(batch_dir, item["path"]))
+                            except OSError:
+                                pass
+            await self._save_manifest(manifest)
+
+        async def close_stage(workers: List[asyncio.Task], next_queue: asyncio.Queue, next_workers: int) -> None:
+            await asyncio.gather(*workers)
+            for _ in range(next_workers):
+                await next_queue.put(None)
+
+        preprocess_workers = [asyncio.create_task(preprocess_worker()) for _ in range(self.preprocess_workers)]
+        vision_workers = [asyncio.create_task(vision_worker()) for _ in range(self.vision_concurrency)]
+        persister = asyncio.create_task(persist_worker())
+        producer = asyncio.create_task(produce())
+        stages = [
+            producer, *preprocess_workers, *vision_workers, persister,
+            asyncio.create_task(close_stage([producer], preprocess_queue, len(preprocess_workers))),
+            asyncio.create_task(close_stage(preprocess_workers, vision_queue, len(vision_workers))),
+            asyncio.create_task(close_stage(vision_workers, persist_queue, 1)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+
+    async def _save_many(self, characteristics_by_user: Dict[str, dict]) -> int:
+        if self._persist is not None:
+            return await self._persist(characteristics_by_user)
+        from api.services.user_repository import get_user_repository
+
+        repository = await get_user_repository()
+        return await repository.save_many(characteristics_by_user)
+
+
+def _archive_members(file: BinaryIO, filename: str):
+    """Yields (name, file) for every regular file in a zip or tar archive, in archive order."""
+    file.seek(0)
+    if filename.lower().endswith(".zip") or zipfile.is_zipfile(file):
+        file.seek(0)
+        try:
+            with zipfile.ZipFile(file) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or _skipped_member(info.filename):
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Error reading zip archive: {e}")
+        return
+    file.seek(0)
+    try:
+        # Stream mode reads the archive front to back without seeking
+        with tarfile.open(fileobj=file, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or _skipped_member(member.name):
+                    continue
+                yield member.name, archive.extractfile(member)
+    except tarfile.TarError as e:
+        raise ValueError(f"Error reading tar archive: {e}")
+
+
+_ingest_manager: Optional[IngestManager] = None
+
+
+def get_ingest_manager() -> IngestManager:
+    """Returns the worker's ingest manager."""
+    global _ingest_manager
+    if _ingest_manager is None:
+        _ingest_manager = IngestManager(
+            INGEST_WORK_DIR, INGEST_QUEUE_SIZE, INGEST_PREPROCESS_WORKERS, INGEST_VISION_CONCURRENCY,
+            INGEST_PERSIST_BATCH, INGEST_PERSIST_INTERVAL_SECONDS, INGEST_CONCURRENT_BATCHES, INGEST_BATCH_TTL_SECONDS,
+        )
+    return _ingest_manager
+
+
+async def shutdown_ingest_manager() -> None:
+    global _ingest_manager
+    if _ingest_manager is not None:
+        await _ingest_manager.shutdown()
+    _ingest_manager = None
+
+
+def _collect_ingest_metrics() -> List[str]:
+    if _ingest_manager is None:
+        return []
+    return sample_lines("app_ingest", "Batch ingestion pipeline state.", _ingest_manager.stats(), "stat")
+
+
+REGISTRY.add_collector(_collect_ingest_metrics)
@@ -0,0 +1,385 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from api.utils.image_utils import count_pdf_pages, preprocess_image_path, render_pdf_page_preprocessed
+from api.utils.metrics import REGISTRY, clear_request_timings, sample_lines, track_stage
+
+logger = logging.getLogger(__name__)
+
+# Job processing settings
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "memory")  # "memory" or "sqlite"
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "100"))
+JOB_CPU_WORKERS = int(os.getenv("JOB_CPU_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Pages rendered ahead of the vision calls for one job
+JOB_PAGE_PREFETCH = int(os.getenv("JOB_PAGE_PREFETCH", "2"))
+JOB_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOB_WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Webhook targets: allowed URL schemes, and if set, the only hosts ("example.com" or "*.example.com")
+JOB_WEBHOOK_ALLOWED_SCHEMES = {scheme.strip().lower() for scheme in os.getenv("JOB_WEBHOOK_ALLOWED_SCHEMES", "https").split(",") if scheme.strip()}
+JOB_WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+SHUTDOWN_ERROR = "Interrupted by server shutdown; submit the document again."
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when the job queue is at JOB_MAX_QUEUE."""
+
+
+class WebhookURLError(ValueError):
+    """Raised when a webhook URL is not an allowed, public target."""
+
+
+class InMemoryJobStore:
+    """Job records kept in this worker's memory; expired records are dropped on write."""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: dict) -> None:
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+            cutoff = time.time() - self.ttl_seconds
+            for job_id in [job_id for job_id, record in self._jobs.items() if record["updated_at"] < cutoff]:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite file, visible to every worker on the host."""
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def save(self, job: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, data, updated_at) VALUES (?, ?, ?)",
+                (job["job_id"], json.dumps(job), job["updated_at"]),
+            )
+            self._db.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class JobManager:
+    """
+    Runs document validation jobs in the background.
+
+    Jobs wait in a bounded asyncio queue and are picked up by JOB_CONCURRENCY
+    runner tasks. CPU-bound work (PDF rasterization, image preprocessing and
+    encoding) runs in a process pool so it neither blocks the event loop nor
+    competes for the GIL with request handling; the I/O-bound model calls
+    stay on the event loop. On shutdown, jobs still running or queued are
+    marked failed, their uploads deleted and their webhooks called.
+    """
+
+    def __init__(self, store, concurrency: int, cpu_workers: int, max_queue: int):
+        self.store = store
+        self.concurrency = concurrency
+        self.cpu_workers = cpu_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_queue = max_queue
+        self._runners: List[asyncio.Task] = []
+        # Queue entries of the jobs whose runner was cancelled mid-job
+        self._interrupted: List[tuple] = []
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._running_jobs = 0
+        self._cpu_tasks_in_flight = 0
+        self._cpu_busy_seconds = 0.0
+        self._started_at = time.time()
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queue)
+        if not self._runners:
+            self._runners = [asyncio.create_task(self._run_forever()) for _ in range(self.concurrency)]
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn avoids forking a process that holds an event loop and client threads
+            self._pool = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def submit(self, kind: str, path: str, options: dict, webhook_url: Optional[str] = None) -> dict:
+        """
+        Queues a job and returns its initial record.
+
+        :param kind: "pdf" or "image"
+        :param path: Path of the uploaded file; the job deletes it when done
+        :param options: Preprocessing options (max_bytes, max_pixels, grayscale)
+        :param webhook_url: URL that receives the finished job record as a POST
+        :raises WebhookURLError: If webhook_url is not an allowed, public target
+        """
+        if webhook_url:
+            await check_webhook_url(webhook_url)
+        self._ensure_started()
+        if self._queue.full():
+            raise JobQueueFullError(f"Job queue is full ({self._max_queue} jobs).")
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+        }
+        # Stored before it is queued so a runner's "running" update cannot be overwritten
+        await asyncio.to_thread(self.store.save, job)
+        self._queue.put_nowait((job, kind, path, options, webhook_url))
+        return dict(job)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def stats(self) -> Dict[str, float]:
+        uptime = max(time.time() - self._started_at, 1e-9)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self._max_queue,
+            "running_jobs": self._running_jobs,
+            "job_runners": self.concurrency,
+            "cpu_workers": self.cpu_workers,
+            "cpu_tasks_in_flight": self._cpu_tasks_in_flight,
+            "cpu_utilization": self._cpu_busy_seconds / (uptime * self.cpu_workers),
+        }
+
+    async def shutdown(self) -> None:
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+        # Interrupted and still queued jobs are failed, so none is left "running" or "queued" with its upload on disk
+        abandoned, self._interrupted = self._interrupted, []
+        while self._queue is not None and not self._queue.empty():
+            abandoned.append(self._queue.get_nowait())
+            self._queue.task_done()
+        await asyncio.gather(*(self._abandon_job(*entry) for entry in abandoned))
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run_in_pool(self, function, *args):
+        """Runs a picklable function in the CPU process pool, counting it in the pool statistics."""
+        self._cpu_tasks_in_flight += 1
+        try:
+            result, busy_seconds = await asyncio.get_running_loop().run_in_executor(self._get_pool(), _timed_call, function, *args)
+        finally:
+            self._cpu_tasks_in_flight -= 1
+        self._cpu_busy_seconds += busy_seconds
+        return result
+
+    async def _run_forever(self) -> None:
+        # Runners outlive the request that started them; don't collect into its timings
+        clear_request_timings()
+        while True:
+            entry = await self._queue.get()
+            self._running_jobs += 1
+            try:
+                await self._run_job(*entry)
+            except asyncio.CancelledError:
+                self._interrupted.append(entry)
+                raise
+            finally:
+                self._running_jobs -= 1
+                self._queue.task_done()
+
+    async def _run_job(self, job: dict, kind: str, path: str, options: dict, webhook_url: Optional[str]) -> None:
+        job.update(status=RUNNING, updated_at=time.time())
+        await asyncio.to_thread(self.store.save, job)
+        try:
+            with track_stage("job_total"):
+                message = await self._validate(kind, path, options)
+            job.update(status=SUCCEEDED, result=message.model_dump() if hasattr(message, "model_dump") else message)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job["job_id"], str(e))
+            job.update(status=FAILED, error=getattr(e, "detail", None) or str(e))
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        job["updated_at"] = time.time()
+        await asyncio.to_thread(self.store.save, job)
+        if webhook_url:
+            await _notify_webhook(webhook_url, job)
+
+    async def _abandon_job(self, job: dict, kind: str, path: str, options: dict, webhook_url: Optional[str]) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        # A job cancelled after its outcome was stored keeps it
+        if job["status"] in (SUCCEEDED, FAILED):
+            return
+        job.update(status=FAILED, error=SHUTDOWN_ERROR, updated_at=time.time())
+        try:
+            await asyncio.to_thread(self.store.save, job)
+        except Exception as e:
+            logger.error("Saving interrupted job %s failed: %s", job["job_id"], str(e))
+        if webhook_url:
+            await _notify_webhook(webhook_url, job)
+
+    async def _validate(self, kind: str, path: str, options: dict):
+        from api.services.openai_service import (
+            process_document_with_text_model_async,
+            process_images_with_grok,
+            process_page_stream_with_grok,
+        )
+
+        if kind == "pdf":
+            page_count = await self.run_in_pool(count_pdf_pages, path)
+            results = await process_page_stream_with_grok(self._render_pages(path, page_count, options))
+        else:
+            image = await self.run_in_pool(
+                preprocess_image_path, path, None, options.get("max_bytes"), options.get("max_pixels"), options.get("grayscale", False)
+            )
+            results = await process_images_with_grok([image])
+        return await process_document_with_text_model_async(results)
+
+    async def _render_pages(self, path: str, page_count: int, options: dict):
+        """Yields preprocessed pages in order while up to JOB_PAGE_PREFETCH more render in the pool."""
+        pending = deque()
+        next_page = 1
+        try:
+            while next_page <= page_count or pending:
+                while next_page <= page_count and len(pending) < JOB_PAGE_PREFETCH:
+                    pending.append(asyncio.ensure_future(self.run_in_pool(
+                        render_pdf_page_preprocessed, path, next_page, None,
+                        options.get("max_bytes"), options.get("max_pixels"), options.get("grayscale"),
+                    )))
+                    next_page += 1
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _timed_call(function, *args):
+    """Runs in a pool worker; the time is measured there, so waiting in the executor queue is not counted as busy."""
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def _host_allowed(host: str) -> bool:
+    if not JOB_WEBHOOK_ALLOWED_HOSTS:
+        return True
+    for allowed in JOB_WEBHOOK_ALLOWED_HOSTS:
+        if allowed.startswith("*.") and host.endswith(allowed[1:]):
+            return True
+        if host == allowed:
+            return True
+    return False
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None):
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_webhook_url(url: str) -> None:
+    """
+    Checks that a webhook URL may be called from this server.
+
+    The scheme must be in JOB_WEBHOOK_ALLOWED_SCHEMES, the host must match
+    JOB_WEBHOOK_ALLOWED_HOSTS when it is set, and every address the host
+    resolves to must be public: loopback, private, link-local (including
+    cloud metadata endpoints) and other reserved ranges are rejected.
+
+    :param url: Caller-supplied webhook URL
+    :raises WebhookURLError: If the URL is not an allowed target
+    """
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError as e:
+        raise WebhookURLError(f"Invalid webhook URL: {e}")
+    scheme = parts.scheme.lower()
+    if scheme not in JOB_WEBHOOK_ALLOWED_SCHEMES:
+        raise WebhookURLError(f"Webhook URL scheme must be one of: {', '.join(sorted(JOB_WEBHOOK_ALLOWED_SCHEMES))}.")
+    if not host:
+        raise WebhookURLError("Webhook URL has no host.")
+    if parts.username or parts.password:
+        raise WebhookURLError("Webhook URL must not contain credentials.")
+    if not _host_allowed(host.lower()):
+        raise WebhookURLError(f"Webhook host {host} is not allowed.")
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port or (443 if scheme == "https" else 80))
+    except OSError as e:
+        raise WebhookURLError(f"Webhook host {host} cannot be resolved: {e}")
+    if not addresses or not all(_is_public_address(address[4][0]) for address in addresses):
+        raise WebhookURLError(f"Webhook host {host} resolves to a private or reserved address.")
+
+
+async def _notify_webhook(url: str, job: dict) -> None:
+    import httpx
+
+    try:
+        # Checked again at delivery, since DNS may have changed since the job was submitted
+        await check_webhook_url(url)
+        async with httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT_SECONDS, follow_redirects=False) as client:
+            await client.post(url, json=job)
+    except Exception as e:
+        logger.warning("Webhook delivery for job %s failed: %s", job["job_id"], str(e))
+
+
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """Returns the worker's job manager, creating the configured store on first use."""
+    global _job_manager
+    if _job_manager is None:
+        if JOB_STORE_BACKEND == "sqlite":
+            store = SQLiteJobStore(JOB_STORE_PATH, JOB_RESULT_TTL_SECONDS)
+        else:
+            store = InMemoryJobStore(JOB_RESULT_TTL_SECONDS)
+        _job_manager = JobManager(store, JOB_CONCURRENCY, JOB_CPU_WORKERS, JOB_MAX_QUEUE)
+    return _job_manager
+
+
+async def shutdown_job_manager() -> None:
+    global _job_manager
+    if _job_manager is not None:
+        await _job_manager.shutdown()
+    _job_manager = None
+
+
+def _collect_job_metrics() -> List[str]:
+    if _job_manager is None:
+        return []
+    return sample_lines("app_job_pool", "Job queue and worker pool state.", _job_manager.stats(), "stat")
+
+
+REGISTRY.add_collector(_collect_job_metrics)
@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from api.services.matching_service import MATCH_WEIGHTS, ProfileIndex, stored_intentions
+from api.utils.metrics import REGISTRY, STAGE_DURATION, sample_lines, track_stage
+
+logger = logging.getLogger(__name__)
+
+# Serve /match/top-k from materialized top-K match lists. Off by default, like the maintainer that writes
+# them: without a maintainer no list is ever written and every lookup would be a wasted round trip.
+# To enable, set this on every API worker and MATCH_LISTS_MAINTAINER on exactly one process
+MATCH_LISTS_ENABLED = os.getenv("MATCH_LISTS_ENABLED", "false").lower() == "true"
+# Run the maintainer (index, incremental updates, reconciler) in this process. Only one process of the
+# deployment may run it (one API worker, or a dedicated one), since every maintainer holds the whole
+# profile index in memory and rewrites the same lists
+MATCH_LISTS_MAINTAINER = os.getenv("MATCH_LISTS_MAINTAINER", "false").lower() == "true"
+MATCH_LISTS_COLLECTION = os.getenv("MATCH_LISTS_COLLECTION", "match_lists")
+MATCH_LIST_SIZE = int(os.getenv("MATCH_LIST_SIZE", "20"))
+MATCH_RECONCILE_INTERVAL_SECONDS = float(os.getenv("MATCH_RECONCILE_INTERVAL_SECONDS", "30"))
+# Lists recomputed per reconciler pass, so pending updates are never blocked for long
+MATCH_RECONCILE_BATCH = int(os.getenv("MATCH_RECONCILE_BATCH", "500"))
+# Writes are re-read this far behind the reconciler's watermark to cover commits that landed late
+MATCH_RECONCILE_OVERLAP_SECONDS = float(os.getenv("MATCH_RECONCILE_OVERLAP_SECONDS", "5"))
+MATCH_UPDATE_BATCH = 256
+
+PROFILE_PROJECTION = {"_id": 0, "user_id": 1, "characteristics": 1, "intentions": 1, "characteristics_updated_at": 1}
+
+
+class MatchLists:
+    """
+    Top-K candidate lists for every user, kept current as profiles change.
+
+    When a profile changes, its own list is recomputed with one top-K query
+    and its score from every other user's point of view comes from one
+    reverse_scores pass. Only lists it now enters, or was already on, are
+    touched; per-list thresholds (the lowest listed score) make finding them
+    a single vectorized comparison. If a listed candidate's score drops below
+    the rest of the list, the best outsider is unknown: the list keeps the
+    candidate at the end and is marked dirty for the reconciler.
+    """
+
+    def __init__(self, index: ProfileIndex, size: int = MATCH_LIST_SIZE, weights: Optional[Dict[str, float]] = None):
+        self.index = index
+        self.size = size
+        self.weights = weights or MATCH_WEIGHTS
+        self.lists: Dict[str, List[Tuple[str, float]]] = {}
+        # Lowest listed score per row; -1 while a list is not full, inf while it is unknown
+        self.thresholds = np.full(len(index), np.inf, dtype=np.float32)
+        # candidate -> owners of the lists it appears on
+        self.listed_in: Dict[str, Set[str]] = {}
+        self.dirty: Set[str] = set(index.user_ids)
+
+    def get(self, user_id: str) -> Optional[List[Tuple[str, float]]]:
+        return self.lists.get(user_id)
+
+    def build_all(self) -> None:
+        """Computes every list from scratch; O(N^2), for bootstrapping and benchmarks."""
+        for user_id in list(self.index.user_ids):
+            self.recompute(user_id)
+
+    def load(self, user_id: str, candidates: List[Tuple[str, float]]) -> None:
+        """Installs a previously persisted list; candidates no longer in the index are dropped."""
+        row = self.index.positions.get(user_id)
+        if row is None:
+            return
+        self._set_list(user_id, [(candidate, score) for candidate, score in candidates if candidate in self.index.positions])
+        if len(self.lists[user_id]) < min(self.size, len(self.index) - 1):
+            self.dirty.add(user_id)
+        else:
+            self.dirty.discard(user_id)
+
+    def recompute(self, user_id: str) -> None:
+        row = self.index.positions[user_id]
+        self._set_list(user_id, self.index.top_k_row(row, self.size))
+        self.dirty.discard(user_id)
+
+    def apply_change(self, user_id: str, characteristics: dict, intentions=None) -> Set[str]:
+        """
+        Applies one profile write.
+
+        :return: Owners of the lists that changed, including the user's own
+        """
+        row = self.index.upsert(user_id, characteristics, intentions)
+        self._grow_thresholds()
+        self.recompute(user_id)
+        changed = {user_id}
+
+        scores = self.index.reverse_scores(row, self.weights)
+        scores[row] = -1.0
+        owners = set(self.listed_in.get(user_id, ()))
+        # Thresholds of unknown lists are inf, so they never qualify here
+        owners.update(self.index.user_ids[i] for i in np.flatnonzero(scores > self.thresholds[:len(scores)]))
+        owners.discard(user_id)
+
+        for owner in owners:
+            if owner not in self.lists:
+                continue
+            score = float(scores[self.index.positions[owner]])
+            threshold = float(self.thresholds[self.index.positions[owner]])
+            entries = [entry for entry in self.lists[owner] if entry[0] != user_id]
+            was_listed = len(entries) < len(self.lists[owner])
+            entries.append((user_id, score))
+            entries.sort(key=lambda entry: -entry[1])
+            # Candidates outside a full list score at most its threshold, so a listed user
+            # falling below it may have been overtaken by someone the list does not hold
+            if was_listed and threshold >= 0 and score < threshold:
+                self.dirty.add(owner)
+            self._set_list(owner, entries[:self.size])
+            changed.add(owner)
+        return changed
+
+    def _grow_thresholds(self) -> None:
+        if len(self.thresholds) < len(self.index):
+            grown = np.full(max(len(self.index), 2 * len(self.thresholds)), np.inf, dtype=np.float32)
+            grown[:len(self.thresholds)] = self.thresholds
+            self.thresholds = grown
+
+    def _set_list(self, user_id: str, entries: List[Tuple[str, float]]) -> None:
+        for candidate, _ in self.lists.get(user_id, ()):
+            owners = self.listed_in.get(candidate)
+            if owners is not None:
+                owners.discard(user_id)
+        for candidate, _ in entries:
+            self.listed_in.setdefault(candidate, set()).add(user_id)
+        self.lists[user_id] = entries
+        self._grow_thresholds()
+        self.thresholds[self.index.positions[user_id]] = entries[-1][1] if len(entries) >= self.size else -1.0
+
+
+class MatchListMaintainer:
+    """
+    Keeps MatchLists in step with the users collection and persists them.
+
+    Runs in a daemon thread. Writes made through this process are queued by
+    notify() and applied within a batch. A reconciler pass every
+    MATCH_RECONCILE_INTERVAL_SECONDS picks up writes it was not told about
+    (bulk imports, other workers) through the characteristics_updated_at
+    field and recomputes dirty lists. Changed lists are upserted into
+    MATCH_LISTS_COLLECTION, where reads are one lookup on the unique user_id
+    index.
+    """
+
+    def __init__(self, users_collection, lists_collection, size: int = MATCH_LIST_SIZE):
+        self.users = users_collection
+        self.lists_collection = lists_collection
+        self.size = size
+        self.match_lists: Optional[MatchLists] = None
+        self._queue: "queue.Queue[Tuple[str, float]]" = queue.Queue()
+        self._oldest_pending: Optional[float] = None
+        self._watermark = 0.0
+        self._applied: Dict[str, float] = {}
+        self._last_reconcile = time.time()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="match-list-maintainer", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def notify(self, user_id: str) -> None:
+        """Queues a user whose characteristics were just written."""
+        now = time.time()
+        if self._oldest_pending is None:
+            self._oldest_pending = now
+        self._queue.put((user_id, now))
+        self.start()
+
+    def stats(self) -> Dict[str, float]:
+        match_lists = self.match_lists
+        now = time.time()
+        return {
+            "profiles": len(match_lists.index) if match_lists else 0,
+            "lists": len(match_lists.lists) if match_lists else 0,
+            "dirty_lists": len(match_lists.dirty) if match_lists else 0,
+            "pending_updates": self._queue.qsize(),
+            "oldest_pending_seconds": now - self._oldest_pending if self._oldest_pending else 0.0,
+            "seconds_since_reconcile": now - self._last_reconcile,
+        }
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._bootstrap()
+                break
+            except Exception as e:
+                logger.error("Match list bootstrap failed, retrying: %s", str(e))
+                self._stopped.wait(MATCH_RECONCILE_INTERVAL_SECONDS)
+
+        while not self._stopped.is_set():
+            # Keep working through dirty lists, but let queued writes go first
+            timeout = 0 if self.match_lists.dirty else max(
+                0.0, MATCH_RECONCILE_INTERVAL_SECONDS - (time.time() - self._last_reconcile)
+            )
+            try:
+                batch = [self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()]
+            except queue.Empty:
+                self._guarded(self._reconcile)
+                continue
+            while len(batch) < MATCH_UPDATE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._guarded(self._apply_batch, batch)
+
+    def _guarded(self, function, *args) -> None:
+        try:
+            function(*args)
+        except Exception as e:
+            logger.error("Match list maintenance failed: %s", str(e))
+
+    def _bootstrap(self) -> None:
+        started = time.perf_counter()
+        self.users.create_index("characteristics_updated_at")
+        self.lists_collection.create_index("user_id", unique=True)
+        documents = list(self.users.find({}, PROFILE_PROJECTION))
+        match_lists = MatchLists(ProfileIndex.build(documents), self.size)
+        for document in documents:
+            updated_at = document.get("characteristics_updated_at") or 0.0
+            self._applied[document["user_id"]] = updated_at
+            self._watermark = max(self._watermark, updated_at)
+
+        lists_written_at = 0.0
+        for document in self.lists_collection.find({}, {"_id": 0}):
+            candidates = [(candidate["user_id"], candidate["score"]) for candidate in document.get("candidates", [])]
+            match_lists.load(document["user_id"], candidates)
+            lists_written_at = max(lists_written_at, document.get("updated_at") or 0.0)
+        self.match_lists = match_lists
+
+        # Profiles written after the persisted lists were saved are applied again
+        changed = set()
+        for document in documents:
+            if lists_written_at and (document.get("characteristics_updated_at") or 0.0) > lists_written_at:
+                changed |= match_lists.apply_change(document["user_id"], document.get("characteristics") or {}, stored_intentions(document))
+        self._persist(changed)
+        logger.info(
+            "Match lists ready in %.2fs: %s profiles, %s lists loaded, %s to compute",
+            time.perf_counter() - started, len(match_lists.index), len(match_lists.lists), len(match_lists.dirty),
+        )
+
+    def _apply_batch(self, batch: List[Tuple[str, float]]) -> None:
+        user_ids = list(dict.fromkeys(user_id for user_id, _ in batch))
+        documents = self.users.find({"user_id": {"$in": user_ids}}, PROFILE_PROJECTION)
+        with track_stage("match_list_update"):
+            changed = self._apply_documents(documents)
+        self._persist(changed)
+        now = time.time()
+        for _, queued_at in batch:
+            STAGE_DURATION.observe(now - queued_at, stage="match_list_lag", outcome="ok")
+        self._oldest_pending = None if self._queue.empty() else now
+
+    def _apply_documents(self, documents: Iterable[dict]) -> Set[str]:
+        changed = set()
+        for document in documents:
+            updated_at = document.get("characteristics_updated_at") or time.time()
+            if self._applied.get(document["user_id"], -1.0) >= updated_at:
+                continue
+            changed |= self.match_lists.apply_change(
+                document["user_id"], document.get("characteristics") or {}, stored_intentions(document)
+            )
+            self._applied[document["user_id"]] = updated_at
+            self._watermark = max(self._watermark, updated_at)
+        return changed
+
+    def _reconcile(self) -> None:
+        with track_stage("match_list_reconcile"):
+            since = self._watermark - MATCH_RECONCILE_OVERLAP_SECONDS
+            documents = self.users.find({"characteristics_updated_at": {"$gt": since}}, PROFILE_PROJECTION)
+            changed = self._apply_documents(documents)
+            dirty = list(self.match_lists.dirty)[:MATCH_RECONCILE_BATCH]
+            for user_id in dirty:
+                self.match_lists.recompute(user_id)
+            changed.update(dirty)
+        self._persist(changed)
+        self._last_reconcile = time.time()
+
+    def _persist(self, owners: Iterable[str]) -> None:
+        from pymongo import UpdateOne
+        from api.services.user_repository import MONGO_BULK_BATCH_SIZE
+
+        now = time.time()
+        operations = []
+        for owner in owners:
+            entries = self.match_lists.get(owner)
+            if entries is None:
+                continue
+            candidates = [{"user_id": candidate, "score": round(score, 2)} for candidate, score in entries]
+            operations.append(UpdateOne(
+                {"user_id": owner},
+                {"$set": {"candidates": candidates, "stale": owner in self.match_lists.dirty, "updated_at": now}},
+                upsert=True,
+            ))
+        for start in range(0, len(operations), MONGO_BULK_BATCH_SIZE):
+            with track_stage("mongo_save_match_lists"):
+                self.lists_collection.bulk_write(operations[start:start + MONGO_BULK_BATCH_SIZE], ordered=False)
+
+
+_maintainer: Optional[MatchListMaintainer] = None
+_maintainer_lock = threading.Lock()
+
+
+def get_match_list_maintainer() -> Optional[MatchListMaintainer]:
+    """Returns this worker's maintainer, or None if match lists or the maintainer are disabled here."""
+    global _maintainer
+    if not (MATCH_LISTS_ENABLED and MATCH_LISTS_MAINTAINER):
+        return None
+    if _maintainer is None:
+        with _maintainer_lock:
+            if _maintainer is None:
+                from api.services.user_repository import USERS_COLLECTION, get_sync_database
+
+                database = get_sync_database()
+                _maintainer = MatchListMaintainer(database[USERS_COLLECTION], database[MATCH_LISTS_COLLECTION])
+    return _maintainer
+
+
+def start_match_list_maintainer() -> None:
+    """Starts the maintainer thread if it runs in this worker; its reconciler picks up bulk imports."""
+    maintainer = get_match_list_maintainer()
+    if maintainer is not None:
+        maintainer.start()
+
+
+def notify_characteristics_changed(user_id: str) -> None:
+    """Queues an incremental match list update for a user whose characteristics were written."""
+    maintainer = get_match_list_maintainer()
+    if maintainer is not None:
+        maintainer.notify(user_id)
+
+
+async def get_match_list(user_id: str) -> Optional[dict]:
+    """
+    Reads a user's materialized match list.
+
+    :return: Document with candidates (best first), stale and updated_at, or None if not computed yet
+    """
+    from api.services.user_repository import get_database
+
+    with track_stage("mongo_get_match_list"):
+        return await get_database()[MATCH_LISTS_COLLECTION].find_one({"user_id": user_id}, {"_id": 0})
+
+
+async def get_fresh_match_list(user_id: str, k: int) -> Optional[List[dict]]:
+    """
+    Reads a user's top k candidates from the materialized list, if it can be trusted.
+
+    :param user_id: User whose candidates are requested
+    :param k: Number of candidates wanted
+    :return: The best k candidates, or None if the list is missing, shorter than k, marked stale or
+             older than the user's last profile write; the caller then computes matches directly
+    """
+    from api.services.user_repository import get_user_repository
+
+    repository = await get_user_repository()
+    match_list, users = await asyncio.gather(
+        get_match_list(user_id), repository.get_many([user_id], fields=("characteristics_updated_at",)),
+    )
+    if not match_list or match_list.get("stale") or len(match_list["candidates"]) < k:
+        return None
+    profile_updated_at = users.get(user_id, {}).get("characteristics_updated_at") or 0.0
+    if (match_list.get("updated_at") or 0.0) < profile_updated_at:
+        return None
+    return match_list["candidates"][:k]
+
+
+def shutdown_match_list_maintainer() -> None:
+    if _maintainer is not None:
+        _maintainer.stop()
+
+
+def _collect_match_list_metrics() -> List[str]:
+    if _maintainer is None:
+        return []
+    return sample_lines("app_match_lists", "Materialized match list state and staleness.", _maintainer.stats(), "stat")
+
+
+REGISTRY.add_collector(_collect_match_list_metrics)
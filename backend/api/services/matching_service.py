@@ -0,0 +1,446 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+MATCH_INDEX_TTL_SECONDS = int(os.getenv("MATCH_INDEX_TTL_SECONDS", "300"))
+MATCH_DEFAULT_TOP_K = 10
+
+# Single-valued attributes, as (field name, path into the characteristics dict)
+CATEGORICAL_FIELDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("face_shape", ("face_shape",)),
+    ("hair_color", ("hair_details", "color")),
+    ("hair_texture", ("hair_details", "texture")),
+    ("hair_length", ("hair_details", "length")),
+    ("eye_color", ("eye_details", "color")),
+    ("eye_shape", ("eye_details", "shape")),
+    ("skin_tone", ("skin_tone",)),
+]
+
+# Relative importance of each attribute group in the final score
+MATCH_WEIGHTS: Dict[str, float] = {
+    "face_shape": 1.0,
+    "hair_color": 1.5,
+    "hair_texture": 0.75,
+    "hair_length": 0.75,
+    "eye_color": 1.5,
+    "eye_shape": 0.5,
+    "skin_tone": 1.0,
+    "other_features": 1.0,
+    "intentions": 3.0,
+}
+
+# Known values get small stable codes; anything else is hashed above this offset so equal strings still match
+KNOWN_VALUES: Dict[str, List[str]] = {
+    "face_shape": ["oval", "round", "square", "heart", "oblong", "diamond", "triangle", "rectangle"],
+    "hair_color": ["black", "brown", "blonde", "red", "auburn", "gray", "white", "dyed"],
+    "hair_texture": ["straight", "wavy", "curly", "coily"],
+    "hair_length": ["bald", "short", "medium", "long"],
+    "eye_color": ["brown", "blue", "green", "hazel", "gray", "amber", "black"],
+    "eye_shape": ["almond", "round", "hooded", "monolid", "upturned", "downturned"],
+    "skin_tone": ["fair", "light", "medium", "olive", "tan", "brown", "dark"],
+}
+SYNONYMS = {"blond": "blonde", "grey": "gray", "heart shaped": "heart", "ginger": "red"}
+HASHED_CODE_OFFSET = 1000
+MISSING_CODE = -1
+
+# Multi-valued attributes are hashed into a 64-bit mask per profile
+MASK_BITS = 64
+
+
+def _normalize(value) -> Optional[str]:
+    if value is None:
+        return None
+    text = str(value).strip().lower().replace("_", " ").replace("-", " ")
+    text = " ".join(text.split())
+    if text.endswith(" shaped"):
+        text = text[: -len(" shaped")]
+    if not text or text in ("<value>", "unknown", "n/a", "none"):
+        return None
+    return SYNONYMS.get(text, text)
+
+
+def _stable_hash(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def _encode_categorical(field: str, value) -> int:
+    text = _normalize(value)
+    if text is None:
+        return MISSING_CODE
+    known = KNOWN_VALUES.get(field, [])
+    if text in known:
+        return known.index(text)
+    return HASHED_CODE_OFFSET + _stable_hash(text) % (np.iinfo(np.int16).max - HASHED_CODE_OFFSET)
+
+
+def _lookup(characteristics: dict, path: Tuple[str, ...]):
+    value = characteristics
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _encode_mask(values: Iterable[str]) -> int:
+    mask = 0
+    for value in values:
+        text = _normalize(value)
+        if text is not None:
+            mask |= 1 << (_stable_hash(text) % MASK_BITS)
+    return mask
+
+
+def _intention_terms(intentions) -> List[str]:
+    if not intentions:
+        return []
+    if isinstance(intentions, str):
+        return [intentions]
+    if isinstance(intentions, dict):
+        return [f"{key}={value}" for key, value in intentions.items()]
+    return [str(value) for value in intentions]
+
+
+def stored_intentions(profile: dict):
+    """Intentions of a users collection document: the top-level field, else the one inside characteristics."""
+    return profile.get("intentions", (profile.get("characteristics") or {}).get("intentions"))
+
+
+def encode_profile(characteristics: dict, intentions=None) -> Tuple[np.ndarray, int, int]:
+    """
+    Encodes one profile into its compact feature representation.
+
+    :param characteristics: Characteristics as returned by the vision model
+    :param intentions: Intentions as a dict, list of strings or a single string
+    :return: Tuple of (categorical codes, other_features mask, intentions mask)
+    """
+    characteristics = characteristics or {}
+    codes = np.array(
+        [_encode_categorical(field, _lookup(characteristics, path)) for field, path in CATEGORICAL_FIELDS],
+        dtype=np.int16,
+    )
+    features = characteristics.get("other_features") or []
+    if isinstance(features, str):
+        features = [features]
+    return codes, _encode_mask(features), _encode_mask(_intention_terms(intentions))
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.float32)
+    bits = np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1).astype(np.float32)
+
+
+def _jaccard(masks: np.ndarray, query_mask: int) -> np.ndarray:
+    query = np.uint64(query_mask)
+    union = _popcount(masks | query)
+    intersection = _popcount(masks & query)
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+class ProfileIndex:
+    """
+    Column-oriented feature store for the whole user population.
+
+    Every profile is one row: an int16 code per categorical attribute and a
+    uint64 bit mask each for other_features and intentions, so one query is
+    scored against all rows with a handful of vectorized comparisons.
+
+    Rows can be updated in place with upsert; the arrays grow by doubling so
+    adding a profile is amortized O(1).
+    """
+
+    def __init__(self, user_ids: List[str], codes: np.ndarray, feature_masks: np.ndarray, intention_masks: np.ndarray):
+        self.user_ids = user_ids
+        self.positions = {user_id: row for row, user_id in enumerate(user_ids)}
+        self._codes_buffer = codes
+        self._feature_buffer = feature_masks
+        self._intention_buffer = intention_masks
+        self._set_views()
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def _set_views(self) -> None:
+        size = len(self.user_ids)
+        self.codes = self._codes_buffer[:size]
+        self.feature_masks = self._feature_buffer[:size]
+        self.intention_masks = self._intention_buffer[:size]
+
+    def upsert(self, user_id: str, characteristics: dict, intentions=None) -> int:
+        """
+        Adds or replaces one profile.
+
+        :return: The profile's row
+        """
+        codes, feature_mask, intention_mask = encode_profile(characteristics, intentions)
+        row = self.positions.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            if row >= len(self._codes_buffer):
+                capacity = max(16, 2 * len(self._codes_buffer))
+                self._codes_buffer = np.resize(self._codes_buffer, (capacity, len(CATEGORICAL_FIELDS)))
+                self._feature_buffer = np.resize(self._feature_buffer, capacity)
+                self._intention_buffer = np.resize(self._intention_buffer, capacity)
+            self.user_ids.append(user_id)
+            self.positions[user_id] = row
+        self._codes_buffer[row] = codes
+        self._feature_buffer[row] = feature_mask
+        self._intention_buffer[row] = intention_mask
+        self._set_views()
+        return row
+
+    @classmethod
+    def build(cls, profiles: Iterable[dict]) -> "ProfileIndex":
+        """
+        Builds an index from documents shaped like the users collection.
+
+        :param profiles: Iterable of dicts with user_id, characteristics and optional intentions
+        """
+        user_ids, codes, feature_masks, intention_masks = [], [], [], []
+        for profile in profiles:
+            profile_codes, feature_mask, intention_mask = encode_profile(profile.get("characteristics"), stored_intentions(profile))
+            user_ids.append(profile["user_id"])
+            codes.append(profile_codes)
+            feature_masks.append(feature_mask)
+            intention_masks.append(intention_mask)
+
+        return cls(
+            user_ids,
+            np.array(codes, dtype=np.int16).reshape(len(user_ids), len(CATEGORICAL_FIELDS)),
+            np.array(feature_masks, dtype=np.uint64),
+            np.array(intention_masks, dtype=np.uint64),
+        )
+
+    def score(self, characteristics: dict, intentions=None, weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """
+        Scores every profile against the query in one vectorized pass.
+
+        Attributes missing from the query do not count towards the score.
+
+        :return: float32 array of scores in the 0-100 range, aligned with user_ids
+        """
+        return self._score_encoded(*encode_profile(characteristics, intentions), weights)
+
+    def score_row(self, row: int, weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Scores every profile against the stored profile at row, as score() would for its characteristics."""
+        return self._score_encoded(self.codes[row], int(self.feature_masks[row]), int(self.intention_masks[row]), weights)
+
+    def reverse_scores(self, row: int, weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """
+        Scores the profile at row from every profile's point of view.
+
+        Entry i equals score_row(i)[row], so the row's place in every other
+        user's ranking is known after one vectorized pass.
+        """
+        weights = weights or MATCH_WEIGHTS
+        field_weights = np.array([weights[field] for field, _ in CATEGORICAL_FIELDS], dtype=np.float32)
+        present = self.codes != MISSING_CODE
+        scores = ((self.codes == self.codes[row]) & present) @ field_weights
+        total_weight = present @ field_weights
+
+        for masks, key in ((self.feature_masks, "other_features"), (self.intention_masks, "intentions")):
+            has_values = masks != 0
+            scores += weights[key] * has_values * _jaccard(masks, int(masks[row]))
+            total_weight += weights[key] * has_values
+
+        return np.divide(scores * 100.0, total_weight, out=np.zeros_like(scores), where=total_weight > 0)
+
+    def _score_encoded(self, query_codes: np.ndarray, query_features: int, query_intentions: int,
+                       weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+        weights = weights or MATCH_WEIGHTS
+        scores = np.zeros(len(self), dtype=np.float32)
+        total_weight = 0.0
+
+        for column, (field, _) in enumerate(CATEGORICAL_FIELDS):
+            if query_codes[column] == MISSING_CODE:
+                continue
+            scores += weights[field] * (self.codes[:, column] == query_codes[column])
+            total_weight += weights[field]
+
+        if query_features:
+            scores += weights["other_features"] * _jaccard(self.feature_masks, query_features)
+            total_weight += weights["other_features"]
+        if query_intentions:
+            scores += weights["intentions"] * _jaccard(self.intention_masks, query_intentions)
+            total_weight += weights["intentions"]
+
+        if total_weight:
+            scores *= 100.0 / total_weight
+        return scores
+
+    def top_k(
+        self,
+        characteristics: dict,
+        intentions=None,
+        k: int = MATCH_DEFAULT_TOP_K,
+        exclude_user_id: Optional[str] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Returns the k best matching (user_id, score) pairs, best first.
+        """
+        if not len(self):
+            return []
+        scores = self.score(characteristics, intentions, weights)
+        return self._top_of(scores, k, exclude_user_id)
+
+    def top_k_row(self, row: int, k: int = MATCH_DEFAULT_TOP_K) -> List[Tuple[str, float]]:
+        """Top-K for the stored profile at row, excluding itself."""
+        return self._top_of(self.score_row(row), k, self.user_ids[row])
+
+    def _top_of(self, scores: np.ndarray, k: int, exclude_user_id: Optional[str]) -> List[Tuple[str, float]]:
+        if exclude_user_id is not None and exclude_user_id in self.positions:
+            scores[self.positions[exclude_user_id]] = -1.0
+
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.user_ids[i], float(scores[i])) for i in candidates if scores[i] >= 0]
+
+
+_profile_index: Optional[ProfileIndex] = None
+_profile_index_lock = threading.Lock()
+_profile_index_refreshing = False
+
+
+def _build_profile_index(users_collection) -> ProfileIndex:
+    started = time.perf_counter()
+    cursor = users_collection.find({}, {"_id": 0, "user_id": 1, "characteristics": 1, "intentions": 1})
+    index = ProfileIndex.build(cursor)
+    logger.info("Built match index of %s profiles in %.3fs", len(index), time.perf_counter() - started)
+    return index
+
+
+def _refresh_profile_index(users_collection) -> None:
+    global _profile_index, _profile_index_refreshing
+    try:
+        _profile_index = _build_profile_index(users_collection)
+    except Exception as e:
+        logger.error("Match index refresh failed, keeping the previous index: %s", str(e))
+    finally:
+        _profile_index_refreshing = False
+
+
+def get_profile_index(users_collection) -> ProfileIndex:
+    """
+    Returns the population index.
+
+    Only the first call builds it on the caller's thread. Once it is older
+    than MATCH_INDEX_TTL_SECONDS it keeps being served while a single
+    background thread rebuilds it from MongoDB and swaps it in.
+    """
+    global _profile_index, _profile_index_refreshing
+    index = _profile_index
+    if index is None:
+        with _profile_index_lock:
+            if _profile_index is None:
+                _profile_index = _build_profile_index(users_collection)
+            return _profile_index
+
+    if time.time() - index.built_at > MATCH_INDEX_TTL_SECONDS:
+        with _profile_index_lock:
+            if not _profile_index_refreshing:
+                _profile_index_refreshing = True
+                threading.Thread(
+                    target=_refresh_profile_index, args=(users_collection,), name="match-index-refresh", daemon=True
+                ).start()
+    return index
+
+
+def _rank(users_collection, characteristics: dict, intentions, k: int, user_id: str) -> List[Tuple[str, float]]:
+    return get_profile_index(users_collection).top_k(characteristics, intentions, k=k, exclude_user_id=user_id)
+
+
+def build_explanation_messages(characteristics: dict, intentions, candidates: List[dict]) -> list:
+    """
+    Builds a single prompt asking the chat model to re-rank and explain a short candidate list.
+    """
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an expert matchmaker. You receive a primary user and a short list of candidates "
+                "already ranked by an attribute-similarity score. Re-rank the candidates by overall compatibility "
+                "and explain each match in one sentence. Respond with JSON: "
+                "{\"matches\": [{\"user_id\": \"<id>\", \"score\": <0-100>, \"explanation\": \"<text>\"}]}"
+            ),
+        },
+        {
+            "role": "user",
+            "content": json.dumps(
+                {"primary": {"characteristics": characteristics, "intentions": intentions}, "candidates": candidates},
+                separators=(",", ":"),
+            ),
+        },
+    ]
+
+
+async def find_top_matches(
+    user_id: str,
+    intentions=None,
+    preferences: Optional[dict] = None,
+    k: int = MATCH_DEFAULT_TOP_K,
+    explain: bool = False,
+) -> List[dict]:
+    """
+    Ranks the whole population for one user and returns the top-K.
+
+    :param user_id: ID of the primary user
+    :param intentions: Intentions of the primary user (defaults to the stored ones)
+    :param preferences: Desired features in the characteristics schema; the user's own characteristics are used when omitted
+    :param k: Number of candidates to return
+    :param explain: Re-rank and explain the short list with one chat model call
+    :return: List of dicts with user_id, score and optional explanation
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from api.services.openai_service import get_async_client, CHAT_MODEL_NAME
+    from api.services.upstream_service import get_upstream
+    from api.services.user_repository import get_user_repository, get_users_collection
+
+    repository = await get_user_repository()
+    # Stored intentions are read the way the index reads them, so both sides of the ranking agree
+    profile = (await repository.get_many([user_id], fields=("characteristics", "intentions"))).get(user_id, {})
+    characteristics = profile.get("characteristics")
+    if not characteristics:
+        raise HTTPException(status_code=404, detail="User does not have stored characteristics.")
+    if intentions is None:
+        intentions = stored_intentions(profile)
+
+    # The O(N) scoring pass runs in the threadpool along with the index lookup
+    ranked = await run_in_threadpool(_rank, get_users_collection(), preferences or characteristics, intentions, k, user_id)
+    matches = [{"user_id": candidate_id, "score": round(score, 2)} for candidate_id, score in ranked]
+    if not explain or not matches:
+        return matches
+
+    try:
+        candidate_ids = [match["user_id"] for match in matches]
+        candidates = await repository.get_many(candidate_ids, fields=("characteristics", "intentions"))
+        messages = build_explanation_messages(characteristics, intentions, list(candidates.values()))
+        response = await get_upstream().call_async(
+            CHAT_MODEL_NAME, lambda: get_async_client().chat.completions.create(model=CHAT_MODEL_NAME, messages=messages)
+        )
+        explained = json.loads(response.choices[0].message.content)["matches"]
+        known_ids = set(candidate_ids)
+        return [
+            {"user_id": match["user_id"], "score": float(match["score"]), "explanation": match.get("explanation")}
+            for match in explained
+            if match.get("user_id") in known_ids
+        ]
+    except Exception as e:
+        # The vectorized ranking is still valid if the explanation step fails
+        logger.warning("Match explanation failed, returning unexplained ranking: %s", str(e))
+        return matches
@@ -1,90 +1,91 @@
+import asyncio
+import base64
+import hashlib
+import json
 import logging
-from openai import OpenAI
+import math
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
 from fastapi import HTTPException
+from typing import AsyncIterator, Awaitable, Callable, Dict, FrozenSet, List, Optional, Union
+from api.utils.image_analysis import BLANK, DOCUMENT, GRAPHIC, TOO_SMALL
+from api.utils.image_utils import PreprocessedImage, base64_length, iter_base64
+from api.models.document_models import DocumentContext, VisionAttributes
+from pydantic import ValidationError
+from api.services.cache_service import get_vision_cache, make_cache_key
+from api.services.upstream_service import CircuitOpenError, get_upstream
+from api.services.user_repository import get_users_collection
+from api.utils.metrics import REGISTRY, STAGE_DURATION, UPSTREAM_REQUESTS, VISION_ROUTES, record_payload, record_usage, sample_lines, track_stage
 import os
+import time
 
 # API keys
 XAI_API_KEY = os.getenv("XAI_API_KEY")
 VISION_MODEL_NAME = "grok-vision-beta"
 CHAT_MODEL_NAME = "grok-beta"
 
-client = OpenAI(api_key=XAI_API_KEY, base_url="https://api.x.ai/v1")
+# Point this at benchmarks/mock_llm.py (or any OpenAI-compatible server) for local load tests
+XAI_BASE_URL = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
+# Per-attempt timeout; retries are done by upstream_service, not the SDK
+XAI_TIMEOUT_SECONDS = float(os.getenv("XAI_TIMEOUT_SECONDS", "120"))
 
 logger = logging.getLogger(__name__)
 
-# MongoDB connection
-MONGO_URI = os.getenv("MONGO_URI")  # You can set your MongoDB URI in environment variables
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client["user_database"]  # Select the database
-users_collection = db["users"]
+# Caps on concurrent vision calls: across the whole worker and within a single upload
+VISION_GLOBAL_CONCURRENCY = int(os.getenv("VISION_GLOBAL_CONCURRENCY", "8"))
+VISION_REQUEST_CONCURRENCY = int(os.getenv("VISION_REQUEST_CONCURRENCY", "4"))
+_vision_semaphore: Optional[asyncio.Semaphore] = None
 
-def process_image_with_grok(base64_image: str) -> dict:
-    try:
-        logger.debug("Sending request to Grok Vision model.")
+# Share one upstream call between concurrent identical requests
+UPSTREAM_COALESCING_ENABLED = os.getenv("UPSTREAM_COALESCING_ENABLED", "true").lower() == "true"
 
-        response = client.chat.completions.create(
-            model=VISION_MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": (
-                                "Analyze the provided image and extract detailed attributes of the person in the image. "
-                                "Categorize the output into distinct groups of physical features. Structure the response in JSON format with the following groups:\n\n"
-                                "1. \"face_shape\": Identify the face shape (e.g., oval, round, square, heart-shaped).\n"
-                                "2. \"hair_details\": Include hair color, texture (e.g., straight, wavy, curly), and length (short, medium, long).\n"
-                                "3. \"eye_details\": Include eye color, shape (e.g., almond, round, hooded).\n"
-                                "4. \"skin_tone\": Classify the skin tone (e.g., fair, medium, tan, dark).\n"
-                                "5. \"other_features\": Note distinctive features like freckles, moles, scars, or makeup (e.g., lipstick, eyeshadow).\n\n"
-                                "Return the results in the following JSON format:\n\n"
-                                "{\n"
-                                "  \"face_shape\": \"<value>\",\n"
-                                "  \"hair_details\": {\n"
-                                "    \"color\": \"<value>\",\n"
-                                "    \"texture\": \"<value>\",\n"
-                                "    \"length\": \"<value>\"\n"
-                                "  },\n"
-                                "  \"eye_details\": {\n"
-                                "    \"color\": \"<value>\",\n"
-                                "    \"shape\": \"<value>\"\n"
-                                "  },\n"
-                                "  \"skin_tone\": \"<value>\",\n"
-                                "  \"other_features\": [\"<value>\", \"<value>\"]\n"
-                                "}\n\n"
-                                "Additionally, allow users to describe desired features (face shape, hair color, eye color, etc.) and match these descriptions with identified attributes to suggest the closest matches. "
-                                "Provide the matching logic and confidence levels for each attribute."
-                            )
-                        }
-                    ]
-                }
-            ],
-        )
+VISION_PROMPT = (
+    "Analyze the provided image and extract detailed attributes of the person in the image. "
+    "Categorize the output into distinct groups of physical features. Structure the response in JSON format with the following groups:\n\n"
+    "1. \"face_shape\": Identify the face shape (e.g., oval, round, square, heart-shaped).\n"
+    "2. \"hair_details\": Include hair color, texture (e.g., straight, wavy, curly), and length (short, medium, long).\n"
+    "3. \"eye_details\": Include eye color, shape (e.g., almond, round, hooded).\n"
+    "4. \"skin_tone\": Classify the skin tone (e.g., fair, medium, tan, dark).\n"
+    "5. \"other_features\": Note distinctive features like freckles, moles, scars, or makeup (e.g., lipstick, eyeshadow).\n\n"
+    "Return the results in the following JSON format:\n\n"
+    "{\n"
+    "  \"face_shape\": \"<value>\",\n"
+    "  \"hair_details\": {\n"
+    "    \"color\": \"<value>\",\n"
+    "    \"texture\": \"<value>\",\n"
+    "    \"length\": \"<value>\"\n"
+    "  },\n"
+    "  \"eye_details\": {\n"
+    "    \"color\": \"<value>\",\n"
+    "    \"shape\": \"<value>\"\n"
+    "  },\n"
+    "  \"skin_tone\": \"<value>\",\n"
+    "  \"other_features\": [\"<value>\", \"<value>\"]\n"
+    "}\n\n"
+    "Additionally, allow users to describe desired features (face shape, hair color, eye color, etc.) and match these descriptions with identified attributes to suggest the closest matches. "
+    "Provide the matching logic and confidence levels for each attribute."
+)
 
-        return response.choices[0].message
+# Image kinds the local tier answers without the vision model: document pages only
+# skip unusable images, profile photos also skip anything that is not a photo
+LOCAL_REJECT_DOCUMENT_KINDS = frozenset({BLANK, TOO_SMALL})
+LOCAL_REJECT_PHOTO_KINDS = frozenset({BLANK, TOO_SMALL, DOCUMENT, GRAPHIC})
 
-    except Exception as e:
-        logger.error("Error processing image: %s", str(e))
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+# Upper bound on the vision context sent to the text model, in estimated tokens
+DOCUMENT_CONTEXT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_CONTEXT_TOKEN_BUDGET", "512"))
+DOCUMENT_NOTE_MAX_CHARS = 400
 
 
-def process_document_with_text_model(aggregated_results: list) -> dict:
-    document_context = " ".join([str(result) for result in aggregated_results])
-    try:
-        response = client.chat.completions.create(
-            model=CHAT_MODEL_NAME,
-             messages=[
-                {
-                    "role": "system",
-                    "content": """You are a helpful, friendly, and clear assistant with expertise in analyzing and solving form-related issues. 
+def _compact_prompt(prompt: str) -> str:
+    """Strips source-code indentation from a prompt; it costs tokens on every call."""
+    return "\n".join(line.strip() for line in prompt.strip().splitlines())
+
+
+# Changing the prompt text changes the version, which invalidates cached vision results
+VISION_PROMPT_VERSION = hashlib.sha256(VISION_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+DOCUMENT_SYSTEM_PROMPT = _compact_prompt("""You are a helpful, friendly, and clear assistant with expertise in analyzing and solving form-related issues. 
                                 Provide personalized guidance based on the extracted form data:
 
                     1. **Completed Fields**:
@@ -131,26 +132,9 @@ def process_document_with_text_model(aggregated_results: list) -> dict:
 
                     Keep going, you're almost there! 📝"
 
-                    Generate helpful, supportive text based on the provided data."""
-                },
-                {"role": "user", "content": document_context},
-            ],
-        )
-        return response.choices[0].message
-    except Exception as e:
-        logger.error("Error processing document: %s", str(e))
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
-
+                    Generate helpful, supportive text based on the provided data.""")
 
-def generate_response(request: dict) -> str:
-    """
-    Generates a response based on the user's request and interaction.
-    Focuses on understanding user preferences, characteristics, and needs.
-    """
-    base_messages = [
-        {
-            "role": "system",
-            "content": """As a funny and creative assistant in the partner matching process, 
+CHAT_SYSTEM_PROMPT = _compact_prompt("""As a funny and creative assistant in the partner matching process, 
                        the language model can check many things during a conversation with 
                        a client to best understand their needs and preferences. Here are some examples:
 
@@ -189,43 +173,783 @@ def generate_response(request: dict) -> str:
 
                        It is important that the language model asks questions in an empathetic and non-judgmental manner, 
                        so that the client feels comfortable and free to share their thoughts and feelings.
-                       """
+                       """)
+
+# Replaces the former second round trip that asked the model to extend its first answer
+FOLLOW_UP_INSTRUCTION = "\n\n" + _compact_prompt("""
+                       After answering the client's message, continue in the same reply with a short
+                       "Let's dive deeper" follow-up: reflect back what you have learned about what they are
+                       looking for and ask one or two empathetic questions that help you assist them further.
+                       """)
+
+SUMMARY_SYSTEM_PROMPT = _compact_prompt("""
+                       You maintain the memory of a matchmaking conversation. Merge the previous summary and the
+                       new messages into one short summary in the third person. Keep every fact the client shared
+                       about themselves and about the partner they are looking for, and drop small talk.
+                       Answer with the summary text only.
+                       """)
+
+# Clients are created on first use so importing this module stays cheap
+_client = None
+_async_client = None
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared synchronous xAI client."""
+    global _client
+    if _client is None:
+        with _clients_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=XAI_API_KEY, base_url=XAI_BASE_URL, timeout=XAI_TIMEOUT_SECONDS, max_retries=0)
+    return _client
+
+
+def get_async_client():
+    """Returns the shared asynchronous xAI client."""
+    global _async_client
+    if _async_client is None:
+        with _clients_lock:
+            if _async_client is None:
+                from openai import AsyncOpenAI
+                _async_client = AsyncOpenAI(api_key=XAI_API_KEY, base_url=XAI_BASE_URL, timeout=XAI_TIMEOUT_SECONDS, max_retries=0)
+    return _async_client
+
+
+async def close_clients() -> None:
+    """Closes whichever clients were created; called on application shutdown."""
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.close()
+    if _client is not None:
+        _client.close()
+    _client = _async_client = None
+
+
+def _load_message(value: str):
+    from openai.types.chat import ChatCompletionMessage
+    return ChatCompletionMessage.model_validate_json(value)
+
+
+def _get_vision_semaphore() -> asyncio.Semaphore:
+    """Returns the worker-wide vision semaphore, creating it inside the running loop."""
+    global _vision_semaphore
+    if _vision_semaphore is None:
+        _vision_semaphore = asyncio.Semaphore(VISION_GLOBAL_CONCURRENCY)
+    return _vision_semaphore
+
+
+def _build_vision_messages(base64_image: str, mime_type: str = "image/jpeg", detail: str = "high") -> list:
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{base64_image}",
+                        "detail": detail
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": VISION_PROMPT
+                }
+            ]
         }
     ]
-    base_messages.append({"role": "user", "content": request['question']})
 
+
+@dataclass
+class _InFlightCall:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical upstream calls into one.
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight wait for the same result, or the same exception. Nothing is
+    kept once the call finishes; repeated results are the cache's job.
+
+    An async call runs as its own task so one waiter being cancelled does
+    not cancel it for the others; it is only cancelled when every waiter is
+    gone. Synchronous callers (thread pool paths) coalesce separately.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _InFlightCall] = {}
+        self._sync_calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._sync_calls)
+
+    async def run_async(self, key: str, model: str, factory: Callable[[], Awaitable]):
+        """
+        :param key: Canonical hash of the request
+        :param model: Model name, used as the metric label for collapsed duplicates
+        :param factory: Returns the awaitable that performs the call
+        """
+        if not UPSTREAM_COALESCING_ENABLED:
+            return await factory()
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _InFlightCall(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            UPSTREAM_REQUESTS.inc(model=model, outcome="coalesced")
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+
+    def run(self, key: str, model: str, function: Callable):
+        """Synchronous counterpart of run_async for calls made from worker threads."""
+        if not UPSTREAM_COALESCING_ENABLED:
+            return function()
+        with self._lock:
+            future = self._sync_calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._sync_calls[key] = Future()
+        if not leader:
+            UPSTREAM_REQUESTS.inc(model=model, outcome="coalesced")
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            with self._lock:
+                self._sync_calls.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._sync_calls.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key: str, call: _InFlightCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+_single_flight = SingleFlight()
+REGISTRY.add_collector(lambda: sample_lines(
+    "app_upstream_in_flight", "Distinct upstream calls currently in flight.", {"calls": _single_flight.in_flight()}, "kind",
+))
+
+
+def _request_key(model: str, messages: list, **params) -> str:
+    """Canonical hash of a chat completion request."""
+    return make_cache_key(model, json.dumps({"messages": messages, **params}, sort_keys=True, separators=(",", ":")))
+
+
+def _upstream_http_error(e: Exception, detail: str) -> HTTPException:
+    """503 with Retry-After while the upstream is rate limiting us or the circuit is open, 500 otherwise."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(math.ceil(e.retry_after))})
+    if getattr(e, "status_code", None) == 429:
+        return HTTPException(status_code=503, detail=detail)
+    return HTTPException(status_code=500, detail=detail)
+
+
+def _record_completion(model: str, response) -> None:
+    UPSTREAM_REQUESTS.inc(model=model, outcome="ok")
+    record_usage(model, getattr(response, "usage", None))
+
+
+def _vision_cache_key(image: memoryview, mime_type: str, detail: str, cache) -> Optional[str]:
+    """Key of a vision request for the result cache and coalescing, or None when neither is in use."""
+    if cache is None and not UPSTREAM_COALESCING_ENABLED:
+        return None
+    # The raw bytes are hashed in place, without Base64-encoding the image for the key
+    return make_cache_key(VISION_MODEL_NAME, VISION_PROMPT_VERSION, mime_type, detail, (image,))
+
+
+def _image_view(image: Union[str, bytes, bytearray, memoryview]) -> memoryview:
+    # Base64 strings are still accepted; they are decoded once and then handled like raw bytes
+    if isinstance(image, str):
+        image = base64.b64decode(image)
+    return memoryview(image)
+
+
+class _VisionRequestBody:
+    """
+    JSON body of a vision request, written to the transport piece by piece.
+
+    The image is Base64-encoded one chunk at a time while the body is sent,
+    so the encoded image, its data URL and the serialized request never
+    exist as full-size strings. The length is known up front, so the body
+    goes out with a Content-Length rather than chunked.
+    """
+    _PLACEHOLDER = "__IMAGE_BASE64__"
+
+    def __init__(self, image: memoryview, mime_type: str, detail: str):
+        text = json.dumps({
+            "model": VISION_MODEL_NAME,
+            "messages": _build_vision_messages(self._PLACEHOLDER, mime_type, detail),
+        })
+        prefix, suffix = text.split(self._PLACEHOLDER)
+        self.prefix, self.suffix = prefix.encode("utf-8"), suffix.encode("utf-8")
+        self.image = image
+        self.length = len(self.prefix) + base64_length(len(image)) + len(self.suffix)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", "Content-Length": str(self.length)}
+
+    def __iter__(self):
+        yield self.prefix
+        yield from iter_base64(self.image)
+        yield self.suffix
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+
+def _create_vision_completion(image: memoryview, mime_type: str, detail: str):
+    from openai.types.chat import ChatCompletion
+
+    body = _VisionRequestBody(image, mime_type, detail)
+    # A fresh iterator per attempt, so retries and hedges each send the whole body
+    return get_client().post("/chat/completions", cast_to=ChatCompletion, content=iter(body), options={"headers": body.headers})
+
+
+def _create_vision_completion_async(image: memoryview, mime_type: str, detail: str):
+    from openai.types.chat import ChatCompletion
+
+    body = _VisionRequestBody(image, mime_type, detail)
+    return get_async_client().post("/chat/completions", cast_to=ChatCompletion, content=body.__aiter__(), options={"headers": body.headers})
+
+
+def process_image_with_grok(image: Union[str, bytes, bytearray, memoryview], mime_type: str = "image/jpeg", detail: str = "high") -> dict:
+    """
+    Extracts attributes from one image with the Grok Vision model.
+
+    :param image: Raw image bytes (any bytes-like object, used without copying) or a Base64 string
+    :param mime_type: MIME type of the image
+    :param detail: Vision detail level, "low" or "high"
+    """
     try:
-        # Initial API call to the chat model
-        response = client.chat.completions.create(
-            model=CHAT_MODEL_NAME,
-            messages=base_messages,
-        )
+        image = _image_view(image)
+        cache = get_vision_cache()
+        cache_key = _vision_cache_key(image, mime_type, detail, cache)
+        with track_stage("vision_cache_lookup"):
+            cached = cache.get(cache_key) if cache else None
+        if cached is not None:
+            logger.debug("Vision cache hit.")
+            UPSTREAM_REQUESTS.inc(model=VISION_MODEL_NAME, outcome="cache_hit")
+            return _load_message(cached)
+
+        logger.debug("Sending request to Grok Vision model.")
+        record_payload("vision_request", base64_length(len(image)))
+
+        def _call():
+            with track_stage("vision_call"):
+                response = get_upstream().call(VISION_MODEL_NAME, lambda: _create_vision_completion(image, mime_type, detail))
+            _record_completion(VISION_MODEL_NAME, response)
+
+            message = response.choices[0].message
+            if cache:
+                cache.set(cache_key, message.model_dump_json())
+            return message
+
+        # The cache key already identifies model, prompt and image
+        return _single_flight.run(cache_key, VISION_MODEL_NAME, _call)
+
+    except Exception as e:
+        UPSTREAM_REQUESTS.inc(model=VISION_MODEL_NAME, outcome="error")
+        logger.error("Error processing image: %s", str(e))
+        raise _upstream_http_error(e, f"Error processing image: {str(e)}")
+
+
+async def process_image_with_grok_async(image: Union[str, bytes, bytearray, memoryview], mime_type: str = "image/jpeg", detail: str = "high",
+                                       semaphore: Optional[asyncio.Semaphore] = None) -> dict:
+    """
+    Async counterpart of process_image_with_grok; does not block the event loop.
+
+    :param semaphore: Concurrency cap the call counts against; the worker-wide vision cap if not given
+    """
+    try:
+        image = _image_view(image)
+        cache = get_vision_cache()
+        cache_key = _vision_cache_key(image, mime_type, detail, cache)
+        with track_stage("vision_cache_lookup"):
+            cached = await asyncio.to_thread(cache.get, cache_key) if cache else None
+        if cached is not None:
+            logger.debug("Vision cache hit.")
+            UPSTREAM_REQUESTS.inc(model=VISION_MODEL_NAME, outcome="cache_hit")
+            return _load_message(cached)
+
+        logger.debug("Sending async request to Grok Vision model.")
+        record_payload("vision_request", base64_length(len(image)))
+
+        async def _call():
+            # The cap is held per attempt, so a call backing off does not block other uploads
+            with track_stage("vision_call"):
+                response = await get_upstream().call_async(
+                    VISION_MODEL_NAME,
+                    lambda: _create_vision_completion_async(image, mime_type, detail),
+                    semaphore=semaphore or _get_vision_semaphore(),
+                )
+            _record_completion(VISION_MODEL_NAME, response)
+
+            message = response.choices[0].message
+            if cache:
+                await asyncio.to_thread(cache.set, cache_key, message.model_dump_json())
+            return message
+
+        return await _single_flight.run_async(cache_key, VISION_MODEL_NAME, _call)
+
+    except Exception as e:
+        UPSTREAM_REQUESTS.inc(model=VISION_MODEL_NAME, outcome="error")
+        logger.error("Error processing image: %s", str(e))
+        raise _upstream_http_error(e, f"Error processing image: {str(e)}")
+
+
+@dataclass
+class LocalVisionResult:
+    """An image answered by a local tier, in place of a vision model result."""
+    kind: str
+    reason: str
 
-        # Extract the first response from the chat model
-        initial_message = response.choices[0].message
+    @property
+    def content(self) -> str:
+        # Read like a model message, so the answer ends up as a note in the document context
+        return self.reason
 
-        # Focus on analyzing and understanding user characteristics and needs
-        grok_response = (
-            f"Thank you for sharing! {initial_message.content} "
-            f"Let's dive deeper into what you're looking for and how I can assist further."
+
+LocalTier = Callable[[PreprocessedImage, FrozenSet[str]], Optional[LocalVisionResult]]
+
+
+def reject_unusable_image(image: PreprocessedImage, reject_kinds: FrozenSet[str]) -> Optional[LocalVisionResult]:
+    """Local tier that answers images the CPU analysis is confident are blank, too small or not what is wanted."""
+    analysis = image.analysis
+    if analysis is not None and analysis.confident and analysis.kind in reject_kinds:
+        return LocalVisionResult(analysis.kind, analysis.reason)
+    return None
+
+
+_local_tiers: List[LocalTier] = [reject_unusable_image]
+
+
+def register_local_tier(tier: LocalTier) -> None:
+    """
+    Adds a local tier, tried in registration order before the vision model.
+
+    :param tier: Called with the preprocessed image and the kinds to reject; returns a LocalVisionResult to answer the image, or None to pass it on
+    """
+    _local_tiers.append(tier)
+
+
+async def extract_image_async(image: Union[str, PreprocessedImage], reject_kinds: FrozenSet[str] = LOCAL_REJECT_DOCUMENT_KINDS,
+                              semaphore: Optional[asyncio.Semaphore] = None):
+    """
+    Extracts from one image with the cheapest tier that can answer it.
+
+    Local tiers run first, on statistics computed during preprocessing;
+    images none of them answers escalate to the Grok Vision model.
+
+    :param image: Preprocessed image, or a Base64 string (which always escalates)
+    :param reject_kinds: Image kinds the local tiers may answer
+    :param semaphore: Concurrency cap for the vision call; the worker-wide vision cap if not given
+    :return: A LocalVisionResult, or the vision model result
+    """
+    if not isinstance(image, PreprocessedImage):
+        VISION_ROUTES.inc(tier="remote", kind="unknown")
+        return await process_image_with_grok_async(image, semaphore=semaphore)
+
+    for tier in _local_tiers:
+        result = tier(image, reject_kinds)
+        if result is not None:
+            VISION_ROUTES.inc(tier="local", kind=result.kind)
+            return result
+    analysis = image.analysis
+    kind = "unknown" if analysis is None else analysis.kind if analysis.confident else "uncertain"
+    VISION_ROUTES.inc(tier="remote", kind=kind)
+    return await process_image_with_grok_async(image.data, image.mime_type, image.detail, semaphore=semaphore)
+
+
+async def process_page_stream_with_grok(
+    pages: AsyncIterator[Union[str, PreprocessedImage]],
+    max_concurrency: Optional[int] = None,
+    reject_kinds: FrozenSet[str] = LOCAL_REJECT_DOCUMENT_KINDS,
+) -> list:
+    """
+    Sends pages to the Grok Vision model as soon as they are produced.
+
+    The next page is only pulled from the iterator once a concurrency slot is
+    free, so at most max_concurrency encoded pages are held at a time while
+    the producer keeps rendering ahead of the upstream calls. Pages the local
+    tier answers (see extract_image_async) never reach the model.
+
+    :param pages: Async iterator of Base64 encoded or preprocessed pages, in page order
+    :param max_concurrency: Per-request cap on in-flight calls (defaults to VISION_REQUEST_CONCURRENCY)
+    :param reject_kinds: Page kinds the local tier may answer
+    :return: Vision results in page order
+    """
+    request_semaphore = asyncio.Semaphore(max_concurrency or VISION_REQUEST_CONCURRENCY)
+    tasks = []
+
+    async def _process_page(page: Union[str, PreprocessedImage]):
+        try:
+            return await extract_image_async(page, reject_kinds)
+        finally:
+            request_semaphore.release()
+
+    try:
+        while True:
+            await request_semaphore.acquire()
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                break
+            tasks.append(asyncio.create_task(_process_page(page)))
+            del page
+
+        # gather() keeps results in page order regardless of completion order
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if results and all(isinstance(result, LocalVisionResult) for result in results):
+        raise HTTPException(status_code=422, detail=f"No usable image: {results[0].reason}")
+    return results
+
+
+async def process_images_with_grok(
+    base64_images: List[Union[str, PreprocessedImage]],
+    max_concurrency: Optional[int] = None,
+    reject_kinds: FrozenSet[str] = LOCAL_REJECT_DOCUMENT_KINDS,
+) -> list:
+    """
+    Sends all pages to the Grok Vision model concurrently.
+
+    :param base64_images: Base64 encoded or preprocessed pages, in page order
+    :param max_concurrency: Per-request cap on in-flight calls (defaults to VISION_REQUEST_CONCURRENCY)
+    :param reject_kinds: Page kinds the local tier may answer
+    :return: Vision results in the same order as base64_images
+    """
+    async def _pages():
+        for base64_image in base64_images:
+            yield base64_image
+
+    return await process_page_stream_with_grok(_pages(), max_concurrency, reject_kinds)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) used for budgeting and logging."""
+    return (len(text) + 3) // 4
+
+
+def _message_text(result) -> str:
+    if isinstance(result, str):
+        return result
+    if isinstance(result, dict):
+        return result.get("content") or ""
+    return getattr(result, "content", None) or ""
+
+
+def _extract_json_object(text: str) -> Optional[dict]:
+    """Returns the first JSON object embedded in text (e.g. inside a ```json fence), if any."""
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+            if isinstance(value, dict):
+                return value
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def build_document_context(aggregated_results: list) -> DocumentContext:
+    """
+    Parses the vision results of every page into one merged, validated context.
+
+    Pages whose output is not valid attribute JSON are kept as short notes.
+    """
+    pages, notes = [], []
+    for result in aggregated_results:
+        text = _message_text(result)
+        data = _extract_json_object(text)
+        try:
+            if data is None:
+                raise ValueError("no JSON object in vision output")
+            pages.append(VisionAttributes.model_validate(data))
+        except (ValueError, ValidationError):
+            note = " ".join(text.split())[:DOCUMENT_NOTE_MAX_CHARS]
+            if note:
+                notes.append(note)
+    return DocumentContext(pages=len(aggregated_results), attributes=VisionAttributes.merge(pages), notes=notes)
+
+
+# Attributes given up, in this order, when the context still does not fit: least useful for matching first
+CONTEXT_DROP_ORDER = (
+    ("eye_details", "shape"),
+    ("hair_details", "texture"),
+    ("hair_details", "length"),
+    ("face_shape",),
+    ("skin_tone",),
+    ("eye_details", "color"),
+    ("hair_details", "color"),
+)
+# Caps tried, in characters, on long free-text attribute values
+CONTEXT_VALUE_LIMITS = (120, 60, 30)
+
+
+def _shorten(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text[:limit - 1]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut).rstrip(",;:. ") + "…"
+
+
+def _fit_context_to_budget(context: DocumentContext, token_budget: int) -> str:
+    """
+    Serializes the context, giving up whole fields until it fits the token budget.
+
+    The result is always the complete JSON of a valid DocumentContext: notes
+    go first, then trailing features, then long values are shortened, then
+    attributes are dropped in CONTEXT_DROP_ORDER. If even the bare context is
+    over budget it is returned as is rather than cut.
+    """
+    context = context.model_copy(deep=True)
+    attributes = context.attributes
+
+    def fits() -> bool:
+        return estimate_tokens(context.to_prompt_json()) <= token_budget
+
+    while not fits() and context.notes:
+        context.notes.pop()
+    while not fits() and attributes.other_features:
+        attributes.other_features.pop()
+    for limit in CONTEXT_VALUE_LIMITS:
+        if fits():
+            break
+        for path in CONTEXT_DROP_ORDER:
+            owner = attributes if len(path) == 1 else getattr(attributes, path[0])
+            value = getattr(owner, path[-1])
+            if value is not None:
+                setattr(owner, path[-1], _shorten(value, limit))
+    for path in CONTEXT_DROP_ORDER:
+        if fits():
+            break
+        owner = attributes if len(path) == 1 else getattr(attributes, path[0])
+        setattr(owner, path[-1], None)
+    return context.to_prompt_json()
+
+
+def _build_document_messages(aggregated_results: list) -> list:
+    context = build_document_context(aggregated_results)
+    document_context = _fit_context_to_budget(context, DOCUMENT_CONTEXT_TOKEN_BUDGET)
+    if logger.isEnabledFor(logging.INFO):
+        legacy_tokens = estimate_tokens(" ".join(str(result) for result in aggregated_results))
+        logger.info(
+            "Document context: ~%s tokens as raw messages, ~%s tokens as canonical JSON (%s pages)",
+            legacy_tokens, estimate_tokens(document_context), context.pages,
         )
+    return [
+        {"role": "system", "content": DOCUMENT_SYSTEM_PROMPT},
+        {"role": "user", "content": document_context},
+    ]
+
+
+def process_document_with_text_model(aggregated_results: list) -> dict:
+    try:
+        messages = _build_document_messages(aggregated_results)
+
+        def _call():
+            with track_stage("text_model_call"):
+                response = get_upstream().call(
+                    CHAT_MODEL_NAME, lambda: get_client().chat.completions.create(model=CHAT_MODEL_NAME, messages=messages)
+                )
+            _record_completion(CHAT_MODEL_NAME, response)
+            return response.choices[0].message
+
+        return _single_flight.run(_request_key(CHAT_MODEL_NAME, messages), CHAT_MODEL_NAME, _call)
+    except Exception as e:
+        UPSTREAM_REQUESTS.inc(model=CHAT_MODEL_NAME, outcome="error")
+        logger.error("Error processing document: %s", str(e))
+        raise _upstream_http_error(e, f"Error processing document: {str(e)}")
+
+
+async def process_document_with_text_model_async(aggregated_results: list) -> dict:
+    """Async counterpart of process_document_with_text_model."""
+    try:
+        messages = _build_document_messages(aggregated_results)
+
+        async def _call():
+            with track_stage("text_model_call"):
+                response = await get_upstream().call_async(
+                    CHAT_MODEL_NAME, lambda: get_async_client().chat.completions.create(model=CHAT_MODEL_NAME, messages=messages)
+                )
+            _record_completion(CHAT_MODEL_NAME, response)
+            return response.choices[0].message
+
+        return await _single_flight.run_async(_request_key(CHAT_MODEL_NAME, messages), CHAT_MODEL_NAME, _call)
+    except Exception as e:
+        UPSTREAM_REQUESTS.inc(model=CHAT_MODEL_NAME, outcome="error")
+        logger.error("Error processing document: %s", str(e))
+        raise _upstream_http_error(e, f"Error processing document: {str(e)}")
+
+
+def _build_chat_messages(request: dict, history: Optional[list] = None) -> list:
+    # The static system prompt always comes first and the new question last, so
+    # consecutive turns of a session share their prompt prefix with the upstream cache
+    messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT + FOLLOW_UP_INSTRUCTION}]
+    if history is not None:
+        messages.extend(history)
+    elif request.get("gender"):
+        messages.append({"role": "system", "content": f"Client profile: gender {request['gender']}."})
+    messages.append({"role": "user", "content": request['question']})
+    return messages
+
+
+def generate_response(request: dict, history: Optional[list] = None) -> str:
+    """
+    Generates a response based on the user's request and interaction.
+    Focuses on understanding user preferences, characteristics, and needs.
+
+    The "dive deeper" follow-up is requested in the same call through
+    FOLLOW_UP_INSTRUCTION, so there is a single round trip.
+
+    :param request: Dictionary with the user's question and gender
+    :param history: Session context from SessionManager.history_messages, if the turn belongs to a session
+    """
+    try:
+        started = time.perf_counter()
+        messages = _build_chat_messages(request, history)
+
+        def _call():
+            with track_stage("chat_call"):
+                response = get_upstream().call(
+                    CHAT_MODEL_NAME, lambda: get_client().chat.completions.create(model=CHAT_MODEL_NAME, messages=messages)
+                )
+            _record_completion(CHAT_MODEL_NAME, response)
+            return response.choices[0].message.content
+
+        content = _single_flight.run(_request_key(CHAT_MODEL_NAME, messages), CHAT_MODEL_NAME, _call)
+        logger.info("Chat response completed in %.3fs", time.perf_counter() - started)
+        return content
 
-        # Prepare follow-up messages for continued conversation
-        follow_up_messages = base_messages + [initial_message, {"role": "assistant", "content": grok_response}]
+    except Exception as e:
+        UPSTREAM_REQUESTS.inc(model=CHAT_MODEL_NAME, outcome="error")
+        logger.error(f"Error generating response: {str(e)}")
+        raise _upstream_http_error(e, f"Error processing the request: {str(e)}")
+
+
+async def generate_response_stream(request: dict, history: Optional[list] = None) -> AsyncIterator[str]:
+    """
+    Streams the response to the user's question token by token.
 
-        # Make the second API call to refine or extend the response
-        final_response = client.chat.completions.create(
+    :param request: Dictionary with the user's question and gender
+    :param history: Session context from SessionManager.history_messages, if the turn belongs to a session
+    :return: Async iterator over content deltas as they arrive
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    outcome = "error"
+    try:
+        # Only opening the stream is retried; the limiter slot is freed once the stream is open
+        stream = await get_upstream().call_async(CHAT_MODEL_NAME, lambda: get_async_client().chat.completions.create(
             model=CHAT_MODEL_NAME,
-            messages=follow_up_messages,
+            messages=_build_chat_messages(request, history),
+            stream=True,
+            stream_options={"include_usage": True},
+        ), hedge=False)
+    except Exception:
+        UPSTREAM_REQUESTS.inc(model=CHAT_MODEL_NAME, outcome=outcome)
+        raise
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                record_usage(CHAT_MODEL_NAME, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    STAGE_DURATION.observe(first_token_at - started, stage="chat_first_token", outcome="ok")
+                yield delta
+        outcome = "ok"
+    finally:
+        await stream.close()
+        finished = time.perf_counter()
+        UPSTREAM_REQUESTS.inc(model=CHAT_MODEL_NAME, outcome=outcome)
+        STAGE_DURATION.observe(finished - started, stage="chat_stream", outcome=outcome)
+        logger.info(
+            "Chat stream finished: time to first token %s, total %.3fs",
+            f"{first_token_at - started:.3f}s" if first_token_at is not None else "n/a",
+            finished - started,
         )
 
-        # Extract and process the final response content
-        final_answer = final_response.choices[0].message.content
-        return final_answer
+async def open_response_stream(request: dict, history: Optional[list] = None) -> AsyncIterator[str]:
+    """
+    Starts streaming the response and waits for its first token.
+
+    Failures before anything is sent (open circuit, rate limits, upstream
+    errors) are raised here as an HTTPException with the status the
+    non-streaming path would return; only later failures reach the stream.
 
+    :param request: Dictionary with the user's question and gender
+    :param history: Session context from SessionManager.history_messages, if the turn belongs to a session
+    :return: Async iterator over every content delta, the first one included
+    """
+    tokens = generate_response_stream(request, history)
+    try:
+        first = await tokens.__anext__()
+    except StopAsyncIteration:
+        first = None
     except Exception as e:
-        logger.error(f"Error generating response: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing the request: {str(e)}")
+        logger.error("Error starting response stream: %s", str(e))
+        raise _upstream_http_error(e, f"Error processing the request: {str(e)}")
+    return _resume_stream(first, tokens)
+
+
+async def _resume_stream(first: Optional[str], tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        if first is not None:
+            yield first
+        async for token in tokens:
+            yield token
+    finally:
+        # Closes the upstream stream if the client goes away before the end
+        await tokens.aclose()
+
+def summarize_conversation(summary: str, messages: list) -> str:
+    """
+    Folds conversation messages into a running summary with the chat model.
+
+    :param summary: Summary so far, empty for a new session
+    :param messages: Messages to fold in, oldest first
+    :return: The new summary
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    request_messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Previous summary: {summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+    with track_stage("chat_summary_call"):
+        response = get_upstream().call(
+            CHAT_MODEL_NAME, lambda: get_client().chat.completions.create(model=CHAT_MODEL_NAME, messages=request_messages)
+        )
+    _record_completion(CHAT_MODEL_NAME, response)
+    return response.choices[0].message.content
+
 
 def save_characteristics_to_db(user_id: str, characteristics: dict) -> None:
     """
@@ -235,20 +959,18 @@ def save_characteristics_to_db(user_id: str, characteristics: dict) -> None:
     :param characteristics: Dictionary containing the user's characteristics
     """
     try:
-        # Check if the user already exists
-        user = users_collection.find_one({"user_id": user_id})
-        
-        if user:
-            # If the user exists, update their data
-            users_collection.update_one(
+        # Single round trip: update the user or insert them if they don't exist yet
+        with track_stage("mongo_save_characteristics"):
+            get_users_collection().update_one(
                 {"user_id": user_id},
-                {"$set": {"characteristics": characteristics}}
+                {"$set": {"characteristics": characteristics, "characteristics_updated_at": time.time()}},
+                upsert=True,
             )
-        else:
-            # If the user doesn't exist, insert a new document
-            users_collection.insert_one({"user_id": user_id, "characteristics": characteristics})
         
         logger.debug(f"Successfully saved characteristics for user {user_id}")
+        # Rescore only the match lists this user affects; NumPy is loaded on first use
+        from api.services.match_list_service import notify_characteristics_changed
+        notify_characteristics_changed(user_id)
     except Exception as e:
         logger.error(f"Error saving characteristics to DB: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error saving characteristics to DB: {str(e)}")
@@ -261,7 +983,8 @@ def get_characteristics_from_db(user_id: str) -> dict:
     :return: Dictionary containing the user's characteristics
     """
     try:
-        user = users_collection.find_one({"user_id": user_id})
+        with track_stage("mongo_get_characteristics"):
+            user = get_users_collection().find_one({"user_id": user_id}, {"_id": 0, "characteristics": 1})
         if user:
             return user.get("characteristics", {})
         else:
@@ -284,9 +1007,17 @@ def match_users(user1_id: str, user2_id: str, user1_intentions: dict, user2_inte
     :return: Dictionary with the comparison results
     """
     try:
-        # Get the characteristics of the users from the database
-        user1_characteristics = get_characteristics_from_db(user1_id)
-        user2_characteristics = get_characteristics_from_db(user2_id)
+        # Get the characteristics of both users from the database in one query
+        with track_stage("mongo_get_many"):
+            users = {
+                user["user_id"]: user.get("characteristics", {})
+                for user in get_users_collection().find(
+                    {"user_id": {"$in": [user1_id, user2_id]}},
+                    {"_id": 0, "user_id": 1, "characteristics": 1},
+                )
+            }
+        user1_characteristics = users.get(user1_id)
+        user2_characteristics = users.get(user2_id)
         
         if not user1_characteristics or not user2_characteristics:
             raise HTTPException(status_code=404, detail="One or both users do not have stored characteristics.")
@@ -305,13 +1036,15 @@ def match_users(user1_id: str, user2_id: str, user1_intentions: dict, user2_inte
         """
         
         # Make the request to the Grok model with an updated prompt including intentions
-        response = client.chat.completions.create(
-            model=CHAT_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are an expert matchmaker who analyzes users' characteristics, intentions, and finds compatibility."},
-                {"role": "user", "content": comparison_text}
-            ]
-        )
+        with track_stage("match_call"):
+            response = get_upstream().call(CHAT_MODEL_NAME, lambda: get_client().chat.completions.create(
+                model=CHAT_MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": "You are an expert matchmaker who analyzes users' characteristics, intentions, and finds compatibility."},
+                    {"role": "user", "content": comparison_text}
+                ]
+            ))
+        _record_completion(CHAT_MODEL_NAME, response)
 
         # Extract the comparison result
         matching_result = response.choices[0].message.content
@@ -323,4 +1056,4 @@ def match_users(user1_id: str, user2_id: str, user1_intentions: dict, user2_inte
     
     except Exception as e:
         logger.error(f"Error matching users: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error matching users: {str(e)}")
+        raise _upstream_http_error(e, f"Error matching users: {str(e)}")
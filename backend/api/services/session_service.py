@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+from fastapi import HTTPException
+from api.services.openai_service import estimate_tokens
+from api.utils.metrics import REGISTRY, record_payload, sample_lines, track_stage
+
+logger = logging.getLogger(__name__)
+
+# Conversation session settings
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+# History above this many estimated tokens is compacted into a summary after the turn
+SESSION_HISTORY_MAX_TOKENS = int(os.getenv("SESSION_HISTORY_MAX_TOKENS", "2000"))
+# Most recent messages kept verbatim when the rest is summarized
+SESSION_KEEP_RECENT_MESSAGES = int(os.getenv("SESSION_KEEP_RECENT_MESSAGES", "6"))
+SESSION_SUMMARY_MAX_TOKENS = int(os.getenv("SESSION_SUMMARY_MAX_TOKENS", "300"))
+
+
+class InMemorySessionStore:
+    """Sessions kept in this worker's memory, least recently used first out, expiring after ttl_seconds."""
+
+    def __init__(self, ttl_seconds: int, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session["updated_at"] < time.time() - self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return json.loads(json.dumps(session))
+
+    def save(self, session: dict) -> None:
+        with self._lock:
+            self._sessions[session["session_id"]] = json.loads(json.dumps(session))
+            self._sessions.move_to_end(session["session_id"])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, shared by every worker on the host and kept across restarts."""
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session["session_id"], json.dumps(session), session["updated_at"]),
+            )
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SessionManager:
+    """
+    Conversation history for /generate-response.
+
+    A session holds the client's profile, a running summary and the recent
+    messages. History is laid out so consecutive turns share the longest
+    possible prompt prefix: the summary only changes when the session is
+    compacted, and between compactions messages are only appended. Once the
+    history passes history_max_tokens, older messages are folded into the
+    summary until it is back to about half the budget (keeping at most the
+    last keep_recent messages verbatim), so the per-turn prompt stays
+    bounded however long the conversation runs.
+    """
+
+    def __init__(self, store, history_max_tokens: int, keep_recent: int, summary_max_tokens: int):
+        self.store = store
+        self.history_max_tokens = history_max_tokens
+        self.keep_recent = keep_recent
+        self.summary_max_tokens = summary_max_tokens
+        # Serializes read-modify-write of a session within this worker
+        self._lock = threading.Lock()
+
+    def open(self, session_id: Optional[str], gender: Optional[str] = None) -> dict:
+        """
+        Loads a session, or starts one when no ID is given.
+
+        :param session_id: ID returned by an earlier turn
+        :param gender: Client's gender; updates the stored profile if it changed
+        :return: The session record
+        """
+        now = time.time()
+        if session_id is None:
+            session = {
+                "session_id": uuid.uuid4().hex,
+                "gender": gender,
+                "summary": "",
+                "messages": [],
+                "created_at": now,
+                "updated_at": now,
+            }
+            self.store.save(session)
+            return session
+        session = self.store.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found or expired.")
+        if gender and gender != session.get("gender"):
+            with self._lock:
+                session = self.store.get(session_id) or session
+                session.update(gender=gender, updated_at=now)
+                self.store.save(session)
+        return session
+
+    def history_messages(self, session: dict) -> List[dict]:
+        """
+        Chat messages carrying the session's context, in prefix-stable order.
+
+        :return: Profile and summary as system messages, then the recent messages
+        """
+        messages = []
+        if session.get("gender"):
+            messages.append({"role": "system", "content": f"Client profile: gender {session['gender']}."})
+        if session.get("summary"):
+            messages.append({"role": "system", "content": f"Summary of the conversation so far: {session['summary']}"})
+        recent = list(session.get("messages", []))
+        # Compaction runs after a turn, so a burst of long turns can briefly exceed the budget
+        while recent and self.history_tokens({"summary": session.get("summary", ""), "messages": recent}) > 2 * self.history_max_tokens:
+            recent = recent[2:]
+        messages.extend(recent)
+        record_payload("chat_history", sum(len(message["content"]) for message in messages))
+        return messages
+
+    def history_tokens(self, session: dict) -> int:
+        return estimate_tokens(session.get("summary", "")) + sum(
+            estimate_tokens(message["content"]) for message in session.get("messages", [])
+        )
+
+    def record_turn(self, session_id: str, question: str, answer: str) -> Optional[dict]:
+        """Appends a question and its answer; returns the updated session, or None if it expired meanwhile."""
+        with self._lock:
+            session = self.store.get(session_id)
+            if session is None:
+                return None
+            session["messages"].extend([
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer},
+            ])
+            session["updated_at"] = time.time()
+            self.store.save(session)
+            return session
+
+    def compact(self, session_id: str, summarize: Callable[[str, List[dict]], str]) -> bool:
+        """
+        Folds older messages into the summary if the history is over budget.
+
+        :param summarize: Called with the current summary and the messages to fold in; returns the new summary
+        :return: Whether the session was compacted
+        """
+        session = self.store.get(session_id)
+        if session is None or self.history_tokens(session) <= self.history_max_tokens:
+            return False
+        # Compact down to half the budget so a session is not summarized again on every turn
+        messages = session["messages"]
+        keep = min(self.keep_recent, len(messages))
+        while keep > 2 and self.summary_max_tokens + sum(
+            estimate_tokens(message["content"]) for message in messages[-keep:]
+        ) > self.history_max_tokens // 2:
+            keep -= 2
+        older = messages[:len(messages) - keep]
+        if not older:
+            return False
+
+        with track_stage("session_compaction"):
+            try:
+                summary = summarize(session.get("summary", ""), older)
+            except Exception as e:
+                logger.warning("Session summary failed, compacting without the model: %s", str(e))
+                summary = self._extractive_summary(session.get("summary", ""), older)
+        summary = summary.strip()[:self.summary_max_tokens * 4]
+
+        with self._lock:
+            # Turns may have been appended while the summary was generated; drop only what was summarized
+            current = self.store.get(session_id)
+            if current is None or current["messages"][:len(older)] != older:
+                return False
+            current.update(summary=summary, messages=current["messages"][len(older):], updated_at=time.time())
+            self.store.save(current)
+        logger.info(
+            "Compacted session %s: %s messages folded into a %s-token summary",
+            session_id, len(older), estimate_tokens(summary),
+        )
+        return True
+
+    def delete(self, session_id: str) -> None:
+        self.store.delete(session_id)
+
+    def _extractive_summary(self, summary: str, messages: List[dict]) -> str:
+        # Keeps the opening of each client message; the client's own words carry their preferences
+        said = [" ".join(message["content"].split())[:200] for message in messages if message["role"] == "user"]
+        return " ".join(filter(None, [summary, "The client said: " + " | ".join(said) if said else ""]))
+
+
+_session_manager: Optional[SessionManager] = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """Returns the worker's session manager, creating the configured store on first use."""
+    global _session_manager
+    if _session_manager is None:
+        with _session_manager_lock:
+            if _session_manager is None:
+                if SESSION_STORE_BACKEND == "sqlite":
+                    store = SQLiteSessionStore(SESSION_STORE_PATH, SESSION_TTL_SECONDS)
+                else:
+                    store = InMemorySessionStore(SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS)
+                _session_manager = SessionManager(
+                    store, SESSION_HISTORY_MAX_TOKENS, SESSION_KEEP_RECENT_MESSAGES, SESSION_SUMMARY_MAX_TOKENS,
+                )
+    return _session_manager
+
+
+def _collect_session_metrics() -> List[str]:
+    if _session_manager is None:
+        return []
+    return sample_lines("app_sessions", "Stored conversation sessions.", {"stored": _session_manager.store.count()}, "state")
+
+
+REGISTRY.add_collector(_collect_session_metrics)
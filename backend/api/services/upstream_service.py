@@ -0,0 +1,503 @@
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from api.utils.metrics import REGISTRY, UPSTREAM_HEDGES, UPSTREAM_RETRIES, sample_lines
+
+logger = logging.getLogger(__name__)
+
+# Adaptive concurrency limit on upstream calls (AIMD)
+UPSTREAM_INITIAL_CONCURRENCY = int(os.getenv("UPSTREAM_INITIAL_CONCURRENCY", "16"))
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "1"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+# Calls slower than this count as an overload signal, like a 429
+UPSTREAM_LATENCY_TARGET_SECONDS = float(os.getenv("UPSTREAM_LATENCY_TARGET_SECONDS", "30"))
+UPSTREAM_BACKOFF_RATIO = float(os.getenv("UPSTREAM_BACKOFF_RATIO", "0.5"))
+
+# Retries of idempotent calls
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_BASE_SECONDS", "0.5"))
+# Longest wait before a retry; a larger Retry-After fails the call instead
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", "20"))
+
+# Circuit breaker: opens when this fraction of the last UPSTREAM_BREAKER_WINDOW calls failed server-side
+UPSTREAM_BREAKER_FAILURE_RATIO = float(os.getenv("UPSTREAM_BREAKER_FAILURE_RATIO", "0.5"))
+UPSTREAM_BREAKER_WINDOW = int(os.getenv("UPSTREAM_BREAKER_WINDOW", "20"))
+UPSTREAM_BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+
+# Hedged requests: a second attempt is sent if the first is slower than the given latency percentile.
+# Off by default: the extra attempts add upstream load, so enable it only where p99 matters more than p50
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "0.95"))
+UPSTREAM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_SECONDS", "1.0"))
+# Most hedges per call, on average (hedges beyond the budget are skipped)
+UPSTREAM_HEDGE_BUDGET = float(os.getenv("UPSTREAM_HEDGE_BUDGET", "0.05"))
+# Latency samples needed per model before hedging starts
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+
+RETRYABLE_KINDS = ("rate_limited", "server_error", "timeout", "connection")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Upstream circuit is open; retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+def classify_error(e: Exception) -> Tuple[str, Optional[float]]:
+    """
+    Sorts an upstream exception into a failure kind.
+
+    :return: The kind (rate_limited, server_error, timeout, connection, client_error or error)
+             and the Retry-After delay in seconds if the response carried one
+    """
+    import openai
+
+    if isinstance(e, openai.APIStatusError):
+        retry_after = parse_retry_after(e.response.headers)
+        if e.status_code == 429:
+            return "rate_limited", retry_after
+        if e.status_code >= 500 or e.status_code == 408:
+            return "server_error", retry_after
+        return "client_error", None
+    if isinstance(e, (openai.APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+        return "timeout", None
+    if isinstance(e, openai.APIConnectionError):
+        return "connection", None
+    return "error", None
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Reads retry-after-ms or Retry-After (seconds or an HTTP date) from response headers."""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit that adapts to the upstream's capacity.
+
+    The limit grows by one per window of successful calls while it is being
+    used (additive increase) and is multiplied by backoff_ratio on a 429 or a
+    call slower than latency_target (multiplicative decrease). Only calls
+    started after the last decrease can trigger another one, so a burst of
+    429s from calls sent under the old limit counts once. Usable from the
+    event loop and from worker threads.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float, backoff_ratio: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._sync_waiting = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._condition = threading.Condition(threading.Lock())
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self) -> bool:
+        """Takes a slot only if one is free right now."""
+        with self._condition:
+            if self._has_capacity():
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._sync_waiting += 1
+            try:
+                self._condition.wait_for(self._has_capacity)
+            finally:
+                self._sync_waiting -= 1
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        while True:
+            with self._condition:
+                if self._has_capacity():
+                    self.in_flight += 1
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    else:
+                        # Already woken; pass the wakeup on to the next waiter
+                        self._wake()
+                raise
+
+    def release(self, started: float, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Returns a slot and adjusts the limit.
+
+        :param started: time.monotonic() when the call was sent
+        :param latency: Duration of a successful call; None if it failed or was cancelled
+        :param overloaded: True if the upstream signalled overload (429)
+        """
+        with self._condition:
+            busy = self.in_flight >= int(self.limit) / 2
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.latency_target):
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.minimum), self.limit * self.backoff_ratio)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            elif latency is not None and busy:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._wake()
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters) + self._sync_waiting,
+                "decreases": self.decreases,
+            }
+
+    def _wake(self) -> None:
+        # Called with the lock held; woken waiters re-check capacity themselves
+        free = int(self.limit) - self.in_flight
+        if free <= 0:
+            return
+        self._condition.notify(free)
+        for _ in range(min(free, len(self._waiters))):
+            waiter = self._waiters.popleft()
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    The circuit opens when at least failure_ratio of the last window_size
+    calls failed server-side; scattered transient errors, which retries
+    absorb, do not trip it. While open, calls fail immediately with
+    CircuitOpenError. After reset_seconds one probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_ratio: float, window_size: int, reset_seconds: float):
+        self.reset_seconds = reset_seconds
+        self.failure_ratio = failure_ratio
+        self.state = self.CLOSED
+        self.opens = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+                return True
+            return self.state == self.CLOSED
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def record(self, outcome: str) -> None:
+        """
+        :param outcome: "success" (the upstream answered), "failure" (server-side failure)
+                        or "cancelled" (no answer either way)
+        """
+        with self._lock:
+            self._probe_in_flight = False
+            if outcome == "cancelled":
+                return
+            self._outcomes.append(outcome == "failure")
+            if outcome == "success":
+                if self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            failures = self.failures
+            tripped = failures >= self.failure_ratio * self._outcomes.maxlen
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and tripped):
+                self.opens += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                logger.warning("Upstream circuit opened after %s of the last %s calls failed.", failures, len(self._outcomes))
+
+    @property
+    def failures(self) -> int:
+        """Server-side failures among the recent calls."""
+        return sum(self._outcomes)
+
+
+class UpstreamCaller:
+    """
+    Runs upstream model calls through the limiter, retries and circuit breaker.
+
+    Each attempt waits for a limiter slot, and its outcome feeds both the
+    limiter and the breaker. Failed idempotent calls are retried with full
+    jitter exponential backoff, waiting at least as long as the upstream's
+    Retry-After. Async calls can be hedged: if the first attempt is slower
+    than the hedge percentile of recent latencies, a second one is sent when
+    a limiter slot is free and the hedge budget allows, and the first to
+    succeed wins.
+    """
+
+    # Unused hedge budget that may accumulate, so hedges can come in small bursts
+    HEDGE_BURST = 5.0
+
+    def __init__(self, limiter: AIMDLimiter, breaker: CircuitBreaker, max_retries: int = UPSTREAM_MAX_RETRIES,
+                 backoff_base: float = UPSTREAM_BACKOFF_BASE_SECONDS, backoff_max: float = UPSTREAM_BACKOFF_MAX_SECONDS,
+                 hedge_enabled: bool = UPSTREAM_HEDGE_ENABLED, hedge_percentile: float = UPSTREAM_HEDGE_PERCENTILE,
+                 hedge_min_delay: float = UPSTREAM_HEDGE_MIN_DELAY_SECONDS, hedge_budget: float = UPSTREAM_HEDGE_BUDGET):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self._hedge_tokens = 0.0
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def call(self, model: str, function: Callable, idempotent: bool = True):
+        """
+        Calls function (one upstream request) from a worker thread.
+
+        :param model: Model name, used for latency tracking and metric labels
+        :param function: Performs a single attempt
+        :param idempotent: Whether a failed attempt may be retried
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(model, function)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt, idempotent)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(self, model: str, factory: Callable[[], Awaitable], idempotent: bool = True, hedge: bool = True,
+                         semaphore: Optional[asyncio.Semaphore] = None):
+        """
+        Async counterpart of call.
+
+        :param factory: Returns the awaitable for a single attempt; called once per attempt
+        :param hedge: Allow a hedged second attempt (only if hedging is enabled)
+        :param semaphore: Caller's concurrency cap, held during each attempt and released while backing off
+        """
+        attempt = 0
+        while True:
+            try:
+                async with semaphore if semaphore is not None else contextlib.nullcontext():
+                    if hedge and self.hedge_enabled and idempotent:
+                        return await self._hedged_attempt_async(model, factory)
+                    return await self._attempt_async(model, factory)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Current hedge delay for a model, or None until enough latencies are known."""
+        samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(self.hedge_percentile * len(samples)))
+        return max(samples[index], self.hedge_min_delay)
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.retry_after())
+
+    def _attempt(self, model: str, function: Callable):
+        self._check_breaker()
+        self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            result = function()
+        except BaseException as e:
+            self._record_failure(started, e)
+            raise
+        self._record_success(model, started)
+        return result
+
+    async def _attempt_async(self, model: str, factory: Callable[[], Awaitable], slot_acquired: bool = False,
+                             sample_latency: bool = True):
+        if not slot_acquired:
+            self._check_breaker()
+            try:
+                await self.limiter.acquire_async()
+            except BaseException:
+                self.breaker.record("cancelled")
+                raise
+        started = time.monotonic()
+        try:
+            result = await factory()
+        except BaseException as e:
+            self._record_failure(started, e)
+            raise
+        self._record_success(model, started, sample_latency)
+        return result
+
+    async def _hedged_attempt_async(self, model: str, factory: Callable[[], Awaitable]):
+        delay = self.hedge_delay(model)
+        if delay is None:
+            return await self._attempt_async(model, factory)
+        self._hedge_tokens = min(self._hedge_tokens + self.hedge_budget, self.HEDGE_BURST)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._attempt_async(model, factory))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # A hedge never waits for a slot or probes an open circuit; it only uses spare capacity
+            if (not done and self._hedge_tokens >= 1 and self.breaker.state == CircuitBreaker.CLOSED
+                    and self.limiter.try_acquire()):
+                self._hedge_tokens -= 1
+                UPSTREAM_HEDGES.inc(model=model, outcome="launched")
+                # Only the primary's latency is sampled: fast winning hedges would drag the percentile down
+                tasks.append(asyncio.ensure_future(
+                    self._attempt_async(model, factory, slot_acquired=True, sample_latency=False)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        if task is not primary:
+                            UPSTREAM_HEDGES.inc(model=model, outcome="won")
+                            # The primary took at least this long
+                            self._sample_latency(model, time.monotonic() - started)
+                        return task.result()
+            # Both failed; surface the first attempt's error
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _record_success(self, model: str, started: float, sample_latency: bool = True) -> None:
+        latency = time.monotonic() - started
+        self.limiter.release(started, latency=latency)
+        self.breaker.record("success")
+        if sample_latency:
+            self._sample_latency(model, latency)
+
+    def _sample_latency(self, model: str, latency: float) -> None:
+        self._latencies.setdefault(model, deque(maxlen=256)).append(latency)
+
+    def _record_failure(self, started: float, e: BaseException) -> None:
+        if not isinstance(e, Exception) or isinstance(e, asyncio.CancelledError):
+            self.limiter.release(started)
+            self.breaker.record("cancelled")
+            return
+        kind, _ = classify_error(e)
+        self.limiter.release(started, overloaded=kind == "rate_limited")
+        # A 429 or a rejected request still means the upstream is up
+        self.breaker.record("failure" if kind in ("server_error", "timeout", "connection") else "success")
+
+    def _retry_delay(self, model: str, e: Exception, attempt: int, idempotent: bool) -> Optional[float]:
+        kind, retry_after = classify_error(e)
+        if not idempotent or kind not in RETRYABLE_KINDS or attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            if retry_after > self.backoff_max:
+                return None
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        UPSTREAM_RETRIES.inc(model=model, reason=kind)
+        logger.warning("Upstream %s call failed (%s), retry %s in %.2fs: %s", model, kind, attempt + 1, delay, str(e))
+        return delay
+
+
+_upstream: Optional[UpstreamCaller] = None
+_upstream_lock = threading.Lock()
+
+
+def get_upstream() -> UpstreamCaller:
+    """Returns the worker's upstream caller; its limiter and breaker are shared by every model."""
+    global _upstream
+    if _upstream is None:
+        with _upstream_lock:
+            if _upstream is None:
+                limiter = AIMDLimiter(
+                    UPSTREAM_INITIAL_CONCURRENCY, UPSTREAM_MIN_CONCURRENCY, UPSTREAM_MAX_CONCURRENCY,
+                    UPSTREAM_LATENCY_TARGET_SECONDS, UPSTREAM_BACKOFF_RATIO,
+                )
+                breaker = CircuitBreaker(
+                    UPSTREAM_BREAKER_FAILURE_RATIO, UPSTREAM_BREAKER_WINDOW, UPSTREAM_BREAKER_RESET_SECONDS,
+                )
+                _upstream = UpstreamCaller(limiter, breaker)
+    return _upstream
+
+
+def _collect_upstream_metrics() -> List[str]:
+    upstream = _upstream
+    if upstream is None:
+        return []
+    breaker = upstream.breaker
+    state = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[breaker.state]
+    return (
+        sample_lines("app_upstream_limiter", "Adaptive upstream concurrency limiter state.", upstream.limiter.stats(), "stat")
+        + sample_lines(
+            "app_upstream_circuit",
+            "Upstream circuit breaker (state: 0 closed, 1 half-open, 2 open).",
+            {"state": state, "recent_failures": breaker.failures, "opens": breaker.opens},
+            "stat",
+        )
+    )
+
+
+REGISTRY.add_collector(_collect_upstream_metrics)
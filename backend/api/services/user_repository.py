@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from api.utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+# MongoDB connection pool settings
+MONGO_URI = os.getenv("MONGO_URI")
+# Every collection, read by the async repository or the sync match list maintainer, lives in this database
+MONGO_DATABASE = os.getenv("MONGO_DATABASE", "user_database")
+USERS_COLLECTION = "users"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+# Bulk writes are split into batches of this many operations
+MONGO_BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", "1000"))
+
+CHARACTERISTICS_PROJECTION = {"_id": 0, "user_id": 1, "characteristics": 1}
+
+
+class UserRepository:
+    """
+    Async access to the users collection.
+
+    Every operation is a single round trip: writes are upserts keyed on the
+    unique user_id index and reads project only the requested fields. The
+    collection is injected, so a local mongod or any in-memory stand-in with
+    the same async collection interface can be used.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("user_id", unique=True)
+
+    async def save_characteristics(self, user_id: str, characteristics: dict) -> None:
+        """
+        Saves a user's characteristics, creating the user if needed.
+
+        :param user_id: User's ID
+        :param characteristics: Dictionary containing the user's characteristics
+        """
+        with track_stage("mongo_save_characteristics"):
+            await self.collection.update_one(
+                {"user_id": user_id},
+                {"$set": {"characteristics": characteristics, "characteristics_updated_at": time.time()}},
+                upsert=True,
+            )
+        from api.services.match_list_service import notify_characteristics_changed
+        notify_characteristics_changed(user_id)
+
+    async def get_characteristics(self, user_id: str) -> dict:
+        """
+        Retrieves a user's characteristics.
+
+        :param user_id: User's ID
+        :return: Dictionary containing the user's characteristics, empty if the user is unknown
+        """
+        with track_stage("mongo_get_characteristics"):
+            user = await self.collection.find_one({"user_id": user_id}, CHARACTERISTICS_PROJECTION)
+        return user.get("characteristics", {}) if user else {}
+
+    async def get_many(self, user_ids: Iterable[str], fields: Iterable[str] = ("characteristics",)) -> Dict[str, dict]:
+        """
+        Retrieves several users with one $in query.
+
+        :param user_ids: IDs of the users to fetch
+        :param fields: Top-level fields to return for each user
+        :return: Mapping of user_id to the projected document; unknown users are absent
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        projection = {"_id": 0, "user_id": 1, **{field: 1 for field in fields}}
+        with track_stage("mongo_get_many"):
+            cursor = self.collection.find({"user_id": {"$in": user_ids}}, projection)
+            return {document["user_id"]: document async for document in cursor}
+
+    async def save_many(self, characteristics_by_user: Dict[str, dict]) -> int:
+        """
+        Upserts characteristics for many users with unordered bulk writes.
+
+        :param characteristics_by_user: Mapping of user_id to characteristics
+        :return: Number of documents inserted or modified
+        """
+        from pymongo import UpdateOne
+        from api.services.match_list_service import start_match_list_maintainer
+
+        now = time.time()
+        operations = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$set": {"characteristics": characteristics, "characteristics_updated_at": now}},
+                upsert=True,
+            )
+            for user_id, characteristics in characteristics_by_user.items()
+        ]
+        written = 0
+        for start in range(0, len(operations), MONGO_BULK_BATCH_SIZE):
+            with track_stage("mongo_save_many"):
+                result = await self.collection.bulk_write(operations[start:start + MONGO_BULK_BATCH_SIZE], ordered=False)
+            written += result.upserted_count + result.modified_count
+        # Bulk imports are picked up by the match list reconciler rather than queued one by one
+        start_match_list_maintainer()
+        return written
+
+
+_mongo_client = None
+_sync_mongo_client = None
+_sync_client_lock = threading.Lock()
+_user_repository: Optional[UserRepository] = None
+
+
+def _client_options() -> dict:
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "retryWrites": True,
+    }
+
+
+def get_mongo_client():
+    """Returns the shared async MongoDB client with the tuned connection pool."""
+    global _mongo_client
+    if _mongo_client is None:
+        from pymongo import AsyncMongoClient
+        _mongo_client = AsyncMongoClient(MONGO_URI, **_client_options())
+    return _mongo_client
+
+
+def get_database():
+    """Returns the configured database on the shared async client."""
+    return get_mongo_client()[MONGO_DATABASE]
+
+
+def get_sync_database():
+    """
+    Returns the configured database on the shared synchronous client.
+
+    Only for code that runs in worker threads (the match list maintainer,
+    the threadpool profile index and the legacy sync helpers); it uses the
+    same URI, database and pool settings as the async client.
+    """
+    global _sync_mongo_client
+    if _sync_mongo_client is None:
+        with _sync_client_lock:
+            if _sync_mongo_client is None:
+                from pymongo import MongoClient
+                _sync_mongo_client = MongoClient(MONGO_URI, **_client_options())
+    return _sync_mongo_client[MONGO_DATABASE]
+
+
+def get_users_collection():
+    """Returns the users collection of the shared synchronous client."""
+    return get_sync_database()[USERS_COLLECTION]
+
+
+async def get_user_repository() -> UserRepository:
+    """Returns the shared repository, creating the unique user_id index on first use."""
+    global _user_repository
+    if _user_repository is None:
+        repository = UserRepository(get_database()[USERS_COLLECTION])
+        await repository.ensure_indexes()
+        _user_repository = repository
+    return _user_repository
+
+
+async def ping() -> None:
+    """Raises if MongoDB cannot be reached within the server selection timeout."""
+    await get_mongo_client().admin.command("ping")
+
+
+async def close_mongo_client() -> None:
+    """Closes the shared clients if they were created; called on application shutdown."""
+    global _mongo_client, _sync_mongo_client, _user_repository
+    if _mongo_client is not None:
+        await _mongo_client.close()
+    if _sync_mongo_client is not None:
+        _sync_mongo_client.close()
+    _mongo_client = _sync_mongo_client = None
+    _user_repository = None
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Tuple
+from api.utils.metrics import track_stage
+
+# NumPy and PIL are imported on first use to keep worker startup fast
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Local (CPU-only) image analysis settings
+LOCAL_VISION_ENABLED = os.getenv("LOCAL_VISION_ENABLED", "true").lower() == "true"
+# Color statistics are computed at this long edge; they are stable well below it
+ANALYSIS_MAX_EDGE = 256
+# Ink and layout are measured at up to this long edge, where a single line of small text still shows
+INK_ANALYSIS_MAX_EDGE = 2048
+# Shorter side, in source pixels, below which an upload is too small to describe a person
+LOCAL_VISION_MIN_EDGE = int(os.getenv("LOCAL_VISION_MIN_EDGE", "96"))
+# Difference (0-255) from the background level, in any channel, that counts a pixel as ink; far above sensor and JPEG noise
+LOCAL_VISION_INK_CONTRAST = int(os.getenv("LOCAL_VISION_INK_CONTRAST", "48"))
+# An image is blank only if at most this many pixels are ink
+LOCAL_VISION_BLANK_MAX_INK_PIXELS = int(os.getenv("LOCAL_VISION_BLANK_MAX_INK_PIXELS", "16"))
+# Separate bands of ink rows a page needs before it is confidently taken for a text document
+LOCAL_VISION_DOCUMENT_MIN_LINES = int(os.getenv("LOCAL_VISION_DOCUMENT_MIN_LINES", "5"))
+
+PHOTO, DOCUMENT, GRAPHIC, BLANK, TOO_SMALL = "photo", "document", "graphic", "blank", "too_small"
+
+
+@dataclass
+class ImageAnalysis:
+    """What cheap image statistics say about an image, and how sure they are."""
+    kind: str
+    confident: bool
+    reason: str
+    stats: Dict[str, float] = field(default_factory=dict)
+
+
+def _classify(stats: Dict[str, float], original_size: Tuple[int, int]) -> ImageAnalysis:
+    if min(original_size) < LOCAL_VISION_MIN_EDGE:
+        return ImageAnalysis(TOO_SMALL, True, f"Image is {original_size[0]}x{original_size[1]}, below the {LOCAL_VISION_MIN_EDGE} px minimum.", stats)
+    # Blank only with next to no ink at near-full resolution; a single line on an empty form is not blank
+    if stats["ink_pixels"] <= LOCAL_VISION_BLANK_MAX_INK_PIXELS:
+        return ImageAnalysis(BLANK, True, "Image is blank.", stats)
+
+    # Text pages: ink on a plain background in many thin, separate rows and nothing taller. A portrait on
+    # a white backdrop has the same tones, but the figure is one tall band, so it is never a confident document
+    if (stats["paper_fraction"] >= 0.6 and 0.002 <= stats["ink_fraction"] <= 0.3 and stats["mean_saturation"] <= 0.1
+            and stats["text_lines"] >= LOCAL_VISION_DOCUMENT_MIN_LINES and stats["tallest_line"] <= 0.04):
+        return ImageAnalysis(DOCUMENT, True, "Image looks like a document, not a photo.", stats)
+    if stats["bright_fraction"] >= 0.45 and stats["midtone_fraction"] <= 0.35 and stats["mean_saturation"] <= 0.15:
+        return ImageAnalysis(DOCUMENT, False, "Image may be a document.", stats)
+
+    # Flat-color artwork and screenshots: a handful of exact colors cover almost every pixel. Counting exact
+    # colors, and requiring some color, keeps out black-and-white photos on a cut-out background
+    if stats["exact_colors_coverage"] >= 0.85 and stats["flat_fraction"] >= 0.6 and stats["mean_saturation"] >= 0.05:
+        return ImageAnalysis(GRAPHIC, True, "Image looks like a graphic or screenshot, not a photo.", stats)
+    if stats["top_colors_coverage"] >= 0.75 and stats["flat_fraction"] >= 0.45:
+        return ImageAnalysis(GRAPHIC, False, "Image may be a graphic or screenshot.", stats)
+
+    return ImageAnalysis(PHOTO, stats["top_colors_coverage"] < 0.6, "Image looks like a photo.", stats)
+
+
+def analyze_image(image: Image.Image, original_size: Tuple[int, int] = None) -> ImageAnalysis:
+    """Classifies an image as photo, document, graphic, blank or too small from pixel statistics.
+
+    Args:
+        image (Image.Image): PIL image object, at any resolution.
+        original_size (tuple): Size of the source upload, if the image was already downscaled.
+
+    Returns:
+        ImageAnalysis: The kind of image, whether the call is confident, and the statistics behind it.
+    """
+    import numpy as np
+    from PIL import Image
+
+    with track_stage("image_analysis"):
+        small = image.convert("RGB")
+        ink_stats = _ink_stats(small)
+        if max(small.size) > ANALYSIS_MAX_EDGE:
+            small.thumbnail((ANALYSIS_MAX_EDGE, ANALYSIS_MAX_EDGE), Image.BILINEAR)
+        rgb = np.asarray(small, dtype=np.uint8)
+        pixels = rgb.astype(np.float32)
+
+        luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        high, low = pixels.max(axis=2), pixels.min(axis=2)
+        saturation = np.where(high > 0, (high - low) / np.maximum(high, 1.0), 0.0)
+
+        # Share of pixels in the 8 most common colors, at 4 bits per channel
+        quantized = rgb >> 4
+        codes = (quantized[..., 0].astype(np.int32) << 8) | (quantized[..., 1].astype(np.int32) << 4) | quantized[..., 2]
+        counts = np.bincount(codes.ravel(), minlength=4096)
+        top_colors = np.partition(counts, -8)[-8:].sum() / codes.size
+
+        # Share of pixels in the 8 most common exact colors
+        _, exact_counts = np.unique(
+            (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2], return_counts=True,
+        )
+        exact_colors = np.sort(exact_counts)[-8:].sum() / codes.size
+
+        # Pixels identical to their right and lower neighbors: flat fills keep them after downscaling,
+        # while sensor noise, even averaged down to under one level, almost never matches in all three channels
+        flat = (rgb[:-1, 1:] == rgb[:-1, :-1]).all(axis=2) & (rgb[1:, :-1] == rgb[:-1, :-1]).all(axis=2)
+
+        stats = {
+            "luminance_mean": float(luminance.mean()),
+            "luminance_stddev": float(luminance.std()),
+            "mean_saturation": float(saturation.mean()),
+            "bright_fraction": float((luminance > 200).mean()),
+            "dark_fraction": float((luminance < 100).mean()),
+            "midtone_fraction": float(((luminance >= 100) & (luminance <= 200)).mean()),
+            "top_colors_coverage": float(top_colors),
+            "exact_colors_coverage": float(exact_colors),
+            "flat_fraction": float(flat.mean()) if flat.size else 1.0,
+            **ink_stats,
+        }
+    return _classify(stats, original_size or image.size)
+
+
+def _ink_stats(image: Image.Image) -> Dict[str, float]:
+    """Ink against the background (most common) level of each channel, and how it is laid out in rows."""
+    import numpy as np
+
+    if max(image.size) > INK_ANALYSIS_MAX_EDGE:
+        image = image.reduce(-(-max(image.size) // INK_ANALYSIS_MAX_EDGE))
+    # A pixel off the background in any channel is ink, so shapes of another hue but equal brightness count too
+    ink_pixels = 0
+    for histogram in np.array(image.histogram()).reshape(-1, 256):
+        distance = np.abs(np.arange(256) - int(histogram.argmax()))
+        ink_pixels = max(ink_pixels, int(histogram[distance > LOCAL_VISION_INK_CONTRAST].sum()))
+
+    # Bands of consecutive rows with anything off the background (faint enough to include skin on a white
+    # backdrop, so a figure forms one band), ignoring rows with a single stray pixel
+    gray = image.convert("L")
+    histogram = np.array(gray.histogram())
+    paper = np.abs(np.arange(256) - int(histogram.argmax())) <= LOCAL_VISION_INK_CONTRAST // 2
+    marked = np.asarray(gray.point((~paper).astype(np.uint8).tolist()))
+    rows = np.concatenate(([False], marked.sum(axis=1, dtype=np.int32) >= 2, [False]))
+    edges = np.flatnonzero(rows[1:] != rows[:-1])
+    heights = edges[1::2] - edges[::2]
+    return {
+        "ink_pixels": ink_pixels,
+        "ink_fraction": ink_pixels / (gray.width * gray.height),
+        "paper_fraction": float(histogram[paper].sum() / histogram.sum()),
+        "text_lines": len(heights),
+        "tallest_line": float(heights.max() / gray.height) if len(heights) else 0.0,
+    }
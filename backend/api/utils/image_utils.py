@@ -1,8 +1,123 @@
+from __future__ import annotations
+
 import base64
-from PIL import Image
 import io
-from typing import List
-from pdf2image import convert_from_path
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Tuple
+from api.utils.image_analysis import LOCAL_VISION_ENABLED, ImageAnalysis, analyze_image
+from api.utils.metrics import record_payload, track_stage
+
+# PIL and pdf2image are imported on first use to keep worker startup fast
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Resource limits for a single upload
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "20"))
+MAX_RSS_BYTES = int(os.getenv("MAX_RSS_BYTES", str(1024 * 1024 * 1024)))
+PDF_DPI = int(os.getenv("PDF_DPI", "200"))
+COPY_CHUNK_SIZE = 1024 * 1024
+# Raw bytes per streamed Base64 chunk; a multiple of 3, so the chunks concatenate into one valid encoding
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+# Default budget for images sent to the vision model
+IMAGE_MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", "1568"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(1568 * 1568)))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(512 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MIN_JPEG_QUALITY = 40
+# Images whose both sides fit in this size gain nothing from "high" detail
+LOW_DETAIL_MAX_EDGE = 512
+PDF_GRAYSCALE = os.getenv("PDF_GRAYSCALE", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceLimitError(ValueError):
+    """Raised when an upload exceeds a configured size, page or memory limit."""
+
+
+@dataclass
+class PreprocessedImage:
+    """An image re-encoded for the vision model, with before/after sizes."""
+    data: bytes
+    format: str
+    original_bytes: int
+    original_size: Tuple[int, int]
+    size: Tuple[int, int]
+    # Local classification, used to answer or reject the image without the vision model
+    analysis: Optional[ImageAnalysis] = None
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format.lower()}"
+
+    @property
+    def detail(self) -> str:
+        return "low" if max(self.size) <= LOW_DETAIL_MAX_EDGE else "high"
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+def base64_length(size: int) -> int:
+    """Length of the Base64 encoding of size bytes."""
+    return 4 * ((size + 2) // 3)
+
+
+def iter_base64(data, chunk_size: int = BASE64_CHUNK_SIZE) -> Iterator[bytes]:
+    """Encodes bytes-like data to Base64 a chunk at a time, without copying the input or the whole output."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield base64.b64encode(view[start:start + chunk_size])
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Returns the resident set size of this process, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def check_memory_ceiling(max_rss_bytes: Optional[int] = None) -> None:
+    """Raises ResourceLimitError if the process RSS is above the ceiling."""
+    limit = max_rss_bytes or MAX_RSS_BYTES
+    rss = current_rss_bytes()
+    if rss is not None and rss > limit:
+        raise ResourceLimitError(f"Worker memory {rss} bytes exceeds the {limit} byte ceiling.")
+
+
+def upload_size(upload_file: BinaryIO) -> int:
+    """Returns the size of a seekable upload without reading it into memory."""
+    upload_file.seek(0, os.SEEK_END)
+    size = upload_file.tell()
+    upload_file.seek(0)
+    return size
+
+
+def check_upload_size(upload_file: BinaryIO, max_bytes: Optional[int] = None) -> int:
+    """Raises ResourceLimitError if the upload is larger than max_bytes; returns its size."""
+    limit = max_bytes or MAX_UPLOAD_BYTES
+    size = upload_size(upload_file)
+    record_payload("upload", size)
+    if size > limit:
+        raise ResourceLimitError(f"Upload of {size} bytes exceeds the {limit} byte limit.")
+    return size
+
+
+def copy_upload_to_file(upload_file: BinaryIO, destination: BinaryIO) -> None:
+    """Copies an upload to destination in fixed-size chunks instead of one full read."""
+    upload_file.seek(0)
+    with track_stage("upload_copy"):
+        shutil.copyfileobj(upload_file, destination, COPY_CHUNK_SIZE)
+        destination.flush()
 
 def encode_image_to_base64(image_file: io.BytesIO) -> str:
     """Encodes an image file to Base64."""
@@ -23,12 +138,271 @@ def convert_pdf_to_images(pdf_path: str, dpi: int = 200) -> List[Image.Image]:
     Returns:
         List[Image.Image]: List of images in PIL format.
     """
+    from pdf2image import convert_from_path
+
     try:
         images = convert_from_path(pdf_path, dpi=dpi)
         return images
     except Exception as e:
         raise ValueError(f"Error converting PDF to images: {e}")
 
+def count_pdf_pages(pdf_path: str, max_pages: Optional[int] = None) -> int:
+    """Returns the page count of a PDF, enforcing the page limit.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        max_pages (int): Maximum number of pages accepted (default is MAX_PDF_PAGES).
+
+    Returns:
+        int: Number of pages.
+    """
+    from pdf2image import pdfinfo_from_path
+
+    max_pages = max_pages or MAX_PDF_PAGES
+    try:
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    except Exception as e:
+        raise ValueError(f"Error reading PDF info: {e}")
+
+    if page_count > max_pages:
+        raise ResourceLimitError(f"PDF has {page_count} pages, the limit is {max_pages}.")
+    return page_count
+
+
+def render_pdf_page(pdf_path: str, page_number: int, dpi: Optional[int] = None) -> Image.Image:
+    """Rasterizes a single PDF page.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_number (int): 1-based page number.
+        dpi (int): Image resolution in DPI (default is PDF_DPI).
+
+    Returns:
+        Image.Image: The page in PIL format.
+    """
+    from pdf2image import convert_from_path
+
+    check_memory_ceiling()
+    try:
+        with track_stage("pdf_rasterize"):
+            images = convert_from_path(pdf_path, dpi=dpi or PDF_DPI, first_page=page_number, last_page=page_number)
+    except Exception as e:
+        raise ValueError(f"Error converting PDF page {page_number} to image: {e}")
+    return images[0]
+
+
+def iter_pdf_pages(pdf_path: str, dpi: Optional[int] = None, max_pages: Optional[int] = None) -> Iterator[Image.Image]:
+    """Rasterizes a PDF one page at a time.
+
+    Only the page being yielded is held in memory, so peak usage does not
+    grow with the page count.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        dpi (int): Image resolution in DPI (default is PDF_DPI).
+        max_pages (int): Maximum number of pages accepted (default is MAX_PDF_PAGES).
+
+    Yields:
+        Image.Image: Each page in PIL format, in page order.
+    """
+    for page_number in range(1, count_pdf_pages(pdf_path, max_pages) + 1):
+        yield render_pdf_page(pdf_path, page_number, dpi)
+
+
+def render_pdf_page_preprocessed(
+    pdf_path: str,
+    page_number: int,
+    dpi: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+) -> PreprocessedImage:
+    """Rasterizes and preprocesses a single PDF page.
+
+    Self-contained and picklable, so pages can be rendered in a process pool.
+    """
+    image = render_pdf_page(pdf_path, page_number, dpi)
+    try:
+        return preprocess_image(
+            image,
+            max_bytes=max_bytes,
+            max_pixels=max_pixels,
+            grayscale=PDF_GRAYSCALE if grayscale is None else grayscale,
+        )
+    finally:
+        image.close()
+
+
+def iter_pdf_pages_preprocessed(
+    pdf_path: str,
+    dpi: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+) -> Iterator[PreprocessedImage]:
+    """Rasterizes and preprocesses a PDF one page at a time.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        dpi (int): Image resolution in DPI (default is PDF_DPI).
+        max_pages (int): Maximum number of pages accepted (default is MAX_PDF_PAGES).
+        max_bytes (int): Encoded size budget per page (default is IMAGE_MAX_BYTES).
+        max_pixels (int): Pixel budget per page (default is IMAGE_MAX_PIXELS).
+        grayscale (bool): Convert pages to grayscale (default is PDF_GRAYSCALE).
+
+    Yields:
+        PreprocessedImage: Each page ready for the vision model, in page order.
+    """
+    if grayscale is None:
+        grayscale = PDF_GRAYSCALE
+    for image in iter_pdf_pages(pdf_path, dpi=dpi, max_pages=max_pages):
+        try:
+            yield preprocess_image(image, max_bytes=max_bytes, max_pixels=max_pixels, grayscale=grayscale)
+        finally:
+            image.close()
+
+
+def _fit_size(size: Tuple[int, int], max_long_edge: int, max_pixels: int) -> Tuple[int, int]:
+    width, height = size
+    scale = min(1.0, max_long_edge / max(width, height), (max_pixels / (width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _choose_format(image: Image.Image) -> str:
+    # Few distinct colors (screenshots, line art, clean scans) compress better losslessly
+    if image.mode in ("1", "P") or image.getcolors(256) is not None:
+        return "PNG"
+    return "JPEG"
+
+
+def _encode(image: Image.Image, format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if format == "JPEG":
+        image.save(buffer, format=format, quality=quality, optimize=True)
+    else:
+        image.save(buffer, format=format, optimize=True)
+    return buffer.getvalue()
+
+
+def preprocess_image(
+    image: Image.Image,
+    max_long_edge: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    grayscale: bool = False,
+    format: Optional[str] = None,
+    original_bytes: Optional[int] = None,
+) -> PreprocessedImage:
+    """Shrinks an image to fit the vision payload budget.
+
+    Applies the EXIF orientation, downscales to the long-edge and pixel
+    budget, optionally converts to grayscale, then lowers JPEG quality
+    (and finally the resolution) until the encoded bytes fit max_bytes.
+
+    Args:
+        image (Image.Image): PIL image object.
+        max_long_edge (int): Longest side in pixels (default is IMAGE_MAX_LONG_EDGE).
+        max_bytes (int): Encoded size budget (default is IMAGE_MAX_BYTES).
+        max_pixels (int): Pixel budget (default is IMAGE_MAX_PIXELS).
+        grayscale (bool): Convert to grayscale, useful for document scans.
+        format (str): Force 'JPEG' or 'PNG' instead of choosing from the content.
+        original_bytes (int): Size of the source upload, for reporting.
+
+    Returns:
+        PreprocessedImage: Encoded image with before/after sizes.
+    """
+    from PIL import Image, ImageOps
+
+    max_long_edge = max_long_edge or IMAGE_MAX_LONG_EDGE
+    max_bytes = max_bytes or IMAGE_MAX_BYTES
+    max_pixels = max_pixels or IMAGE_MAX_PIXELS
+    original_size = image.size
+
+    try:
+        with track_stage("image_preprocess"):
+            image = ImageOps.exif_transpose(image)
+            target_size = _fit_size(image.size, max_long_edge, max_pixels)
+            if target_size != image.size:
+                image = image.resize(target_size, Image.LANCZOS)
+
+            # Analyzed before any grayscale conversion, which would hide the color statistics
+            analysis = analyze_image(image, original_size) if LOCAL_VISION_ENABLED else None
+
+            if grayscale:
+                image = image.convert("L")
+            elif image.mode not in ("RGB", "L"):
+                if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+                    rgba = image.convert("RGBA")
+                    image = Image.new("RGB", rgba.size, (255, 255, 255))
+                    image.paste(rgba, mask=rgba.getchannel("A"))
+                else:
+                    image = image.convert("RGB")
+
+            format = (format or _choose_format(image)).upper()
+            quality = IMAGE_JPEG_QUALITY
+            data = _encode(image, format, quality)
+            while len(data) > max_bytes:
+                if format == "JPEG" and quality > IMAGE_MIN_JPEG_QUALITY:
+                    quality = max(IMAGE_MIN_JPEG_QUALITY, quality - 10)
+                elif min(image.size) > 64:
+                    image = image.resize(_fit_size(image.size, int(max(image.size) * 0.75), max_pixels), Image.LANCZOS)
+                else:
+                    break
+                data = _encode(image, format, quality)
+    except Exception as e:
+        raise ValueError(f"Error preprocessing image: {e}")
+
+    if original_bytes is None:
+        # Rasterized pages have no source file; report the raw bitmap size
+        original_bytes = original_size[0] * original_size[1] * 3
+    result = PreprocessedImage(
+        data=data,
+        format=format,
+        original_bytes=original_bytes,
+        original_size=original_size,
+        size=image.size,
+        analysis=analysis,
+    )
+    record_payload("image_original", result.original_bytes)
+    record_payload("image_preprocessed", len(data))
+    logger.info(
+        "Preprocessed image %sx%s (%s bytes) -> %sx%s %s q=%s (%s bytes)",
+        original_size[0], original_size[1], result.original_bytes,
+        result.size[0], result.size[1], format, quality if format == "JPEG" else "-", len(data),
+    )
+    return result
+
+
+def preprocess_image_file(
+    image_file: BinaryIO,
+    max_long_edge: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    grayscale: bool = False,
+) -> PreprocessedImage:
+    """Decodes an uploaded image file and preprocesses it for the vision model."""
+    from PIL import Image
+
+    try:
+        original_bytes = upload_size(image_file)
+        image = Image.open(image_file)
+        # Let the JPEG decoder downscale by a power of two while decoding
+        draft_edge = max_long_edge or IMAGE_MAX_LONG_EDGE
+        image.draft("RGB", (draft_edge, draft_edge))
+    except Exception as e:
+        raise ValueError(f"Error decoding image: {e}")
+    with image:
+        return preprocess_image(
+            image,
+            max_long_edge=max_long_edge,
+            max_bytes=max_bytes,
+            max_pixels=max_pixels,
+            grayscale=grayscale,
+            original_bytes=original_bytes,
+        )
+
+
 def pil_image_to_base64(pil_image: Image.Image, format: str = "JPEG") -> str:
     """Converts a PIL image object to Base64.
 
@@ -45,3 +419,15 @@ def pil_image_to_base64(pil_image: Image.Image, format: str = "JPEG") -> str:
         return base64.b64encode(buffer.getvalue()).decode("utf-8")
     except Exception as e:
         raise ValueError(f"Error converting PIL image to Base64: {e}")
+
+
+def preprocess_image_path(
+    image_path: str,
+    max_long_edge: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    grayscale: bool = False,
+) -> PreprocessedImage:
+    """Preprocesses an image stored on disk; picklable for use in a process pool."""
+    with open(image_path, "rb") as image_file:
+        return preprocess_image_file(image_file, max_long_edge, max_bytes, max_pixels, grayscale)
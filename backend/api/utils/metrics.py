@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Add a Server-Timing header with per-stage durations to every response
+TIMING_HEADERS_ENABLED = os.getenv("TIMING_HEADERS_ENABLED", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(kb * 1024 for kb in (1, 10, 100, 256, 512, 1024, 2048, 5120, 10240, 20480))
+
+# Stage timings of the request being handled; the list is shared with threads and tasks it spawns
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            # Per-bucket counts followed by sum and count
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0.0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += state[i]
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    """Holds metrics plus collectors that render gauges from live state at scrape time."""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "app_http_request_duration_seconds", "HTTP request latency.", ["method", "route", "status"],
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "app_stage_duration_seconds", "Duration of a processing stage.", ["stage", "outcome"],
+))
+PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "app_payload_bytes", "Size of payloads handled by a stage.", ["stage"], buckets=SIZE_BUCKETS,
+))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "app_upstream_requests_total", "Upstream model requests by outcome (ok, error, cache_hit, coalesced).", ["model", "outcome"],
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "app_upstream_retries_total", "Retried upstream attempts by failure kind.", ["model", "reason"],
+))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+    "app_upstream_hedges_total", "Hedged upstream attempts (launched, won).", ["model", "outcome"],
+))
+UPSTREAM_TOKENS = REGISTRY.register(Counter(
+    "app_upstream_tokens_total", "Tokens reported in the completion usage field.", ["model", "kind"],
+))
+VISION_ROUTES = REGISTRY.register(Counter(
+    "app_vision_routes_total", "Images answered by the local tier or escalated to the vision model, by local classification.", ["tier", "kind"],
+))
+
+
+def sample_lines(name: str, documentation: str, values: Dict[str, float], label: str, metric_type: str = "gauge") -> List[str]:
+    """Renders one labelled metric from live values; used by collectors registered with REGISTRY.add_collector."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{{{label}="{_escape(key)}"}} {_format_value(value)}')
+    return lines
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Times a block as a stage; the outcome label is "error" if it raises."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_DURATION.observe(duration, stage=stage, outcome=outcome)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def record_payload(stage: str, size: int) -> None:
+    PAYLOAD_BYTES.observe(size, stage=stage)
+
+
+def record_usage(model: str, usage) -> None:
+    """Counts prompt and completion tokens from a completion's usage field."""
+    if usage is None:
+        return
+    UPSTREAM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    UPSTREAM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+    # Prompt tokens served from the upstream's prefix cache, when the provider reports them
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None:
+        UPSTREAM_TOKENS.inc(getattr(details, "cached_tokens", 0) or 0, model=model, kind="cached_prompt")
+
+
+def start_request_timings() -> List[Tuple[str, float]]:
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def clear_request_timings() -> None:
+    _request_timings.set(None)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """Formats stage timings as a Server-Timing header; repeated stages are summed."""
+    totals: Dict[str, float] = {}
+    for stage, duration in list(timings):
+        totals[stage] = totals.get(stage, 0.0) + duration
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in totals.items())
+
+
+def render_latest() -> str:
+    return REGISTRY.render()
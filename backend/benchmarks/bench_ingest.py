@@ -0,0 +1,158 @@
+"""
+Throughput benchmark for batch ingestion against the local mock LLM.
+
+Builds a zip of distinct profile photos, then imports it two ways and
+reports sustained images/sec:
+
+    one-at-a-time  decode, preprocess, vision call and save per image, in
+                   sequence, the way /validate-document imports are done
+    pipeline       IngestManager: process-pool preprocessing, concurrent
+                   vision calls and bulk writes, joined by bounded queues
+
+With MONGO_URI set, users are written to a throwaway database that is
+dropped afterwards; without it the save step is skipped in both modes.
+
+    cd backend && python -m benchmarks.bench_ingest [--images 300] [--baseline-images 40]
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+import httpx
+
+from benchmarks.load_test import free_port, jpeg_payload, start_server, wait_until_up
+
+BENCH_DATABASE = "bench_ingest"
+
+
+def build_archive(images: int, width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for i in range(images):
+            archive.writestr(f"bench-user-{i}.jpg", jpeg_payload(width, height))
+    return buffer.getvalue()
+
+
+async def one_at_a_time(archive_bytes: bytes, limit: int, repository) -> dict:
+    from fastapi.concurrency import run_in_threadpool
+
+    from api.services.openai_service import build_document_context, process_image_with_grok_async
+    from api.utils.image_utils import preprocess_image_file
+
+    started = time.perf_counter()
+    done = 0
+    with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+        for info in archive.infolist()[:limit]:
+            image_file = io.BytesIO(archive.read(info))
+            image = await run_in_threadpool(preprocess_image_file, image_file)
+            result = await process_image_with_grok_async(image.data, image.mime_type, image.detail)
+            characteristics = build_document_context([result]).attributes.model_dump(exclude_none=True)
+            if repository is not None:
+                await repository.save_characteristics(info.filename.rsplit(".", 1)[0], characteristics)
+            done += 1
+    return {"images": done, "seconds": time.perf_counter() - started, "failed": 0}
+
+
+async def pipeline(archive_bytes: bytes, work_dir: str, repository, queue_size: int, vision_concurrency: int) -> dict:
+    from api.services.ingest_service import (
+        INGEST_PERSIST_BATCH,
+        INGEST_PERSIST_INTERVAL_SECONDS,
+        INGEST_PREPROCESS_WORKERS,
+        IngestManager,
+    )
+
+    async def persist(characteristics_by_user):
+        if repository is None:
+            return len(characteristics_by_user)
+        return await repository.save_many(characteristics_by_user)
+
+    manager = IngestManager(
+        work_dir, queue_size, INGEST_PREPROCESS_WORKERS, vision_concurrency,
+        INGEST_PERSIST_BATCH, INGEST_PERSIST_INTERVAL_SECONDS, 1, 3600, persist=persist,
+    )
+    started = time.perf_counter()
+    manifest = await asyncio.to_thread(manager.stage_batch, [("batch.zip", "application/zip", io.BytesIO(archive_bytes))])
+    status = await manager.start(manifest)
+    while status["status"] in ("queued", "running"):
+        await asyncio.sleep(0.1)
+        status = await manager.get(manifest["batch_id"])
+    return {
+        "images": status["counts"]["saved"],
+        "seconds": time.perf_counter() - started,
+        "failed": status["counts"]["failed"],
+        "pipeline_images_per_second": status["images_per_second"],
+    }
+
+
+async def run(args) -> dict:
+    from api.services.job_service import shutdown_job_manager
+
+    repository, client = None, None
+    if os.getenv("MONGO_URI"):
+        from pymongo import AsyncMongoClient
+
+        from api.services.user_repository import UserRepository
+
+        client = AsyncMongoClient(os.environ["MONGO_URI"])
+        repository = UserRepository(client[BENCH_DATABASE]["users"])
+        await repository.ensure_indexes()
+
+    archive_bytes = build_archive(args.images, args.width, args.height)
+    results = {}
+    try:
+        results["one-at-a-time"] = await one_at_a_time(archive_bytes, args.baseline_images, repository)
+        with tempfile.TemporaryDirectory() as work_dir:
+            results["pipeline"] = await pipeline(archive_bytes, work_dir, repository, args.queue_size, args.vision_concurrency)
+    finally:
+        await shutdown_job_manager()
+        if client is not None:
+            await client.drop_database(BENCH_DATABASE)
+            await client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=300)
+    parser.add_argument("--baseline-images", type=int, default=40, help="images imported one at a time for the baseline")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--vision-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    port = free_port()
+    mock_env = {"MOCK_TOKENS_PER_SECOND": "0", **{key: value for key, value in os.environ.items() if key.startswith("MOCK_")}}
+    mock = start_server("benchmarks.mock_llm:app", port, mock_env)
+    # Read by the service modules at import time, so set before they are imported
+    os.environ.update({
+        "XAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "XAI_API_KEY": "mock",
+        "VISION_CACHE_ENABLED": "false",
+        "VISION_GLOBAL_CONCURRENCY": str(args.vision_concurrency),
+    })
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/v1/models")
+        results = asyncio.run(run(args))
+        mock_stats = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    if not os.getenv("MONGO_URI"):
+        print("MONGO_URI not set: the save step is skipped")
+    print(f"{'mode':<14} {'images':>7} {'failed':>7} {'seconds':>8} {'images/s':>9}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<14} {result['images']:>7} {result['failed']:>7} {result['seconds']:>8.2f} "
+            f"{result['images'] / result['seconds']:>9.2f}"
+        )
+    print(f"upstream requests: {mock_stats['requests']}, peak in flight: {mock_stats['peak_in_flight']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Routing benchmark for the local vision tier against the local mock LLM.
+
+Generates a labelled corpus of synthetic profile uploads (photo-like
+images, portraits on plain backgrounds, scanned documents, flat graphics,
+blank and tiny images), preprocesses each one, and extracts attributes two
+ways with the profile-photo rules used by batch ingestion:
+
+    remote-only  every image goes to the vision model
+    tiered       the CPU tier answers blank, tiny and non-photo images and
+                 only the rest escalate to the vision model
+
+Reports how the local tier classified each group, the upstream calls and
+the latency saved, and what the local analysis costs per image.
+
+    cd backend && python -m benchmarks.bench_local_vision [--images 200] [--mix photo=0.5,document=0.5]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.load_test import free_port, start_server, wait_until_up
+
+# Share of the corpus per group; uploads to a dating app are mostly, but not only, photos
+DEFAULT_MIX = "photo=0.55,portrait=0.15,document=0.1,graphic=0.1,blank=0.05,tiny=0.05"
+# Kind the local tier should report for each group
+EXPECTED_KIND = {"photo": "photo", "portrait": "photo", "document": "document", "graphic": "graphic", "blank": "blank", "tiny": "too_small"}
+
+
+def _smooth_field(rng, np, width: int, height: int, channels: int = 3):
+    """Low-frequency color field: a coarse random grid upscaled with bicubic interpolation."""
+    from PIL import Image
+
+    grid = (rng.random((rng.integers(3, 7), rng.integers(3, 7), channels)) * 255).astype("uint8")
+    mode = "RGB" if channels == 3 else "L"
+    return np.asarray(Image.fromarray(grid.squeeze(), mode).resize((width, height), Image.BICUBIC), dtype="float32")
+
+
+def _face(rng, draw, width: int, height: int, box_scale: float) -> None:
+    skin = tuple(int(c) for c in rng.choice([(236, 188, 160), (198, 134, 96), (141, 85, 56), (90, 56, 37)]))
+    hair = tuple(int(c) for c in rng.choice([(40, 28, 20), (110, 70, 40), (200, 160, 90), (20, 20, 20)]))
+    cx, cy = width * rng.uniform(0.4, 0.6), height * rng.uniform(0.35, 0.5)
+    rx, ry = width * box_scale, height * box_scale * 1.3
+    draw.ellipse([cx - rx * 1.15, cy - ry * 1.1, cx + rx * 1.15, cy + ry * 0.6], fill=hair)
+    draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=skin)
+    draw.rectangle([cx - rx * 1.6, cy + ry, cx + rx * 1.6, height], fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+
+
+def make_image(group: str, rng, np) -> bytes:
+    from PIL import Image, ImageDraw, ImageFilter
+
+    width, height = int(rng.integers(640, 1600)), int(rng.integers(640, 1600))
+    fmt = "JPEG"
+    if group == "photo":
+        # Scene lighting, a person and sensor noise
+        pixels = _smooth_field(rng, np, width, height)
+        image = Image.fromarray(pixels.astype("uint8"))
+        _face(rng, ImageDraw.Draw(image), width, height, rng.uniform(0.12, 0.22))
+        image = image.filter(ImageFilter.GaussianBlur(rng.uniform(1, 3)))
+        pixels = np.asarray(image, dtype="float32") + rng.normal(0, rng.uniform(3, 9), (height, width, 3))
+        if rng.random() < 0.2:
+            pixels = pixels.mean(axis=2, keepdims=True).repeat(3, axis=2)
+        image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+    elif group == "portrait":
+        # Studio portrait on a plain light backdrop
+        shade = int(rng.integers(200, 250))
+        # Backdrops are lit unevenly, darkening towards the bottom
+        backdrop = np.linspace(shade, shade - rng.integers(10, 40), height, dtype="float32")[:, None, None].repeat(width, axis=1).repeat(3, axis=2)
+        image = Image.fromarray(backdrop.astype("uint8"))
+        _face(rng, ImageDraw.Draw(image), width, height, rng.uniform(0.2, 0.3))
+        image = image.filter(ImageFilter.GaussianBlur(2))
+        pixels = np.asarray(image, dtype="float32") + rng.normal(0, 4, (height, width, 3))
+        image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+    elif group == "document":
+        # Scanned or photographed page: off-white paper, dark text lines, some noise
+        paper = int(rng.integers(225, 255))
+        image = Image.new("RGB", (width, int(width * 1.3)), (paper, paper, paper - int(rng.integers(0, 10))))
+        draw = ImageDraw.Draw(image)
+        y = int(image.height * 0.08)
+        while y < image.height * 0.9:
+            x = int(image.width * 0.08)
+            while x < image.width * 0.9:
+                word = int(rng.integers(20, 90))
+                draw.rectangle([x, y, x + word, y + 10], fill=(int(rng.integers(0, 60)),) * 3)
+                x += word + 12
+            y += int(rng.integers(22, 34))
+        pixels = np.asarray(image, dtype="float32") + rng.normal(0, 3, (image.height, image.width, 3))
+        image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+    elif group == "graphic":
+        # Flat-color artwork or a screenshot, saved as PNG
+        image = Image.new("RGB", (width, height), tuple(int(c) for c in rng.integers(0, 255, 3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(int(rng.integers(3, 8))):
+            x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            shape = [x0, y0, x0 + int(rng.integers(50, width // 2)), y0 + int(rng.integers(50, height // 2))]
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(shape, fill=color)
+        fmt = "PNG"
+    elif group == "blank":
+        # Lens cap, all-white export or an empty scan, with a little noise
+        level = int(rng.choice([0, 20, 128, 240, 255]))
+        pixels = np.full((height, width, 3), level, dtype="float32") + rng.normal(0, 1.5, (height, width, 3))
+        image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+    else:
+        # Thumbnail-sized photo
+        side = int(rng.integers(24, 90))
+        pixels = _smooth_field(rng, np, side, side) + rng.normal(0, 6, (side, side, 3))
+        image = Image.fromarray(pixels.clip(0, 255).astype("uint8"))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def build_corpus(size: int, mix: dict, seed: int) -> list:
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    groups = [group for group, share in mix.items() for _ in range(round(size * share))]
+    random.Random(seed).shuffle(groups)
+    return [(group, make_image(group, rng, np)) for group in groups]
+
+
+async def extract_all(images: list, reject_kinds, concurrency: int) -> dict:
+    from api.services.openai_service import LocalVisionResult, extract_image_async
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, routes = [], Counter()
+
+    async def extract(image):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await extract_image_async(image, reject_kinds)
+            latencies.append(time.perf_counter() - started)
+            routes["local" if isinstance(result, LocalVisionResult) else "remote"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(extract(image) for image in images))
+    return {
+        "seconds": time.perf_counter() - started,
+        "routes": routes,
+        "mean_latency": statistics.mean(latencies),
+        "p95_latency": statistics.quantiles(latencies, n=20)[-1],
+    }
+
+
+async def compare(images: list, stats_url: str, reject_kinds, concurrency: int) -> dict:
+    results = {}
+    async with httpx.AsyncClient() as client:
+        for mode, kinds in (("remote-only", frozenset()), ("tiered", reject_kinds)):
+            before = (await client.get(stats_url)).json()["requests"]
+            results[mode] = await extract_all(images, kinds, concurrency)
+            results[mode]["upstream"] = (await client.get(stats_url)).json()["requests"] - before
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="share of the corpus per group, e.g. photo=0.5,document=0.5")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    mix = {group: float(share) for group, share in (part.split("=") for part in args.mix.split(","))}
+
+    port = free_port()
+    mock_env = {"MOCK_TOKENS_PER_SECOND": "0", "MOCK_SEED": str(args.seed), **{key: value for key, value in os.environ.items() if key.startswith("MOCK_")}}
+    mock = start_server("benchmarks.mock_llm:app", port, mock_env)
+    # Read by the service modules at import time, so set before they are imported
+    os.environ.update({
+        "XAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "XAI_API_KEY": "mock",
+        "VISION_CACHE_ENABLED": "false",
+        "UPSTREAM_COALESCING_ENABLED": "false",
+        "VISION_GLOBAL_CONCURRENCY": str(args.concurrency),
+    })
+    from PIL import Image
+
+    from api.services.openai_service import LOCAL_REJECT_PHOTO_KINDS
+    from api.utils.image_analysis import analyze_image
+    from api.utils.image_utils import preprocess_image_file
+
+    print(f"Building a corpus of {args.images} images...")
+    corpus = build_corpus(args.images, mix, args.seed)
+    images, analysis_seconds = [], []
+    confusion = {group: Counter() for group in mix}
+    for group, data in corpus:
+        image = preprocess_image_file(io.BytesIO(data))
+        images.append(image)
+        label = image.analysis.kind if image.analysis.confident else f"{image.analysis.kind}?"
+        confusion[group][label] += 1
+        # The analysis is timed again on its own, on the decoded upload, to report its cost
+        with Image.open(io.BytesIO(data)) as decoded:
+            decoded.draft("RGB", (1568, 1568))
+            decoded.load()
+            started = time.perf_counter()
+            analyze_image(decoded)
+            analysis_seconds.append(time.perf_counter() - started)
+
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/v1/models")
+        # One event loop for both runs; the async client belongs to the loop that first used it
+        results = asyncio.run(compare(images, f"http://127.0.0.1:{port}/stats", LOCAL_REJECT_PHOTO_KINDS, args.concurrency))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print("\nLocal classification by group (\"?\" = not confident, escalated):")
+    for group, counts in confusion.items():
+        total = sum(counts.values())
+        if not total:
+            continue
+        correct = counts[EXPECTED_KIND[group]]
+        breakdown = ", ".join(f"{label} {count}" for label, count in counts.most_common())
+        print(f"  {group:<9} {total:>4} images, {correct / total:>4.0%} confidently {EXPECTED_KIND[group]:<10} [{breakdown}]")
+    wrongly_rejected = sum(
+        count for group in ("photo", "portrait") for label, count in confusion.get(group, Counter()).items()
+        if label in LOCAL_REJECT_PHOTO_KINDS
+    )
+    print(f"  photos rejected locally by mistake: {wrongly_rejected}")
+
+    print(f"\n{'mode':<12} {'upstream':>9} {'local':>6} {'seconds':>8} {'mean ms':>8} {'p95 ms':>8}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<12} {result['upstream']:>9} {result['routes']['local']:>6} {result['seconds']:>8.2f} "
+            f"{result['mean_latency'] * 1000:>8.1f} {result['p95_latency'] * 1000:>8.1f}"
+        )
+    baseline, tiered = results["remote-only"], results["tiered"]
+    saved = baseline["upstream"] - tiered["upstream"]
+    print(
+        f"\nupstream calls saved: {saved} of {baseline['upstream']} ({saved / baseline['upstream']:.0%}), "
+        f"wall time saved: {baseline['seconds'] - tiered['seconds']:.2f} s, "
+        f"mean latency saved per image: {(baseline['mean_latency'] - tiered['mean_latency']) * 1000:.1f} ms"
+    )
+    print(
+        f"local analysis: {statistics.mean(analysis_seconds) * 1000:.1f} ms mean, "
+        f"{statistics.quantiles(analysis_seconds, n=20)[-1] * 1000:.1f} ms p95 per image (paid during preprocessing)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark for incremental match-list maintenance.
+
+Builds synthetic populations, computes every top-K list from scratch, then
+applies a stream of profile edits through MatchLists.apply_change and times
+them, along with the reconciler work they leave behind (dirty lists) and a
+single list recompute for comparison.
+
+    cd backend && python -m benchmarks.bench_match_lists [--sizes 2000 10000 20000] [--updates 500]
+"""
+import argparse
+import copy
+import random
+import time
+
+from api.services.match_list_service import MatchLists
+from api.services.matching_service import KNOWN_VALUES, ProfileIndex
+from benchmarks.bench_matching import random_profile
+
+
+def edit_profile(rng: random.Random, profile: dict) -> dict:
+    """One attribute changed, the way a re-uploaded photo usually differs."""
+    edited = copy.deepcopy(profile)
+    characteristics = edited["characteristics"]
+    field = rng.choice(["face_shape", "skin_tone", "hair_color", "eye_color"])
+    if field == "hair_color":
+        characteristics["hair_details"]["color"] = rng.choice(KNOWN_VALUES["hair_color"])
+    elif field == "eye_color":
+        characteristics["eye_details"]["color"] = rng.choice(KNOWN_VALUES["eye_color"])
+    else:
+        characteristics[field] = rng.choice(KNOWN_VALUES[field])
+    return edited
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2_000, 10_000, 20_000])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(
+        f"{'profiles':>10} {'build all s':>11} {'recompute ms':>12} {'update p50 ms':>13} {'update max ms':>13} "
+        f"{'lists/update':>12} {'dirty/update':>12} {'reconcile ms':>12}"
+    )
+    for size in args.sizes:
+        profiles = [random_profile(rng, f"user-{i}") for i in range(size)]
+        match_lists = MatchLists(ProfileIndex.build(profiles), args.k)
+        started = time.perf_counter()
+        match_lists.build_all()
+        build_seconds = time.perf_counter() - started
+
+        timings, changed = [], 0
+        for _ in range(args.updates):
+            profile = edit_profile(rng, rng.choice(profiles))
+            started = time.perf_counter()
+            changed += len(match_lists.apply_change(profile["user_id"], profile["characteristics"], profile["intentions"]))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        dirty = len(match_lists.dirty)
+        started = time.perf_counter()
+        for user_id in list(match_lists.dirty):
+            match_lists.recompute(user_id)
+        reconcile_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"{size:>10} {build_seconds:>11.2f} {build_seconds * 1000 / size:>12.3f} {timings[len(timings) // 2]:>13.3f} "
+            f"{timings[-1]:>13.3f} {changed / args.updates:>12.1f} {dirty / args.updates:>12.2f} {reconcile_ms:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
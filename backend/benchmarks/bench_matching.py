@@ -0,0 +1,66 @@
+"""
+Benchmark for the vectorized matching engine.
+
+Builds synthetic populations and times one top-K query against each.
+
+    cd backend && python -m benchmarks.bench_matching [--sizes 10000 100000 1000000]
+"""
+import argparse
+import random
+import time
+
+from api.services.matching_service import KNOWN_VALUES, ProfileIndex
+
+OTHER_FEATURES = ["freckles", "moles", "scars", "glasses", "beard", "lipstick", "eyeshadow", "tattoos", "piercings"]
+INTENTIONS = {"relationship": ["serious", "casual", "friendship"], "family": ["yes", "no", "unsure"]}
+
+
+def random_profile(rng: random.Random, user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "characteristics": {
+            "face_shape": rng.choice(KNOWN_VALUES["face_shape"]),
+            "hair_details": {
+                "color": rng.choice(KNOWN_VALUES["hair_color"]),
+                "texture": rng.choice(KNOWN_VALUES["hair_texture"]),
+                "length": rng.choice(KNOWN_VALUES["hair_length"]),
+            },
+            "eye_details": {
+                "color": rng.choice(KNOWN_VALUES["eye_color"]),
+                "shape": rng.choice(KNOWN_VALUES["eye_shape"]),
+            },
+            "skin_tone": rng.choice(KNOWN_VALUES["skin_tone"]),
+            "other_features": rng.sample(OTHER_FEATURES, rng.randint(0, 3)),
+        },
+        "intentions": {key: rng.choice(values) for key, values in INTENTIONS.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'profiles':>10} {'build s':>9} {'index MB':>9} {'p50 ms':>8} {'max ms':>8}")
+    for size in args.sizes:
+        profiles = [random_profile(rng, f"user-{i}") for i in range(size)]
+        started = time.perf_counter()
+        index = ProfileIndex.build(profiles)
+        build_seconds = time.perf_counter() - started
+        index_mb = (index.codes.nbytes + index.feature_masks.nbytes + index.intention_masks.nbytes) / 1e6
+
+        timings = []
+        for _ in range(args.queries):
+            query = rng.choice(profiles)
+            started = time.perf_counter()
+            index.top_k(query["characteristics"], query["intentions"], k=args.k, exclude_user_id=query["user_id"])
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{size:>10} {build_seconds:>9.2f} {index_mb:>9.1f} {timings[len(timings) // 2]:>8.2f} {timings[-1]:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Throughput benchmark: legacy characteristic access vs the async UserRepository.
+
+Runs against a local mongod in a throwaway database, which is dropped afterwards.
+
+    cd backend && MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_mongo [--users 5000]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from pymongo import AsyncMongoClient, MongoClient
+
+from api.services.user_repository import UserRepository
+
+BENCH_DATABASE = "bench_user_repository"
+
+
+def characteristics_for(i: int) -> dict:
+    return {
+        "face_shape": "oval",
+        "hair_details": {"color": "brown", "texture": "wavy", "length": str(i % 3)},
+        "eye_details": {"color": "green", "shape": "almond"},
+        "skin_tone": "medium",
+        "other_features": ["freckles"],
+    }
+
+
+def legacy_save(collection, user_id: str, characteristics: dict) -> None:
+    # Mirrors the former save_characteristics_to_db: find_one, then update_one or insert_one
+    if collection.find_one({"user_id": user_id}):
+        collection.update_one({"user_id": user_id}, {"$set": {"characteristics": characteristics}})
+    else:
+        collection.insert_one({"user_id": user_id, "characteristics": characteristics})
+
+
+def legacy_get_pair(collection, user1_id: str, user2_id: str):
+    # Mirrors the former match_users: two sequential find_one calls
+    return collection.find_one({"user_id": user1_id}), collection.find_one({"user_id": user2_id})
+
+
+def report(label: str, operations: int, seconds: float) -> None:
+    print(f"{label:<42} {operations:>8} ops {seconds:>8.3f}s {operations / seconds:>10.0f} ops/s")
+
+
+def bench_legacy(uri: str, users: int) -> None:
+    client = MongoClient(uri)
+    collection = client[BENCH_DATABASE]["legacy_users"]
+    collection.drop()
+    user_ids = [f"user-{i}" for i in range(users)]
+
+    started = time.perf_counter()
+    for i, user_id in enumerate(user_ids):
+        legacy_save(collection, user_id, characteristics_for(i))
+    report("legacy save (find_one + insert/update)", users, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(0, users - 1, 2):
+        legacy_get_pair(collection, user_ids[i], user_ids[i + 1])
+    report("legacy pair read (2x find_one)", users // 2, time.perf_counter() - started)
+    client.close()
+
+
+async def bench_repository(uri: str, users: int, concurrency: int) -> None:
+    client = AsyncMongoClient(uri, maxPoolSize=concurrency)
+    database = client[BENCH_DATABASE]
+    await database["users"].drop()
+    repository = UserRepository(database["users"])
+    await repository.ensure_indexes()
+    user_ids = [f"user-{i}" for i in range(users)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        bounded(repository.save_characteristics(user_id, characteristics_for(i)))
+        for i, user_id in enumerate(user_ids)
+    ))
+    report(f"repository upsert (concurrency {concurrency})", users, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await repository.save_many({user_id: characteristics_for(i + 1) for i, user_id in enumerate(user_ids)})
+    report("repository save_many (bulk_write)", users, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        bounded(repository.get_many([user_ids[i], user_ids[i + 1]]))
+        for i in range(0, users - 1, 2)
+    ))
+    report(f"repository pair read ($in, concurrency {concurrency})", users // 2, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await repository.get_many(user_ids)
+    report("repository get_many (all users, one $in)", users, time.perf_counter() - started)
+
+    await client.drop_database(BENCH_DATABASE)
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    bench_legacy(args.uri, args.users)
+    asyncio.run(bench_repository(args.uri, args.users, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Cold-start budget check for a worker.
+
+Measures `python -X importtime -c "import main"`, verifies that heavy
+dependencies are not imported at startup, and times a fresh uvicorn
+process until /healthz answers. Exits non-zero if any budget is exceeded,
+so it can gate CI.
+
+    cd backend && python -m benchmarks.bench_startup [--import-budget-ms 600] [--first-response-budget-ms 3000]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be loaded on first use, never by `import main`
+LAZY_MODULES = ["openai", "pymongo", "PIL", "pdf2image", "numpy"]
+
+
+def measure_import(runs: int):
+    """Returns (best cumulative import time of main in ms, slowest self-time modules)."""
+    best_ms, slowest = None, []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        )
+        rows = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(self_us), int(cumulative_us), name.strip()))
+        main_ms = next(cumulative for _, cumulative, name in rows if name == "main") / 1000
+        if best_ms is None or main_ms < best_ms:
+            best_ms = main_ms
+            slowest = sorted(rows, reverse=True)[:10]
+    return best_ms, slowest
+
+
+def eagerly_imported_modules():
+    code = f"import sys, main; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return [name for name in result.stdout.strip().split(",") if name]
+
+
+def measure_first_response(timeout_seconds: float):
+    """Returns milliseconds from spawning uvicorn until /healthz answers, or None if uvicorn is missing."""
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        return None
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        while time.perf_counter() - started < timeout_seconds:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=0.5) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.01)
+        return float("inf")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--import-budget-ms", type=float, default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "600")))
+    parser.add_argument("--first-response-budget-ms", type=float, default=float(os.getenv("STARTUP_FIRST_RESPONSE_BUDGET_MS", "3000")))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = []
+
+    import_ms, slowest = measure_import(args.runs)
+    print(f"import main: {import_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    for self_us, cumulative_us, name in slowest:
+        print(f"    {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+    if import_ms > args.import_budget_ms:
+        failures.append("import time over budget")
+
+    eager = eagerly_imported_modules()
+    print(f"heavy modules imported at startup: {', '.join(eager) or 'none'}")
+    if eager:
+        failures.append(f"eagerly imported: {', '.join(eager)}")
+
+    first_response_ms = measure_first_response(args.first_response_budget_ms / 1000 * 2)
+    if first_response_ms is None:
+        print("time to first response: skipped (uvicorn is not installed)")
+    else:
+        print(f"time to first response: {first_response_ms:.0f} ms (budget {args.first_response_budget_ms:.0f} ms)")
+        if first_response_ms > args.first_response_budget_ms:
+            failures.append("time to first response over budget")
+
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
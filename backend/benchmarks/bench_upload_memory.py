@@ -0,0 +1,98 @@
+"""
+Allocation profile of the vision request path, measured with tracemalloc.
+
+Sends payloads of several sizes to the local mock LLM and reports the peak
+Python memory allocated while building and sending one vision request, as
+bytes and as a multiple of the raw image size:
+
+    legacy    b64encode().decode(), the data URL f-string and the SDK's JSON
+              serialization, as process_image_with_grok used to do
+    streamed  process_image_with_grok / process_image_with_grok_async with
+              raw bytes: Base64 encoded chunk by chunk into the request body
+
+    cd backend && python -m benchmarks.bench_upload_memory [--sizes-kb 512 4096 16384]
+
+The pass/fail check on the streamed paths lives in tests/test_upload_memory.py.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import tracemalloc
+
+from benchmarks.load_test import free_port, start_server, wait_until_up
+
+
+def legacy_request(data: bytes) -> None:
+    from api.services.openai_service import VISION_MODEL_NAME, VISION_PROMPT, get_client
+
+    base64_image = base64.b64encode(data).decode("utf-8")
+    get_client().chat.completions.create(
+        model=VISION_MODEL_NAME,
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "high"}},
+                {"type": "text", "text": VISION_PROMPT},
+            ],
+        }],
+    )
+
+
+def streamed_request(data: bytes) -> None:
+    from api.services.openai_service import process_image_with_grok
+
+    process_image_with_grok(data)
+
+
+# The async client and the vision semaphore belong to one event loop, so every call runs on it
+_loop = asyncio.new_event_loop()
+
+
+def streamed_request_async(data: bytes) -> None:
+    from api.services.openai_service import process_image_with_grok_async
+
+    _loop.run_until_complete(process_image_with_grok_async(data))
+
+
+def peak_allocated(function, data: bytes) -> int:
+    """Peak bytes allocated above the starting point while function runs."""
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    return peak - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[512, 4096, 16384])
+    args = parser.parse_args()
+
+    port = free_port()
+    mock = start_server("benchmarks.mock_llm:app", port, {"MOCK_TOKENS_PER_SECOND": "0", "MOCK_LATENCY": "fixed:0.01"})
+    # Read by the service modules at import time, so set before they are imported
+    os.environ.update({"XAI_BASE_URL": f"http://127.0.0.1:{port}/v1", "XAI_API_KEY": "mock", "VISION_CACHE_ENABLED": "false"})
+    cases = {"legacy": legacy_request, "streamed": streamed_request, "streamed_async": streamed_request_async}
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/v1/models")
+        # Imports, clients and connections are set up outside the measurement
+        for function in cases.values():
+            function(os.urandom(1024))
+
+        tracemalloc.start()
+        print(f"{'payload KB':>10} {'path':<15} {'peak KB':>10} {'x payload':>10}")
+        for size_kb in args.sizes_kb:
+            data = os.urandom(size_kb * 1024)
+            for name, function in cases.items():
+                peak = peak_allocated(function, data)
+                ratio = peak / len(data)
+                print(f"{size_kb:>10} {name:<15} {peak / 1024:>10.0f} {ratio:>10.2f}")
+        tracemalloc.stop()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
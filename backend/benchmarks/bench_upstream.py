@@ -0,0 +1,101 @@
+"""
+Fault-injection benchmark for the upstream call layer (limiter, retries, breaker, hedging).
+
+Each scenario starts benchmarks/mock_llm.py with its own MOCK_* settings and
+drives a fresh UpstreamCaller against it, reporting successes, failures,
+calls rejected by the open circuit, upstream attempts, latency percentiles
+and where the adaptive limit settled.
+
+    cd backend && python -m benchmarks.bench_upstream [--calls 400] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from api.services.upstream_service import AIMDLimiter, CircuitBreaker, CircuitOpenError, UpstreamCaller
+from benchmarks.load_test import free_port, start_server, wait_until_up
+
+SCENARIOS = {
+    # Provider allows 16 concurrent requests; the limiter should settle near that
+    "rate_limit": {"MOCK_MAX_CONCURRENCY": "16", "MOCK_RETRY_AFTER": "0.2", "MOCK_LATENCY": "fixed:0.1"},
+    # 10% transient 503s; retries should hide them without tripping the breaker
+    "transient_errors": {"MOCK_ERROR_RATE": "0.1", "MOCK_ERROR_STATUS": "503", "MOCK_RETRY_AFTER": "0.1", "MOCK_LATENCY": "fixed:0.1"},
+    # Upstream down; the breaker should turn most calls into immediate rejections
+    "outage": {"MOCK_ERROR_RATE": "1", "MOCK_ERROR_STATUS": "500", "MOCK_LATENCY": "fixed:0.05"},
+    # Heavy latency tail, without and with hedging
+    "tail": {"MOCK_LATENCY": "lognormal:0.1,1.2", "MOCK_SEED": "7"},
+    "tail_hedged": {"MOCK_LATENCY": "lognormal:0.1,1.2", "MOCK_SEED": "7"},
+}
+
+
+async def run_scenario(name: str, base_url: str, calls: int, concurrency: int) -> dict:
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key="mock", base_url=base_url, max_retries=0, timeout=30)
+    caller = UpstreamCaller(
+        AIMDLimiter(initial=64, minimum=1, maximum=128, latency_target=30),
+        CircuitBreaker(failure_ratio=0.5, window_size=20, reset_seconds=1.0),
+        max_retries=3, backoff_base=0.05, backoff_max=2.0,
+        hedge_enabled=name == "tail_hedged", hedge_percentile=0.95, hedge_min_delay=0.05, hedge_budget=0.05,
+    )
+    messages = [{"role": "user", "content": "benchmark"}]
+    latencies, counts = [], {"ok": 0, "failed": 0, "rejected": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await caller.call_async("mock", lambda: client.chat.completions.create(model="mock", messages=messages))
+                counts["ok"] += 1
+            except CircuitOpenError:
+                counts["rejected"] += 1
+            except Exception:
+                counts["failed"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+    return dict(
+        counts, p50_ms=percentile(0.5), p99_ms=percentile(0.99), seconds=round(elapsed, 2),
+        limit=caller.limiter.stats()["limit"], breaker_opens=caller.breaker.opens,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=48)
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    print(f"{'scenario':<18} {'ok':>5} {'fail':>5} {'reject':>6} {'attempts':>8} {'peak':>5} {'p50 ms':>8} {'p99 ms':>8} {'limit':>5} {'opens':>5} {'secs':>6}")
+    for name in args.scenarios:
+        port = free_port()
+        mock = start_server("benchmarks.mock_llm:app", port, {"MOCK_TOKENS_PER_SECOND": "0", **SCENARIOS[name]})
+        try:
+            wait_until_up(f"http://127.0.0.1:{port}/v1/models")
+            result = asyncio.run(run_scenario(name, f"http://127.0.0.1:{port}/v1", args.calls, args.concurrency))
+            mock_stats = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+        finally:
+            mock.terminate()
+            mock.wait()
+        print(
+            f"{name:<18} {result['ok']:>5} {result['failed']:>5} {result['rejected']:>6} {mock_stats['requests']:>8} "
+            f"{mock_stats['peak_in_flight']:>5} {result['p50_ms']:>8} {result['p99_ms']:>8} {result['limit']:>5} "
+            f"{result['breaker_opens']:>5} {result['seconds']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+End-to-end load test against the local mock LLM.
+
+Starts benchmarks/mock_llm.py and the API (each as a uvicorn process),
+points the API at the mock via XAI_BASE_URL, and drives every scenario at
+fixed concurrency levels. Reports p50/p95/p99 latency, throughput, errors
+and the API process's peak RSS, then compares against a stored baseline.
+
+    cd backend && python -m benchmarks.load_test [--concurrency 1 8 32] [--requests 100]
+    cd backend && python -m benchmarks.load_test --save-baseline
+
+Exits non-zero if a scenario regresses past --tolerance versus the baseline.
+Mock behaviour is controlled with the MOCK_* variables documented in
+benchmarks/mock_llm.py; they are passed through to the mock process.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "load_baseline.json")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def jpeg_payload(width: int, height: int) -> bytes:
+    from PIL import Image
+
+    # Random pixels are the worst case for JPEG size and preprocessing time
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def pdf_payload(pages: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    images = []
+    for page in range(pages):
+        image = Image.new("RGB", (1275, 1650), "white")
+        draw = ImageDraw.Draw(image)
+        for row in range(40):
+            draw.text((80, 80 + row * 38), f"Page {page + 1} field {row}: ____________________", fill="black")
+        images.append(image)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def build_scenarios(include_pdf: bool, include_matching: bool) -> Dict[str, Callable]:
+    small_jpeg = jpeg_payload(640, 480)
+    large_jpeg = jpeg_payload(4000, 3000)
+    scenarios = {
+        "validate_image_small": lambda client: client.post(
+            "/validate-document", files={"file": ("small.jpg", small_jpeg, "image/jpeg")}
+        ),
+        "validate_image_large": lambda client: client.post(
+            "/validate-document", files={"file": ("large.jpg", large_jpeg, "image/jpeg")}
+        ),
+        "generate_response": lambda client: client.post(
+            "/generate-response", json={"question": "I enjoy hiking and want something serious.", "gender": "female"}
+        ),
+        "generate_response_stream": lambda client: client.post(
+            "/generate-response", json={"question": "I enjoy hiking and want something serious.", "gender": "female", "stream": True}
+        ),
+    }
+    if include_pdf:
+        pdf_3 = pdf_payload(3)
+        pdf_10 = pdf_payload(10)
+        scenarios["validate_pdf_3_pages"] = lambda client: client.post(
+            "/validate-document", files={"file": ("form.pdf", pdf_3, "application/pdf")}
+        )
+        scenarios["validate_pdf_10_pages"] = lambda client: client.post(
+            "/validate-document", files={"file": ("form.pdf", pdf_10, "application/pdf")}
+        )
+    if include_matching:
+        scenarios["match_top_k"] = lambda client: client.post("/match/top-k", json={"user_id": "load-test-user", "k": 10})
+    return scenarios
+
+
+async def run_level(base_url: str, request: Callable, concurrency: int, total: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await request(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(0.50), 1),
+        "p95_ms": round(percentile(0.95), 1),
+        "p99_ms": round(percentile(0.99), 1),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']} -> {result['p95_ms']} ms")
+        if result["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {previous['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if previous.get("peak_rss_mb") and result.get("peak_rss_mb") and result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{key}: peak RSS {previous['peak_rss_mb']} -> {result['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and concurrency level")
+    parser.add_argument("--scenarios", nargs="*", help="run only these scenarios")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression versus the baseline")
+    parser.add_argument("--with-matching", action="store_true", help="include /match/top-k (needs MongoDB)")
+    args = parser.parse_args()
+
+    mock_port, api_port = free_port(), free_port()
+    mock_env = {key: value for key, value in os.environ.items() if key.startswith("MOCK_")}
+    api_env = {
+        "XAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "XAI_API_KEY": "mock",
+        "VISION_CACHE_ENABLED": "false",
+    }
+    mock = start_server("benchmarks.mock_llm:app", mock_port, mock_env)
+    api = start_server("main:app", api_port, api_env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{mock_port}/v1/models")
+        wait_until_up(f"http://127.0.0.1:{api_port}/healthz")
+
+        include_pdf = shutil.which("pdftoppm") is not None
+        if not include_pdf:
+            print("PDF scenarios skipped: poppler (pdftoppm) is not installed")
+        scenarios = build_scenarios(include_pdf, args.with_matching)
+        if args.scenarios:
+            scenarios = {name: scenarios[name] for name in args.scenarios if name in scenarios}
+
+        results: Dict[str, dict] = {}
+        print(f"{'scenario':<28} {'conc':>4} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'peak MB':>8}")
+        for name, request in scenarios.items():
+            for concurrency in args.concurrency:
+                result = asyncio.run(run_level(f"http://127.0.0.1:{api_port}", request, concurrency, args.requests))
+                rss = peak_rss_bytes(api.pid)
+                # VmHWM is the process lifetime peak, so it is cumulative across scenarios
+                result["peak_rss_mb"] = round(rss / 1e6, 1) if rss else None
+                results[f"{name}@{concurrency}"] = result
+                print(
+                    f"{name:<28} {concurrency:>4} {result['requests']:>5} {result['errors']:>4} "
+                    f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+                    f"{result['throughput_rps']:>8} {result['peak_rss_mb'] or '-':>8}"
+                )
+    finally:
+        api.terminate()
+        mock.terminate()
+        api.wait()
+        mock.wait()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions versus baseline.")
+
+
+if __name__ == "__main__":
+    main()
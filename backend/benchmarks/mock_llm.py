@@ -0,0 +1,175 @@
+"""
+Local OpenAI-compatible stand-in for the xAI API, for benchmarks and load tests.
+
+Serves POST /v1/chat/completions (plain and streaming) with configurable
+latency, token rate and error injection, so the service can be exercised
+without spending upstream quota.
+
+    cd backend && uvicorn benchmarks.mock_llm:app --port 8001
+    XAI_BASE_URL=http://127.0.0.1:8001/v1 XAI_API_KEY=mock uvicorn main:app
+
+Settings (environment variables):
+    MOCK_LATENCY            Time to first token: "fixed:0.2", "uniform:0.1,0.5" or "lognormal:<median>,<sigma>"
+    MOCK_TOKENS_PER_SECOND  Generation speed after the first token (0 = instant)
+    MOCK_COMPLETION_TOKENS  Completion length for text responses
+    MOCK_ERROR_RATE         Fraction of requests that fail (0-1)
+    MOCK_ERROR_STATUS       HTTP status of injected failures (e.g. 429, 500, 503)
+    MOCK_RETRY_AFTER        Retry-After seconds sent with injected 429/503 responses
+    MOCK_MAX_CONCURRENCY    Requests beyond this many in flight get a 429, like a provider rate limit (0 = off)
+    MOCK_SEED               Seed for reproducible latency and error draws
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_LATENCY = os.getenv("MOCK_LATENCY", "lognormal:0.4,0.5")
+MOCK_TOKENS_PER_SECOND = float(os.getenv("MOCK_TOKENS_PER_SECOND", "80"))
+MOCK_COMPLETION_TOKENS = int(os.getenv("MOCK_COMPLETION_TOKENS", "150"))
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+MOCK_ERROR_STATUS = int(os.getenv("MOCK_ERROR_STATUS", "500"))
+MOCK_RETRY_AFTER = os.getenv("MOCK_RETRY_AFTER", "1")
+MOCK_MAX_CONCURRENCY = int(os.getenv("MOCK_MAX_CONCURRENCY", "0"))
+
+VISION_RESULT = {
+    "face_shape": "oval",
+    "hair_details": {"color": "brown", "texture": "wavy", "length": "medium"},
+    "eye_details": {"color": "green", "shape": "almond"},
+    "skin_tone": "medium",
+    "other_features": ["freckles"],
+}
+WORDS = "great work so far here is what I noticed about your form and how to complete the remaining fields".split()
+
+app = FastAPI(title="Mock LLM")
+rng = random.Random(int(os.getenv("MOCK_SEED", "0")) or None)
+stats = {"requests": 0, "errors": 0, "streams": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+
+def sample_latency(spec: str = MOCK_LATENCY) -> float:
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return values[0]
+    if kind == "uniform":
+        return rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def estimate_tokens(messages: list) -> int:
+    # Roughly four characters per token; images count as a flat 765 tokens like a high-detail tile set
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+        elif isinstance(content, list):
+            for part in content:
+                tokens += 765 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+    return max(tokens, 1)
+
+
+def completion_text(messages: list) -> str:
+    is_vision = any(
+        isinstance(message.get("content"), list) and any(part.get("type") == "image_url" for part in message["content"])
+        for message in messages
+    )
+    if is_vision:
+        return json.dumps(VISION_RESULT)
+    return " ".join(rng.choice(WORDS) for _ in range(MOCK_COMPLETION_TOKENS))
+
+
+def error_response(status: int = MOCK_ERROR_STATUS) -> JSONResponse:
+    stats["errors"] += 1
+    headers = {"Retry-After": MOCK_RETRY_AFTER} if status in (429, 503) else {}
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": "Injected failure", "type": "mock_error", "code": status}},
+        headers=headers,
+    )
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["in_flight"] += 1
+    stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+    try:
+        return await _chat_completions(request)
+    finally:
+        # Streams are counted until their response object is returned, not until the last chunk
+        stats["in_flight"] -= 1
+
+
+async def _chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if MOCK_MAX_CONCURRENCY and stats["in_flight"] > MOCK_MAX_CONCURRENCY:
+        stats["rate_limited"] += 1
+        return error_response(429)
+    if rng.random() < MOCK_ERROR_RATE:
+        await asyncio.sleep(sample_latency() / 4)
+        return error_response()
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "mock")
+    text = completion_text(body.get("messages", []))
+    pieces = text.split(" ")
+    usage = {
+        "prompt_tokens": estimate_tokens(body.get("messages", [])),
+        "completion_tokens": len(pieces),
+        "total_tokens": estimate_tokens(body.get("messages", [])) + len(pieces),
+    }
+    token_delay = 1.0 / MOCK_TOKENS_PER_SECOND if MOCK_TOKENS_PER_SECOND > 0 else 0.0
+
+    if body.get("stream"):
+        stats["streams"] += 1
+
+        async def events():
+            await asyncio.sleep(sample_latency())
+            for i, piece in enumerate(pieces):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece if i == 0 else " " + piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if token_delay:
+                    await asyncio.sleep(token_delay)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(sample_latency() + token_delay * len(pieces))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+@app.get("/v1/models")
+def list_models():
+    return {"object": "list", "data": [{"id": "grok-beta", "object": "model"}, {"id": "grok-vision-beta", "object": "model"}]}
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+# Settings are read at import time, so they are pinned before any api module is imported:
+# no background match list thread, no on-disk vision cache, and a dummy upstream key
+os.environ.setdefault("MATCH_LISTS_MAINTAINER", "false")
+os.environ.setdefault("VISION_CACHE_ENABLED", "false")
+os.environ.setdefault("XAI_API_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -1,11 +1,57 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from api.routes import router
+from api.services.openai_service import close_clients
+from api.services.job_service import shutdown_job_manager
+from api.services.ingest_service import shutdown_ingest_manager
+from api.services.user_repository import close_mongo_client, ping
+from api.utils.metrics import HTTP_REQUEST_DURATION, TIMING_HEADERS_ENABLED, render_latest, server_timing_header, start_request_timings
+
+logger = logging.getLogger(__name__)
+
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", "2"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created lazily on first use; only their shutdown is managed here.
+    # The match list maintainer loads NumPy, so it is started off the startup path.
+    asyncio.get_running_loop().run_in_executor(None, _start_match_lists).add_done_callback(_log_match_lists_start)
+    yield
+    _stop_match_lists()
+    # Ingest batches use the job manager's process pool, so they stop first
+    await shutdown_ingest_manager()
+    await shutdown_job_manager()
+    await close_clients()
+    await close_mongo_client()
+
+
+def _start_match_lists() -> None:
+    from api.services.match_list_service import start_match_list_maintainer
+    start_match_list_maintainer()
+
+
+def _log_match_lists_start(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Match list maintainer failed to start: %s", str(future.exception()))
+
+
+def _stop_match_lists() -> None:
+    from api.services.match_list_service import shutdown_match_list_maintainer
+    shutdown_match_list_maintainer()
+
 
 app = FastAPI(
     title="DMV Document Validator and Assistant",
     description="A combined API for document validation and DMV assistance.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -19,6 +65,51 @@ app.add_middleware(
 
 app.include_router(router)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = start_request_timings()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if TIMING_HEADERS_ENABLED:
+            timings.append(("total", time.perf_counter() - started))
+            response.headers["Server-Timing"] = server_timing_header(timings)
+        return response
+    finally:
+        # Label by route template rather than raw path to keep cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the DMV Document Validator and Assistant API"}
\ No newline at end of file
+    return {"message": "Welcome to the DMV Document Validator and Assistant API"}
+
+@app.get("/healthz")
+def liveness():
+    """Liveness probe: the worker is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: upstream credentials are configured and MongoDB answers a ping."""
+    checks = {"xai_api_key": bool(os.getenv("XAI_API_KEY"))}
+    try:
+        await asyncio.wait_for(ping(), READINESS_TIMEOUT_SECONDS)
+        checks["mongodb"] = True
+    except Exception:
+        checks["mongodb"] = False
+
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ready" if ready else "not ready", "checks": checks})
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics for this worker."""
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
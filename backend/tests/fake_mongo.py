@@ -0,0 +1,164 @@
+"""
+In-process stand-in for the pymongo collections the services use.
+
+Supports the subset of the API the code calls: create_index (unique
+indexes are enforced), find / find_one with equality, $in and $gt filters
+and inclusion or exclusion projections, update_one with $set and upsert, and
+bulk_write of UpdateOne operations. FakeCollection has the synchronous
+interface; AsyncFakeCollection wraps it with the async one.
+"""
+import copy
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+@dataclass
+class BulkWriteResult:
+    upserted_count: int = 0
+    modified_count: int = 0
+    matched_count: int = 0
+
+
+def _matches(document: dict, filter: dict) -> bool:
+    for field, condition in filter.items():
+        value = document.get(field)
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            for operator, operand in condition.items():
+                if operator == "$in":
+                    if value not in operand:
+                        return False
+                elif operator == "$gt":
+                    if value is None or not value > operand:
+                        return False
+                else:
+                    raise NotImplementedError(f"Filter operator {operator} is not supported")
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    if not any(flag for field, flag in projection.items() if field != "_id"):
+        # Exclusion projection, such as {"_id": 0}
+        return {field: copy.deepcopy(value) for field, value in document.items() if projection.get(field, 1)}
+    included = {field for field, flag in projection.items() if flag and field != "_id"}
+    result = {field: copy.deepcopy(value) for field, value in document.items() if field in included}
+    if projection.get("_id", 1):
+        result["_id"] = document["_id"]
+    return result
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents: List[dict] = []
+        self.unique_fields: List[str] = []
+        self.calls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def create_index(self, field: str, unique: bool = False) -> str:
+        self._count("create_index")
+        if unique and field not in self.unique_fields:
+            values = [document.get(field) for document in self.documents]
+            if len(values) != len(set(values)):
+                raise DuplicateKeyError(field)
+            self.unique_fields.append(field)
+        return f"{field}_1"
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> Iterable[dict]:
+        self._count("find")
+        return [_project(document, projection) for document in self.documents if _matches(document, filter or {})]
+
+    def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        self._count("find_one")
+        for document in self.documents:
+            if _matches(document, filter or {}):
+                return _project(document, projection)
+        return None
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> BulkWriteResult:
+        self._count("update_one")
+        return self._update(filter, update, upsert)
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> BulkWriteResult:
+        self._count("bulk_write")
+        total = BulkWriteResult()
+        for operation in operations:
+            # pymongo's UpdateOne keeps its arguments in private slots
+            result = self._update(operation._filter, operation._doc, operation._upsert)
+            total.upserted_count += result.upserted_count
+            total.modified_count += result.modified_count
+            total.matched_count += result.matched_count
+        return total
+
+    def _update(self, filter: dict, update: dict, upsert: bool) -> BulkWriteResult:
+        unsupported = set(update) - {"$set"}
+        if unsupported:
+            raise NotImplementedError(f"Update operators {sorted(unsupported)} are not supported")
+        changes = update.get("$set", {})
+        for document in self.documents:
+            if _matches(document, filter):
+                modified = any(document.get(field) != value for field, value in changes.items())
+                document.update(copy.deepcopy(changes))
+                return BulkWriteResult(modified_count=int(modified), matched_count=1)
+        if not upsert:
+            return BulkWriteResult()
+        document = {"_id": next(self._ids), **copy.deepcopy(filter), **copy.deepcopy(changes)}
+        for field in self.unique_fields:
+            if any(other.get(field) == document.get(field) for other in self.documents):
+                raise DuplicateKeyError(field)
+        self.documents.append(document)
+        return BulkWriteResult(upserted_count=1)
+
+
+class _AsyncCursor:
+    def __init__(self, documents: Iterable[dict]):
+        self._documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncFakeCollection:
+    """Async interface over a FakeCollection, like pymongo's AsyncCollection."""
+
+    def __init__(self, collection: Optional[FakeCollection] = None):
+        self.sync = collection or FakeCollection()
+
+    @property
+    def documents(self) -> List[dict]:
+        return self.sync.documents
+
+    @property
+    def calls(self) -> Dict[str, int]:
+        return self.sync.calls
+
+    async def create_index(self, field: str, unique: bool = False) -> str:
+        return self.sync.create_index(field, unique=unique)
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> _AsyncCursor:
+        return _AsyncCursor(self.sync.find(filter, projection))
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        return self.sync.find_one(filter, projection)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> BulkWriteResult:
+        return self.sync.update_one(filter, update, upsert=upsert)
+
+    async def bulk_write(self, operations: list, ordered: bool = True) -> BulkWriteResult:
+        return self.sync.bulk_write(operations, ordered=ordered)
@@ -0,0 +1,83 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api import routes
+from api.services import openai_service
+from api.services.session_service import InMemorySessionStore, SessionManager
+from api.services.upstream_service import CircuitOpenError
+
+pytestmark = pytest.mark.anyio
+
+QUESTION = {"question": "What haircut suits a round face?", "gender": "female", "stream": True}
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    sessions = SessionManager(InMemorySessionStore(ttl_seconds=3600, max_sessions=10), 2000, keep_recent=6, summary_max_tokens=100)
+    monkeypatch.setattr(routes, "get_session_manager", lambda: sessions)
+    return sessions
+
+
+def upstream_stream(monkeypatch, tokens, error=None, fail_after=None):
+    async def generate_response_stream(request, history=None):
+        for i, token in enumerate(tokens):
+            if i == fail_after:
+                raise error
+            yield token
+        if error is not None and fail_after is None:
+            raise error
+
+    monkeypatch.setattr(openai_service, "generate_response_stream", generate_response_stream)
+
+
+async def ask(payload: dict = QUESTION) -> httpx.Response:
+    app = FastAPI()
+    app.include_router(routes.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/generate-response", json=payload)
+
+
+def recorded_messages(sessions: SessionManager, response: httpx.Response) -> list:
+    return sessions.store.get(response.headers["X-Session-Id"])["messages"]
+
+
+async def test_tokens_are_framed_as_events_and_terminated(monkeypatch, sessions):
+    upstream_stream(monkeypatch, ["Layers", " and", " \"side\"\nbangs"])
+
+    response = await ask()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == 'data: "Layers"\n\ndata: " and"\n\ndata: " \\"side\\"\\nbangs"\n\ndata: [DONE]\n\n'
+    assert [message["content"] for message in recorded_messages(sessions, response)] == [
+        QUESTION["question"], 'Layers and "side"\nbangs',
+    ]
+
+
+async def test_failure_after_the_first_token_is_reported_in_band_and_not_recorded(monkeypatch, sessions):
+    upstream_stream(monkeypatch, ["Layers", " and"], error=RuntimeError("connection reset"), fail_after=1)
+
+    response = await ask()
+
+    assert response.status_code == 200
+    events = response.text.split("\n\n")
+    assert events[0] == 'data: "Layers"'
+    assert events[1].startswith("event: error\ndata: ")
+    assert "connection reset" in events[1]
+    assert "[DONE]" not in response.text
+    assert recorded_messages(sessions, response) == []
+
+
+@pytest.mark.parametrize("error, status", [(CircuitOpenError(12.5), 503), (RuntimeError("upstream down"), 500)])
+async def test_failure_before_the_first_token_gets_an_error_status(monkeypatch, sessions, error, status):
+    upstream_stream(monkeypatch, [], error=error)
+    session_id = sessions.open(None, "female")["session_id"]
+
+    response = await ask({**QUESTION, "session_id": session_id})
+
+    assert response.status_code == status
+    assert "event: error" not in response.text
+    if status == 503:
+        assert response.headers["Retry-After"] == "13"
+    assert sessions.store.get(session_id)["messages"] == []
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from api.models.document_models import DocumentContext, VisionAttributes
+from api.services.openai_service import _fit_context_to_budget, estimate_tokens
+
+
+def make_context(notes: int = 5, features: int = 20, value: str = "chestnut brown") -> DocumentContext:
+    attributes = VisionAttributes.model_validate({
+        "face_shape": "oval " + value,
+        "hair_details": {"color": value, "texture": "wavy " + value, "length": "long " + value},
+        "eye_details": {"color": "green " + value, "shape": "almond " + value},
+        "skin_tone": "medium " + value,
+        "other_features": [f"feature number {i} with a fairly long description" for i in range(features)],
+    })
+    return DocumentContext(pages=3, attributes=attributes, notes=[f"page {i} had no attributes: " + "x " * 60 for i in range(notes)])
+
+
+@pytest.mark.parametrize("budget", [2000, 300, 120, 60, 30, 1])
+def test_fitted_context_is_always_complete_valid_json(budget):
+    text = _fit_context_to_budget(make_context(value="a very long free text description " * 10), budget)
+
+    DocumentContext.model_validate_json(text)
+    assert isinstance(json.loads(text), dict)
+
+
+def test_context_within_budget_is_unchanged():
+    context = make_context(notes=1, features=2)
+    text = _fit_context_to_budget(context, 10_000)
+
+    assert text == context.to_prompt_json()
+
+
+def test_notes_and_trailing_features_go_before_attributes():
+    context = make_context()
+    budget = estimate_tokens(make_context(notes=0, features=3).to_prompt_json())
+
+    fitted = DocumentContext.model_validate_json(_fit_context_to_budget(context, budget))
+
+    assert fitted.notes == []
+    assert fitted.attributes.other_features == context.attributes.other_features[:len(fitted.attributes.other_features)]
+    assert fitted.attributes.hair_details.color == "chestnut brown"
+    assert fitted.attributes.eye_details.shape is not None
+    assert estimate_tokens(fitted.to_prompt_json()) <= budget
+
+
+def test_long_values_are_shortened_at_a_word_boundary():
+    context = make_context(notes=0, features=0, value="with streaks of copper and gold that catch the light " * 4)
+    budget = estimate_tokens(context.to_prompt_json()) // 2
+
+    fitted = DocumentContext.model_validate_json(_fit_context_to_budget(context, budget))
+
+    color = fitted.attributes.hair_details.color
+    assert color.endswith("…") and len(color) <= 120
+    assert color[:-1] in context.attributes.hair_details.color
+    assert estimate_tokens(fitted.to_prompt_json()) <= budget
+
+
+def test_lower_priority_attributes_are_dropped_first():
+    context = make_context(notes=0, features=0)
+    budget = estimate_tokens(context.to_prompt_json()) - 10
+
+    fitted = DocumentContext.model_validate_json(_fit_context_to_budget(context, budget))
+
+    assert fitted.attributes.eye_details.shape is None
+    assert fitted.attributes.hair_details.color == "chestnut brown"
+    assert fitted.attributes.eye_details.color is not None
+    assert estimate_tokens(fitted.to_prompt_json()) <= budget
+
+
+def test_fitting_does_not_modify_the_callers_context():
+    context = make_context()
+    _fit_context_to_budget(context, 20)
+
+    assert len(context.notes) == 5 and len(context.attributes.other_features) == 20
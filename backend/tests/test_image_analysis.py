@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from api.services.openai_service import LOCAL_REJECT_DOCUMENT_KINDS, LOCAL_REJECT_PHOTO_KINDS
+from api.utils.image_analysis import BLANK, DOCUMENT, GRAPHIC, TOO_SMALL, analyze_image
+
+# Everything the local tier may reject without asking the vision model
+REJECTED_KINDS = LOCAL_REJECT_DOCUMENT_KINDS | LOCAL_REJECT_PHOTO_KINDS
+
+
+def with_noise(image: Image.Image, sigma: float, seed: int = 0) -> Image.Image:
+    pixels = np.asarray(image, dtype=np.float32)
+    pixels = pixels + np.random.default_rng(seed).normal(0, sigma, pixels.shape)
+    return Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+
+
+def page(lines=(), boxes=0, width=1700, height=2200) -> Image.Image:
+    """Scanned form: off-white paper, the given lines of text and some empty answer boxes."""
+    image = Image.new("RGB", (width, height), (250, 250, 247))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=28)
+    for i, text in enumerate(lines):
+        draw.text((150, 200 + i * 60), text, fill=(20, 20, 20), font=font)
+    for i in range(boxes):
+        top = 300 + len(lines) * 60 + i * 120
+        draw.rectangle([150, top, width - 200, top + 60], outline=(90, 90, 90), width=2)
+    return with_noise(image, 2.5)
+
+
+def portrait(face_scale: float, background: int = 245, mode: str = "L", width: int = 1000, height: int = 1250) -> Image.Image:
+    """Headshot on a plain studio backdrop: hair, face with eyes and mouth, dark clothing."""
+    colors = {
+        "L": {"hair": 25, "skin": 200, "features": 45, "clothes": 30},
+        "RGB": {"hair": (40, 28, 20), "skin": (236, 198, 170), "features": (70, 40, 35), "clothes": (25, 25, 35)},
+    }[mode]
+    image = Image.new(mode, (width, height), background if mode == "L" else (background,) * 3)
+    draw = ImageDraw.Draw(image)
+    cx, cy = width * 0.5, height * 0.4
+    rx = ry = width * face_scale
+    ry *= 1.3
+    draw.ellipse([cx - rx * 1.15, cy - ry * 1.1, cx + rx * 1.15, cy + ry * 0.6], fill=colors["hair"])
+    draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=colors["skin"])
+    for side in (-1, 1):
+        eye = cx + side * rx * 0.4
+        draw.ellipse([eye - rx * 0.12, cy - ry * 0.15, eye + rx * 0.12, cy - ry * 0.02], fill=colors["features"])
+    draw.line([cx - rx * 0.3, cy + ry * 0.45, cx + rx * 0.3, cy + ry * 0.45], fill=colors["features"], width=max(2, int(rx * 0.05)))
+    draw.rectangle([cx - rx * 1.6, cy + ry, cx + rx * 1.6, cy + ry * 3], fill=colors["clothes"])
+    image = image.filter(ImageFilter.GaussianBlur(1.5))
+    return with_noise(image.convert("RGB"), 3)
+
+
+def text_page(width=1400) -> Image.Image:
+    height = int(width * 1.3)
+    image = Image.new("RGB", (width, height), (245, 245, 240))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=width // 50)
+    for y in range(int(height * 0.08), int(height * 0.9), width // 30):
+        draw.text((int(width * 0.08), y), "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do", fill=(15, 15, 15), font=font)
+    return with_noise(image, 3)
+
+
+@pytest.mark.parametrize("lines, boxes", [
+    (["Name: ______________________"], 0),
+    (["Date of birth: ____ / ____ / ________"], 0),
+    (["APPLICATION FORM"], 2),
+    (["Signature:", "Date:"], 0),
+])
+def test_sparse_form_is_not_blank(lines, boxes):
+    analysis = analyze_image(page(lines, boxes))
+
+    assert analysis.kind != BLANK
+    assert analysis.stats["ink_pixels"] > 100
+
+
+def test_single_short_word_on_a_page_is_not_blank():
+    analysis = analyze_image(page(["X"]))
+
+    assert analysis.kind != BLANK
+
+
+@pytest.mark.parametrize("level, noise", [(250, 1.5), (5, 1.5), (128, 4), (235, 6)])
+def test_empty_page_is_blank(level, noise):
+    image = with_noise(Image.new("RGB", (1600, 2000), (level,) * 3), noise)
+
+    analysis = analyze_image(image)
+
+    assert (analysis.kind, analysis.confident) == (BLANK, True)
+
+
+@pytest.mark.parametrize("face_scale", [0.3, 0.2, 0.1, 0.05])
+@pytest.mark.parametrize("background", [245, 255])
+def test_monochrome_portrait_is_never_confidently_rejected(face_scale, background):
+    analysis = analyze_image(portrait(face_scale, background, mode="L"))
+
+    assert not (analysis.confident and analysis.kind in REJECTED_KINDS), analysis
+
+
+@pytest.mark.parametrize("face_scale", [0.12, 0.07, 0.04])
+def test_small_face_portrait_on_white_is_never_confidently_rejected(face_scale):
+    analysis = analyze_image(portrait(face_scale, 250, mode="RGB", width=1200, height=1500))
+
+    assert not (analysis.confident and analysis.kind in REJECTED_KINDS), analysis
+
+
+def test_sparse_forms_and_portraits_escalate_to_the_model():
+    for image in (page(["Name: ____________"]), portrait(0.1), portrait(0.05, mode="RGB")):
+        analysis = analyze_image(image)
+        assert not analysis.confident or analysis.kind not in REJECTED_KINDS
+
+
+@pytest.mark.parametrize("width", [1000, 1568, 2400])
+def test_full_text_page_is_a_confident_document(width):
+    analysis = analyze_image(text_page(width))
+
+    assert (analysis.kind, analysis.confident) == (DOCUMENT, True)
+
+
+def test_flat_color_graphic_is_confident():
+    image = Image.new("RGB", (1200, 900), (30, 120, 200))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([100, 100, 700, 500], fill=(240, 200, 20))
+    draw.ellipse([600, 300, 1100, 800], fill=(200, 30, 60))
+
+    analysis = analyze_image(image)
+
+    assert (analysis.kind, analysis.confident) == (GRAPHIC, True)
+
+
+def test_tiny_image_is_too_small():
+    analysis = analyze_image(portrait(0.2).resize((80, 100)))
+
+    assert (analysis.kind, analysis.confident) == (TOO_SMALL, True)
+
+
+def test_original_size_decides_too_small_after_downscaling():
+    image = text_page(1000)
+
+    assert analyze_image(image, original_size=(60, 78)).kind == TOO_SMALL
+    assert analyze_image(image, original_size=(4000, 5200)).kind == DOCUMENT
+
+
+def test_shapes_differing_only_in_hue_are_not_blank():
+    # Same luminance (about 150) in three hues
+    image = Image.new("RGB", (1200, 900), (150, 150, 150))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([100, 100, 500, 500], fill=(250, 133, 105))
+    draw.ellipse([600, 300, 1000, 700], fill=(87, 180, 115))
+
+    assert analyze_image(image).kind != BLANK
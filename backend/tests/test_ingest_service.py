@@ -0,0 +1,139 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+
+from api.services import ingest_service
+from api.services.ingest_service import FAILED, PENDING, IngestManager
+from api.utils.image_utils import ResourceLimitError
+
+KB = 1024
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_service, "INGEST_MAX_UPLOAD_BYTES", 1000 * KB)
+    monkeypatch.setattr(ingest_service, "MAX_UPLOAD_BYTES", 400 * KB)
+    return IngestManager(str(tmp_path), 4, 1, 1, 10, 1.0, 1, 3600)
+
+
+def zip_of(sizes):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i, size in enumerate(sizes):
+            archive.writestr(f"user{i}.png", b"\0" * size)
+    buffer.seek(0)
+    return buffer
+
+
+def test_archive_within_the_cap_is_staged(manager, tmp_path):
+    manifest = manager.stage_batch([("photos.zip", "application/zip", zip_of([300 * KB] * 3))])
+
+    assert [item["status"] for item in manifest["items"]] == [PENDING] * 3
+    batch_dir = tmp_path / manifest["batch_id"]
+    assert sum(os.path.getsize(batch_dir / item["path"]) for item in manifest["items"]) == 900 * KB
+
+
+def test_archive_unpacking_past_the_cap_fails_the_batch(manager, tmp_path):
+    upload = zip_of([300 * KB] * 5)
+    # A few kilobytes compressed, 1.5 MB unpacked
+    assert len(upload.getvalue()) < 20 * KB
+
+    with pytest.raises(ResourceLimitError, match="Batch unpacks to more than"):
+        manager.stage_batch([("photos.zip", "application/zip", upload)])
+    assert os.listdir(tmp_path) == []
+
+
+def test_extracted_bytes_are_counted_across_uploads(manager):
+    uploads = [("a.zip", "application/zip", zip_of([300 * KB] * 2)), ("b.zip", "application/zip", zip_of([300 * KB] * 2))]
+
+    with pytest.raises(ResourceLimitError):
+        manager.stage_batch(uploads)
+
+
+def test_oversized_image_fails_only_its_item(manager):
+    manifest = manager.stage_batch([("photos.zip", "application/zip", zip_of([500 * KB, 100 * KB]))])
+
+    assert [item["status"] for item in manifest["items"]] == [FAILED, PENDING]
+    assert "larger than" in manifest["items"][0]["error"]
+
+
+@pytest.mark.anyio
+async def test_ingest_vision_calls_count_against_their_own_cap(monkeypatch):
+    from fastapi import HTTPException
+    from api.services import openai_service
+
+    semaphores = []
+
+    class Upstream:
+        async def call_async(self, model, factory, semaphore=None, **kwargs):
+            semaphores.append(semaphore)
+            raise RuntimeError("upstream unavailable")
+
+    monkeypatch.setattr(openai_service, "get_upstream", lambda: Upstream())
+    ingest_slots = asyncio.Semaphore(1)
+
+    with pytest.raises(HTTPException):
+        await openai_service.extract_image_async("aW5nZXN0", semaphore=ingest_slots)
+    with pytest.raises(HTTPException):
+        await openai_service.extract_image_async("aW50ZXJhY3RpdmU=")
+
+    assert semaphores == [ingest_slots, openai_service._get_vision_semaphore()]
+
+
+def other_worker(tmp_path) -> IngestManager:
+    """A second manager on the same work directory, as another uvicorn worker would have."""
+    return IngestManager(str(tmp_path), 4, 1, 1, 10, 1.0, 1, 3600)
+
+
+@pytest.mark.anyio
+async def test_batch_running_in_one_worker_cannot_be_resumed_in_another(manager, tmp_path):
+    release = asyncio.Event()
+    runs = []
+
+    async def pipeline(manifest):
+        runs.append(manifest["batch_id"])
+        await release.wait()
+
+    manager._pipeline = pipeline
+    manifest = manager.stage_batch([("alice.png", "image/png", io.BytesIO(b"\0" * KB))])
+    await manager.start(manifest)
+    await asyncio.sleep(0.05)
+    worker = other_worker(tmp_path)
+    worker._pipeline = pipeline
+
+    with pytest.raises(ingest_service.IngestBatchRunningError):
+        await worker.resume(manifest["batch_id"])
+    assert runs == [manifest["batch_id"]]
+
+    release.set()
+    await asyncio.wait_for(manager._tasks[manifest["batch_id"]], 1)
+    # Once the first run has ended, the claim is free
+    assert (await worker.resume(manifest["batch_id"]))["batch_id"] == manifest["batch_id"]
+    await asyncio.wait_for(worker._tasks[manifest["batch_id"]], 1)
+    assert len(runs) == 2
+
+
+@pytest.mark.anyio
+async def test_expiry_keeps_a_batch_running_in_another_worker(manager, tmp_path):
+    release = asyncio.Event()
+
+    async def pipeline(manifest):
+        await release.wait()
+
+    manager._pipeline = pipeline
+    manifest = manager.stage_batch([("alice.png", "image/png", io.BytesIO(b"\0" * KB))])
+    await manager.start(manifest)
+    await asyncio.sleep(0.05)
+    worker = other_worker(tmp_path)
+    worker.ttl_seconds = -1
+
+    worker._expire_batches()
+
+    assert os.path.isdir(tmp_path / manifest["batch_id"])
+    release.set()
+    await asyncio.wait_for(manager._tasks[manifest["batch_id"]], 1)
+    worker._expire_batches()
+    assert not os.path.exists(tmp_path / manifest["batch_id"])
@@ -0,0 +1,164 @@
+import random
+
+import pytest
+
+from api.services import user_repository
+from api.services.match_list_service import MATCH_LISTS_COLLECTION, MatchListMaintainer, MatchLists, get_fresh_match_list
+from api.services.matching_service import KNOWN_VALUES, ProfileIndex
+from api.services.user_repository import USERS_COLLECTION, UserRepository
+from fake_mongo import AsyncFakeCollection, FakeCollection
+
+pytestmark = pytest.mark.anyio
+
+CANDIDATES = [{"user_id": f"user-{i}", "score": 90.0 - i} for i in range(5)]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = {USERS_COLLECTION: AsyncFakeCollection(), MATCH_LISTS_COLLECTION: AsyncFakeCollection()}
+    monkeypatch.setattr(user_repository, "get_database", lambda: database)
+    monkeypatch.setattr(user_repository, "_user_repository", UserRepository(database[USERS_COLLECTION]))
+    return database
+
+
+def store(database, profile_updated_at: float, list_updated_at: float, stale: bool = False) -> None:
+    database[USERS_COLLECTION].documents.append(
+        {"_id": 1, "user_id": "alice", "characteristics": {}, "characteristics_updated_at": profile_updated_at}
+    )
+    database[MATCH_LISTS_COLLECTION].documents.append(
+        {"_id": 1, "user_id": "alice", "candidates": CANDIDATES, "stale": stale, "updated_at": list_updated_at}
+    )
+
+
+async def test_current_list_is_served(database):
+    store(database, profile_updated_at=100.0, list_updated_at=105.0)
+
+    assert await get_fresh_match_list("alice", 3) == CANDIDATES[:3]
+
+
+async def test_stale_list_is_not_served(database):
+    store(database, profile_updated_at=100.0, list_updated_at=105.0, stale=True)
+
+    assert await get_fresh_match_list("alice", 3) is None
+
+
+async def test_list_older_than_the_profile_is_not_served(database):
+    store(database, profile_updated_at=110.0, list_updated_at=105.0)
+
+    assert await get_fresh_match_list("alice", 3) is None
+
+
+async def test_short_or_missing_list_is_not_served(database):
+    assert await get_fresh_match_list("alice", 3) is None
+    store(database, profile_updated_at=100.0, list_updated_at=105.0)
+    assert await get_fresh_match_list("alice", 6) is None
+
+
+# Incremental maintenance
+
+def random_characteristics(rng: random.Random) -> dict:
+    # Few values per attribute, so rankings are full of ties and candidates move in and out of lists
+    return {
+        "face_shape": rng.choice(KNOWN_VALUES["face_shape"][:3]),
+        "skin_tone": rng.choice(KNOWN_VALUES["skin_tone"][:3]),
+        "hair_details": {"color": rng.choice(KNOWN_VALUES["hair_color"][:3]), "length": rng.choice(["short", "long", None])},
+        "eye_details": {"color": rng.choice(KNOWN_VALUES["eye_color"][:3])},
+        "other_features": rng.sample(["freckles", "glasses", "beard", "dimples"], rng.randint(0, 2)),
+    }
+
+
+def random_intentions(rng: random.Random):
+    return rng.choice([None, ["friendship"], ["dating"], ["friendship", "networking"]])
+
+
+def assert_matches_recomputed(match_lists: MatchLists, owner: str) -> None:
+    """Checks a list against a from-scratch top-K; ties may be listed in any order."""
+    index = match_lists.index
+    row = index.positions[owner]
+    expected = index.top_k_row(row, match_lists.size)
+    listed = match_lists.get(owner)
+    assert [score for _, score in listed] == pytest.approx([score for _, score in expected], abs=1e-3), owner
+    scores = index.score_row(row)
+    for candidate, score in listed:
+        assert candidate != owner
+        assert float(scores[index.positions[candidate]]) == pytest.approx(score, abs=1e-3), (owner, candidate)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_updates_keep_clean_lists_equal_to_a_full_recompute(seed):
+    rng = random.Random(seed)
+    profiles = [
+        {"user_id": f"user-{i}", "characteristics": random_characteristics(rng), "intentions": random_intentions(rng)}
+        for i in range(60)
+    ]
+    match_lists = MatchLists(ProfileIndex.build(profiles), size=5)
+    match_lists.build_all()
+    assert not match_lists.dirty
+
+    user_ids = [profile["user_id"] for profile in profiles]
+    for step in range(300):
+        action = rng.random()
+        if action < 0.1:
+            # New user
+            user_id = f"user-{len(user_ids)}"
+            user_ids.append(user_id)
+            changed = match_lists.apply_change(user_id, random_characteristics(rng), random_intentions(rng))
+        elif action < 0.25:
+            # Deleted profile: characteristics and intentions cleared, so it scores 0 for everyone
+            user_id = rng.choice(user_ids)
+            changed = match_lists.apply_change(user_id, {}, None)
+        else:
+            user_id = rng.choice(user_ids)
+            changed = match_lists.apply_change(user_id, random_characteristics(rng), random_intentions(rng))
+
+        assert user_id in changed
+        for owner in user_ids:
+            if owner not in match_lists.dirty:
+                assert_matches_recomputed(match_lists, owner)
+
+    # Reconciling the dirty lists brings every list back to a full recompute
+    for owner in list(match_lists.dirty):
+        match_lists.recompute(owner)
+    for owner in user_ids:
+        assert_matches_recomputed(match_lists, owner)
+
+
+def stored_profile(user_id: str, characteristics: dict, updated_at: float) -> dict:
+    return {"_id": user_id, "user_id": user_id, "characteristics": characteristics, "characteristics_updated_at": updated_at}
+
+
+def listed(lists: FakeCollection, owner: str) -> list:
+    return [candidate["user_id"] for candidate in lists.find_one({"user_id": owner})["candidates"]]
+
+
+def test_dirty_list_is_persisted_stale_then_reconciled():
+    alice = {"face_shape": "oval", "hair_details": {"color": "brown"}, "skin_tone": "fair"}
+    users, lists = FakeCollection(), FakeCollection()
+    users.documents.extend([
+        stored_profile("alice", alice, 100.0),
+        stored_profile("bob", alice, 100.0),
+        stored_profile("carol", {**alice, "skin_tone": "tan"}, 100.0),
+        stored_profile("dave", {**alice, "hair_details": {"color": "black"}}, 100.0),
+        stored_profile("erin", {"face_shape": "square"}, 100.0),
+    ])
+    maintainer = MatchListMaintainer(users, lists, size=2)
+    maintainer._bootstrap()
+    maintainer._reconcile()
+    assert not maintainer.match_lists.dirty
+    assert listed(lists, "alice") == ["bob", "carol"]
+
+    # Bob no longer resembles alice, so dave, who is not on her list, now ranks above him
+    users.documents[1] = stored_profile("bob", {"face_shape": "square"}, 200.0)
+    maintainer._apply_batch([("bob", 200.0)])
+
+    assert "alice" in maintainer.match_lists.dirty
+    assert lists.find_one({"user_id": "alice"})["stale"] is True
+    # Until it is reconciled the list keeps bob last, at his new score
+    assert listed(lists, "alice") == ["carol", "bob"]
+
+    maintainer._reconcile()
+
+    assert not maintainer.match_lists.dirty
+    assert lists.find_one({"user_id": "alice"})["stale"] is False
+    assert listed(lists, "alice") == ["carol", "dave"]
+    assert_matches_recomputed(maintainer.match_lists, "alice")
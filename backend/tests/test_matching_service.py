@@ -0,0 +1,221 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from api.models.document_models import MatchRequest
+from api.services import matching_service, user_repository
+from api.services.matching_service import (
+    CATEGORICAL_FIELDS, HASHED_CODE_OFFSET, MISSING_CODE, ProfileIndex, _jaccard, encode_profile, find_top_matches,
+    get_profile_index,
+)
+from api.services.user_repository import UserRepository
+from fake_mongo import AsyncFakeCollection, FakeCollection
+
+pytestmark = pytest.mark.anyio
+
+FACE = {"face_shape": "oval", "hair_details": {"color": "brown"}, "skin_tone": "fair"}
+
+
+@pytest.fixture
+def users(monkeypatch):
+    users = AsyncFakeCollection()
+    monkeypatch.setattr(user_repository, "_user_repository", UserRepository(users))
+    monkeypatch.setattr(user_repository, "get_users_collection", lambda: users.sync)
+    monkeypatch.setattr(matching_service, "_profile_index", None)
+    return users
+
+
+def add_user(users: AsyncFakeCollection, user_id: str, characteristics: dict, **fields) -> None:
+    users.documents.append({"_id": user_id, "user_id": user_id, "characteristics": characteristics, **fields})
+
+
+# Scoring engine
+
+def test_encode_profile_normalizes_known_values_and_hashes_the_rest():
+    codes, features, intentions = encode_profile({
+        "face_shape": "Heart-Shaped",
+        "hair_details": {"color": "Blond", "texture": "<value>"},
+        "eye_details": {"color": "unknown"},
+        "skin_tone": "periwinkle",
+    })
+
+    by_field = dict(zip([field for field, _ in CATEGORICAL_FIELDS], codes.tolist()))
+    assert by_field["face_shape"] == 3  # "heart"
+    assert by_field["hair_color"] == 2  # "blonde"
+    assert by_field["hair_texture"] == by_field["eye_color"] == by_field["eye_shape"] == MISSING_CODE
+    assert by_field["skin_tone"] >= HASHED_CODE_OFFSET
+    assert by_field["skin_tone"] == encode_profile({"skin_tone": " PERIWINKLE "})[0][-1]
+    assert features == intentions == 0
+
+
+def test_feature_and_intention_masks_set_one_bit_per_distinct_value():
+    _, features, intentions = encode_profile({"other_features": ["Freckles", "glasses", "freckles"]}, {"goal": "dating"})
+
+    assert bin(features).count("1") == 2
+    assert bin(intentions).count("1") == 1
+    assert encode_profile({}, "goal=dating")[2] == intentions
+    assert encode_profile({"other_features": "glasses"})[1] & features
+
+
+def test_jaccard_of_masks():
+    masks = np.array([0b1011, 0b0001, 0b0100, 0], dtype=np.uint64)
+
+    assert _jaccard(masks, 0b0011).tolist() == pytest.approx([2 / 3, 1 / 2, 0.0, 0.0])
+    assert _jaccard(masks, 0).tolist() == [0.0, 0.0, 0.0, 0.0]
+
+
+QUERY = {
+    "user_id": "query",
+    "characteristics": {
+        "face_shape": "oval", "hair_details": {"color": "brown"}, "eye_details": {"color": "blue"},
+        "other_features": ["freckles", "glasses"],
+    },
+    "intentions": ["dating", "friendship"],
+}
+PROFILES = [
+    QUERY,
+    {
+        "user_id": "same-look",
+        "characteristics": {
+            "face_shape": "oval", "hair_details": {"color": "brown"}, "eye_details": {"color": "blue"}, "other_features": ["freckles"],
+        },
+        "intentions": ["dating"],
+    },
+    {
+        "user_id": "same-hair",
+        "characteristics": {
+            "face_shape": "round", "hair_details": {"color": "brown"}, "eye_details": {"color": "green"},
+            "other_features": ["freckles", "glasses", "beard"],
+        },
+        "intentions": ["friendship"],
+    },
+    {"user_id": "face-only", "characteristics": {"face_shape": "oval"}},
+    {"user_id": "empty", "characteristics": {}},
+]
+
+
+def test_scores_match_a_hand_computed_example():
+    index = ProfileIndex.build(PROFILES)
+
+    scores = index.score(QUERY["characteristics"], QUERY["intentions"])
+
+    # Weights of the attributes the query has: face 1, hair color 1.5, eye color 1.5, features 1, intentions 3
+    total = 1 + 1.5 + 1.5 + 1 + 3
+    assert scores.tolist() == pytest.approx([
+        100.0,
+        100 * (1 + 1.5 + 1.5 + 1 * 1 / 2 + 3 * 1 / 2) / total,  # features {freckles} of 2, intentions {dating} of 2
+        100 * (1.5 + 1 * 2 / 3 + 3 * 1 / 2) / total,  # features 2 shared of 3, intentions {friendship} of 2
+        100 * 1 / total,
+        0.0,
+    ], abs=1e-4)
+
+
+def test_attributes_missing_from_the_query_do_not_count():
+    index = ProfileIndex.build(PROFILES)
+
+    scores = index.score({"face_shape": "oval"})
+
+    assert scores.tolist() == pytest.approx([100.0, 100.0, 0.0, 100.0, 0.0])
+
+
+def test_reverse_scores_rank_the_row_from_every_profiles_point_of_view():
+    index = ProfileIndex.build(PROFILES)
+    row = index.positions["query"]
+
+    reverse = index.reverse_scores(row)
+
+    # face-only weighs only the face shape, which the query shares
+    assert reverse[index.positions["face-only"]] == pytest.approx(100.0)
+    assert reverse[index.positions["empty"]] == 0.0
+    for other in range(len(index)):
+        assert reverse[other] == pytest.approx(index.score_row(other)[row], abs=1e-4)
+
+
+def test_top_k_excludes_the_user_and_orders_by_score():
+    index = ProfileIndex.build(PROFILES)
+
+    ranked = index.top_k_row(index.positions["query"], 3)
+
+    assert [user_id for user_id, _ in ranked] == ["same-look", "same-hair", "face-only"]
+    assert ranked[0][1] == pytest.approx(75.0)
+
+
+def test_expired_index_is_served_while_one_background_rebuild_runs(monkeypatch):
+    monkeypatch.setattr(matching_service, "_profile_index", None)
+    collection = FakeCollection()
+    collection.documents.extend({"_id": i, **profile} for i, profile in enumerate(PROFILES))
+    rebuilding, release = threading.Event(), threading.Event()
+    build = matching_service._build_profile_index
+
+    def slow_build(users_collection):
+        rebuilding.set()
+        release.wait(5)
+        return build(users_collection)
+
+    first = get_profile_index(collection)
+    monkeypatch.setattr(matching_service, "_build_profile_index", slow_build)
+    first.built_at -= matching_service.MATCH_INDEX_TTL_SECONDS + 1
+
+    # Requests get the expired index at once; only one rebuild starts
+    assert get_profile_index(collection) is first
+    assert rebuilding.wait(5)
+    assert get_profile_index(collection) is first
+    release.set()
+    for _ in range(100):
+        if get_profile_index(collection) is not first:
+            break
+        time.sleep(0.01)
+
+    assert get_profile_index(collection) is not first
+    assert collection.calls["find"] == 2
+
+
+# Direct path
+
+async def test_stored_top_level_intentions_rank_like_the_index(users):
+    add_user(users, "alice", FACE, intentions=["dating"])
+    add_user(users, "bob", FACE, intentions=["friendship"])
+    add_user(users, "carol", FACE, intentions=["dating"])
+    add_user(users, "dave", {**FACE, "intentions": ["friendship"]}, intentions=["dating"])
+
+    matches = await find_top_matches("alice", k=3)
+
+    index = ProfileIndex.build(users.sync.find())
+    expected = index.top_k_row(index.positions["alice"], 3)
+    assert [(match["user_id"], match["score"]) for match in matches] == [(user_id, round(score, 2)) for user_id, score in expected]
+    assert {match["user_id"] for match in matches[:2]} == {"carol", "dave"}
+    assert matches[2] == {"user_id": "bob", "score": pytest.approx(100 * 3.5 / 6.5, abs=0.01)}
+
+
+async def test_intentions_inside_characteristics_are_used_without_a_top_level_field(users):
+    add_user(users, "alice", {**FACE, "intentions": ["dating"]})
+    add_user(users, "bob", FACE, intentions=["friendship"])
+    add_user(users, "carol", FACE, intentions=["dating"])
+
+    matches = await find_top_matches("alice", k=2)
+
+    assert [match["user_id"] for match in matches] == ["carol", "bob"]
+    assert matches[0]["score"] == 100.0
+
+
+async def test_unknown_user_is_not_found(users):
+    with pytest.raises(Exception) as error:
+        await find_top_matches("nobody")
+
+    assert error.value.status_code == 404
+
+
+@pytest.mark.parametrize("k", [-3, 0, 101])
+def test_match_request_rejects_k_out_of_range(k):
+    with pytest.raises(ValidationError):
+        MatchRequest(user_id="alice", k=k)
+
+
+def test_top_k_of_zero_is_empty():
+    index = ProfileIndex.build([{"user_id": f"user-{i}", "characteristics": FACE} for i in range(5)])
+
+    assert index.top_k(FACE, k=0) == []
+    assert len(index.top_k(FACE, k=10)) == 5
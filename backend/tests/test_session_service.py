@@ -0,0 +1,116 @@
+import pytest
+
+from api.services.session_service import InMemorySessionStore, SessionManager, SQLiteSessionStore
+
+HISTORY_MAX_TOKENS = 200
+SUMMARY_MAX_TOKENS = 40
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def sessions(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=3600)
+    else:
+        store = InMemorySessionStore(ttl_seconds=3600, max_sessions=10)
+    return SessionManager(store, HISTORY_MAX_TOKENS, keep_recent=6, summary_max_tokens=SUMMARY_MAX_TOKENS)
+
+
+class Summarizer:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, summary, messages):
+        self.calls.append((summary, messages))
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        return f"{summary} [{len(messages)} messages]".strip()
+
+
+def take_turn(sessions: SessionManager, session_id: str, turn: int, summarize) -> bool:
+    question = f"Question {turn}: what hairstyle suits an oval face with wavy hair?"
+    answer = f"Answer {turn}: " + "layered cuts with soft curtain bangs work well " * 3
+    assert sessions.record_turn(session_id, question, answer) is not None
+    return sessions.compact(session_id, summarize)
+
+
+def test_short_history_is_not_compacted(sessions):
+    session = sessions.open(None, "female")
+    summarize = Summarizer()
+
+    assert not take_turn(sessions, session["session_id"], 0, summarize)
+    assert summarize.calls == []
+    assert len(sessions.store.get(session["session_id"])["messages"]) == 2
+
+
+@pytest.mark.parametrize("fail", [False, True], ids=["summary", "extractive"])
+def test_history_stays_bounded_however_long_the_conversation(sessions, fail):
+    session_id = sessions.open(None, "female")["session_id"]
+    summarize = Summarizer(fail=fail)
+
+    compactions = 0
+    for turn in range(60):
+        compactions += take_turn(sessions, session_id, turn, summarize)
+        session = sessions.store.get(session_id)
+        assert sessions.history_tokens(session) <= HISTORY_MAX_TOKENS
+        assert len(session["summary"]) <= SUMMARY_MAX_TOKENS * 4
+
+    assert len(summarize.calls) == compactions
+    # Compacting to half the budget means the summary is not regenerated every turn
+    assert 5 < compactions < 30
+    # The most recent turn is always kept verbatim
+    assert session["messages"][-2]["content"].startswith("Question 59:")
+
+
+def test_extractive_fallback_keeps_the_clients_words(sessions):
+    session_id = sessions.open(None)["session_id"]
+    summarize = Summarizer(fail=True)
+
+    turn = 0
+    while not take_turn(sessions, session_id, turn, summarize):
+        turn += 1
+
+    summary = sessions.store.get(session_id)["summary"]
+    assert summary.startswith("The client said: Question 0: what hairstyle suits")
+    assert "Answer 0" not in summary
+
+
+def test_prompt_prefix_is_unchanged_between_compactions(sessions):
+    session_id = sessions.open(None, "male")["session_id"]
+    summarize = Summarizer()
+    profile = {"role": "system", "content": "Client profile: gender male."}
+
+    previous = sessions.history_messages(sessions.store.get(session_id))
+    unchanged_turns = 0
+    for turn in range(30):
+        compacted = take_turn(sessions, session_id, turn, summarize)
+        current = sessions.history_messages(sessions.store.get(session_id))
+
+        assert current[0] == profile
+        if compacted:
+            # Only the summary message and the folded messages change
+            assert current[1]["content"].startswith("Summary of the conversation so far:")
+            assert current[2:] == sessions.store.get(session_id)["messages"]
+        else:
+            assert current[:len(previous)] == previous
+            unchanged_turns += 1
+        previous = current
+
+    assert unchanged_turns > 20
+
+
+def test_turns_recorded_during_summarization_are_kept(sessions):
+    session_id = sessions.open(None)["session_id"]
+    for turn in range(5):
+        sessions.record_turn(session_id, f"Question {turn}: " + "x " * 100, f"Answer {turn}: " + "y " * 100)
+
+    def summarize(summary, messages):
+        # Another request finishes its turn while the summary is being written
+        sessions.record_turn(session_id, "Late question", "Late answer")
+        return "summary"
+
+    assert sessions.compact(session_id, summarize)
+
+    messages = sessions.store.get(session_id)["messages"]
+    assert [message["content"] for message in messages[-2:]] == ["Late question", "Late answer"]
+    assert sessions.store.get(session_id)["summary"] == "summary"
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.services.openai_service import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """Counts calls and holds each one open until released."""
+
+    def __init__(self, result="answer", error: Exception = None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def call(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def test_concurrent_identical_requests_call_upstream_once():
+    flight, upstream = SingleFlight(), Upstream()
+
+    waiters = [asyncio.ensure_future(flight.run_async("key", "model", upstream.call)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert flight.in_flight() == 1
+    upstream.release.set()
+
+    assert await asyncio.gather(*waiters) == ["answer"] * 5
+    assert upstream.calls == 1
+    assert flight.in_flight() == 0
+
+
+async def test_different_keys_are_not_coalesced():
+    flight, upstream = SingleFlight(), Upstream()
+    upstream.release.set()
+
+    await asyncio.gather(flight.run_async("a", "model", upstream.call), flight.run_async("b", "model", upstream.call))
+
+    assert upstream.calls == 2
+
+
+async def test_cancelled_leader_does_not_cancel_waiting_followers():
+    flight, upstream = SingleFlight(), Upstream()
+    leader = asyncio.ensure_future(flight.run_async("key", "model", upstream.call))
+    await asyncio.sleep(0)
+    followers = [asyncio.ensure_future(flight.run_async("key", "model", upstream.call)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    assert leader.cancelled()
+    upstream.release.set()
+
+    assert await asyncio.gather(*followers) == ["answer", "answer"]
+    assert upstream.calls == 1
+    assert not upstream.cancelled
+
+
+async def test_call_is_cancelled_once_every_waiter_is_gone():
+    flight, upstream = SingleFlight(), Upstream()
+    waiters = [asyncio.ensure_future(flight.run_async("key", "model", upstream.call)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert upstream.cancelled
+    assert flight.in_flight() == 0
+    # A later request starts a fresh call instead of joining the cancelled one
+    upstream.release.set()
+    assert await flight.run_async("key", "model", upstream.call) == "answer"
+    assert upstream.calls == 2
+
+
+async def test_exception_reaches_every_waiter_and_is_not_kept():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("upstream failed"))
+    waiters = [asyncio.ensure_future(flight.run_async("key", "model", upstream.call)) for _ in range(3)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) and str(result) == "upstream failed" for result in results)
+    assert upstream.calls == 1
+    assert flight.in_flight() == 0
+    upstream.error = None
+    assert await flight.run_async("key", "model", upstream.call) == "answer"
+
+
+def test_sync_callers_share_one_call_and_its_exception():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def call(outcome):
+        calls.append(outcome)
+        started.set()
+        release.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    for outcome in ("answer", ValueError("bad request")):
+        calls.clear()
+        started.clear()
+        release.clear()
+        with ThreadPoolExecutor(4) as pool:
+            leader = pool.submit(flight.run, "key", "model", lambda: call(outcome))
+            started.wait(5)
+            followers = [pool.submit(flight.run, "key", "model", lambda: call(outcome)) for _ in range(3)]
+            # Followers block on the leader's future; give them time to arrive before it finishes
+            time.sleep(0.2)
+            release.set()
+            futures = [leader, *followers]
+            if isinstance(outcome, Exception):
+                for future in futures:
+                    with pytest.raises(ValueError, match="bad request"):
+                        future.result(5)
+            else:
+                assert [future.result(5) for future in futures] == ["answer"] * 4
+        assert len(calls) == 1
+        assert flight.in_flight() == 0
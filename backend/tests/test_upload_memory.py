@@ -0,0 +1,91 @@
+"""
+Peak Python memory of one vision request, measured with tracemalloc against
+the local mock LLM (benchmarks/mock_llm.py). The image is Base64-encoded
+chunk by chunk into the request body, so a request must not allocate much
+more than the image itself.
+"""
+import asyncio
+import os
+import tracemalloc
+
+import pytest
+
+from api.services import openai_service
+from benchmarks.load_test import free_port, start_server, wait_until_up
+
+MAX_RATIO = 1.5
+SIZES = [4 * 1024 * 1024, 12 * 1024 * 1024]
+
+
+@pytest.fixture(scope="module")
+def mock_llm():
+    port = free_port()
+    server = start_server("benchmarks.mock_llm:app", port, {"MOCK_TOKENS_PER_SECOND": "0", "MOCK_LATENCY": "fixed:0.01"})
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/v1/models")
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.fixture
+def vision(mock_llm, monkeypatch):
+    monkeypatch.setattr(openai_service, "XAI_BASE_URL", mock_llm)
+    monkeypatch.setattr(openai_service, "_client", None)
+    monkeypatch.setattr(openai_service, "_async_client", None)
+    monkeypatch.setattr(openai_service, "get_vision_cache", lambda: None)
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(openai_service.close_clients())
+    loop.close()
+
+
+def peak_allocated(function, data: bytes) -> int:
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        function(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("path", ["sync", "async"])
+def test_vision_request_peaks_near_the_image_size(vision, path, size):
+    if path == "sync":
+        def request(data):
+            openai_service.process_image_with_grok(data)
+    else:
+        def request(data):
+            vision.run_until_complete(openai_service.process_image_with_grok_async(data))
+    # Imports, clients and connections are set up outside the measurement
+    request(os.urandom(1024))
+
+    data = os.urandom(size)
+    peak = peak_allocated(request, data)
+
+    assert peak / len(data) <= MAX_RATIO, f"{path} request peaked at {peak / len(data):.2f}x a {size} byte image"
+
+
+@pytest.mark.parametrize("coalescing", [True, False])
+def test_image_is_not_base64_encoded_for_the_key(monkeypatch, coalescing):
+    monkeypatch.setattr(openai_service, "UPSTREAM_COALESCING_ENABLED", coalescing)
+
+    def no_base64(image):
+        raise AssertionError("the key must not Base64-encode the image")
+
+    monkeypatch.setattr(openai_service, "iter_base64", no_base64)
+    image = memoryview(os.urandom(3 * 1024 * 1024))
+
+    peak = peak_allocated(lambda data: openai_service._vision_cache_key(data, "image/jpeg", "high", None), image)
+    key = openai_service._vision_cache_key(image, "image/jpeg", "high", None)
+
+    assert peak < 64 * 1024
+    if coalescing:
+        assert key == openai_service._vision_cache_key(memoryview(bytes(image)), "image/jpeg", "high", None)
+        assert key != openai_service._vision_cache_key(image, "image/png", "high", None)
+    else:
+        assert key is None
@@ -0,0 +1,300 @@
+import asyncio
+import types
+
+import httpx
+import openai
+import pytest
+
+from api.services import upstream_service
+from api.services.upstream_service import AIMDLimiter, CircuitBreaker, CircuitOpenError, UpstreamCaller
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream_service, "time", clock)
+    return clock
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    response = httpx.Response(status, request=httpx.Request("POST", "https://upstream.test/v1/chat/completions"))
+    return openai.APIStatusError("upstream error", response=response, body=None)
+
+
+# Circuit breaker
+
+def test_breaker_opens_once_the_failure_ratio_is_reached(clock):
+    breaker = CircuitBreaker(failure_ratio=0.5, window_size=10, reset_seconds=30)
+    for outcome in ["success"] * 6 + ["failure"] * 4:
+        assert breaker.allow()
+        breaker.record(outcome)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record("failure")
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opens == 1
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.retry_after() == pytest.approx(20)
+
+
+def test_scattered_failures_do_not_open_the_breaker(clock):
+    breaker = CircuitBreaker(failure_ratio=0.5, window_size=10, reset_seconds=30)
+    for _ in range(50):
+        breaker.record("failure")
+        breaker.record("success")
+        breaker.record("success")
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.opens == 0
+
+
+def open_breaker(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_ratio=0.5, window_size=4, reset_seconds=30)
+    for _ in range(2):
+        breaker.record("failure")
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 30
+    return breaker
+
+
+def test_half_open_breaker_lets_a_single_probe_through(clock):
+    breaker = open_breaker(clock)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes_the_breaker_with_a_clean_window(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    breaker.record("success")
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    breaker.record("failure")
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opens == 2
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_cancelled_probe_frees_the_probe_slot_without_an_outcome(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    breaker.record("cancelled")
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("status", [429, 400])
+def test_rate_limits_and_rejected_requests_do_not_count_as_failures(clock, status):
+    caller = UpstreamCaller(AIMDLimiter(4, 1, 8, latency_target=30), CircuitBreaker(0.5, 4, 30))
+    for _ in range(4):
+        caller._record_failure(clock.now, status_error(status))
+
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+    assert caller.breaker.failures == 0
+
+
+# Adaptive limiter
+
+def acquire(limiter: AIMDLimiter, count: int) -> None:
+    for _ in range(count):
+        assert limiter.try_acquire()
+
+
+def test_overload_halves_the_limit(clock):
+    limiter = AIMDLimiter(initial=16, minimum=1, maximum=64, latency_target=30)
+    acquire(limiter, 1)
+    clock.now += 1
+
+    limiter.release(started=clock.now - 1, overloaded=True)
+
+    assert limiter.limit == 8
+    assert limiter.decreases == 1
+
+
+def test_slow_call_counts_as_overload(clock):
+    limiter = AIMDLimiter(initial=16, minimum=1, maximum=64, latency_target=30)
+    acquire(limiter, 1)
+    started = clock.now
+    clock.now += 31
+
+    limiter.release(started=started, latency=31)
+
+    assert limiter.limit == 8
+
+
+def test_burst_of_overloads_sent_under_the_old_limit_decreases_once(clock):
+    limiter = AIMDLimiter(initial=16, minimum=1, maximum=64, latency_target=30)
+    acquire(limiter, 5)
+    started = clock.now
+    clock.now += 1
+
+    for _ in range(4):
+        limiter.release(started=started, overloaded=True)
+    assert limiter.limit == 8
+    assert limiter.decreases == 1
+
+    # A call sent after the decrease is a new signal
+    later = clock.now
+    clock.now += 1
+    limiter.release(started=later, overloaded=True)
+    assert limiter.limit == 4
+    assert limiter.decreases == 2
+
+
+def test_limit_grows_additively_only_while_busy(clock):
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=64, latency_target=30)
+
+    # One call in flight out of four: the limit is not the bottleneck
+    acquire(limiter, 1)
+    limiter.release(started=clock.now, latency=0.1)
+    assert limiter.limit == 4
+
+    # Half the slots busy: each success adds 1/limit, so one full window adds one slot
+    acquire(limiter, 3)
+    for _ in range(4):
+        limiter.release(started=clock.now, latency=0.1)
+        acquire(limiter, 1)
+    assert 4.9 < limiter.limit < 5
+    assert int(limiter.limit) == 4
+    limiter.release(started=clock.now, latency=0.1)
+    assert int(limiter.limit) == 5
+
+
+def test_limit_stays_within_its_bounds(clock):
+    limiter = AIMDLimiter(initial=2, minimum=2, maximum=3, latency_target=30)
+    for _ in range(5):
+        acquire(limiter, 1)
+        clock.now += 1
+        limiter.release(started=clock.now, overloaded=True)
+    assert limiter.limit == 2
+
+    for _ in range(50):
+        acquire(limiter, 2)
+        limiter.release(started=clock.now, latency=0.1)
+        limiter.release(started=clock.now, latency=0.1)
+    assert limiter.limit == 3
+
+
+def test_limiter_out_of_range_initial_value_is_clamped():
+    assert AIMDLimiter(initial=100, minimum=1, maximum=8, latency_target=30).limit == 8
+    assert AIMDLimiter(initial=0, minimum=2, maximum=8, latency_target=30).limit == 2
+
+
+def test_try_acquire_fails_at_the_limit():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=8, latency_target=30)
+    acquire(limiter, 2)
+
+    assert not limiter.try_acquire()
+    limiter.release(started=0.0)
+    assert limiter.try_acquire()
+
+
+async def test_async_waiter_gets_the_released_slot():
+    limiter = AIMDLimiter(initial=1, minimum=1, maximum=8, latency_target=30)
+    acquire(limiter, 1)
+    waiter = asyncio.ensure_future(limiter.acquire_async())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    assert limiter.stats()["waiting"] == 1
+
+    limiter.release(started=0.0)
+
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.stats()["in_flight"] == 1
+
+
+# Caller
+
+async def test_call_async_frees_the_callers_semaphore_while_backing_off(monkeypatch):
+    monkeypatch.setattr(upstream_service, "random", types.SimpleNamespace(uniform=lambda low, high: high))
+    caller = UpstreamCaller(AIMDLimiter(4, 1, 8, latency_target=30), CircuitBreaker(0.5, 20, 30),
+                            max_retries=1, backoff_base=0.2, backoff_max=1.0)
+    semaphore = asyncio.Semaphore(1)
+    attempts = []
+
+    async def attempt():
+        attempts.append(semaphore.locked())
+        if len(attempts) == 1:
+            raise asyncio.TimeoutError()
+        return "answer"
+
+    call = asyncio.ensure_future(caller.call_async("model", attempt, semaphore=semaphore))
+    await asyncio.sleep(0.05)
+
+    assert len(attempts) == 1 and not call.done()
+    # Another request can run during the backoff
+    await asyncio.wait_for(semaphore.acquire(), 0.05)
+    semaphore.release()
+
+    assert await call == "answer"
+    assert attempts == [True, True]
+    assert not semaphore.locked()
+
+
+async def test_open_circuit_rejects_without_calling_upstream():
+    caller = UpstreamCaller(AIMDLimiter(4, 1, 8, latency_target=30), CircuitBreaker(0.5, 2, 30), max_retries=0)
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise status_error(503)
+
+    with pytest.raises(openai.APIStatusError):
+        await caller.call_async("model", attempt)
+    with pytest.raises(CircuitOpenError):
+        await caller.call_async("model", attempt)
+    assert len(calls) == 1
+    assert caller.limiter.stats()["in_flight"] == 0
+
+
+async def test_hedges_stay_within_the_budget_and_do_not_skew_the_percentile():
+    caller = UpstreamCaller(AIMDLimiter(8, 1, 8, latency_target=30), CircuitBreaker(0.5, 20, 30),
+                            hedge_enabled=True, hedge_percentile=0.9, hedge_min_delay=0.05, hedge_budget=0.5)
+    caller._latencies["model"] = upstream_service.deque([0.01] * 20, maxlen=256)
+    attempts = []
+
+    async def attempt():
+        # Every first attempt is slow, every hedge fast
+        attempts.append(1)
+        await asyncio.sleep(0.2 if len(attempts) % 2 else 0)
+        return "answer"
+
+    for _ in range(4):
+        attempts.clear()
+        assert await caller.call_async("model", attempt) == "answer"
+
+    samples = list(caller._latencies["model"])[20:]
+    # Two hedges in four calls at a budget of 0.5; hedged calls record the primary's elapsed time, not the hedge's
+    assert len(samples) == 4
+    assert sorted(samples)[:2] == [pytest.approx(0.05, abs=0.04)] * 2
+    assert sorted(samples)[2:] == [pytest.approx(0.2, abs=0.08)] * 2
@@ -0,0 +1,74 @@
+import pytest
+
+from api.services import user_repository
+from api.services.user_repository import UserRepository
+from fake_mongo import AsyncFakeCollection
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def repository():
+    repository = UserRepository(AsyncFakeCollection())
+    await repository.ensure_indexes()
+    return repository
+
+
+async def test_save_characteristics_creates_then_updates_one_document(repository):
+    await repository.save_characteristics("alice", {"face_shape": "oval"})
+    await repository.save_characteristics("alice", {"face_shape": "round"})
+
+    documents = repository.collection.documents
+    assert len(documents) == 1
+    assert documents[0]["user_id"] == "alice"
+    assert documents[0]["characteristics"] == {"face_shape": "round"}
+    assert documents[0]["characteristics_updated_at"] > 0
+    assert repository.collection.calls["update_one"] == 2
+    assert "find_one" not in repository.collection.calls
+
+
+async def test_get_characteristics_of_unknown_user_is_empty(repository):
+    await repository.save_characteristics("alice", {"skin_tone": "fair"})
+
+    assert await repository.get_characteristics("alice") == {"skin_tone": "fair"}
+    assert await repository.get_characteristics("bob") == {}
+
+
+async def test_get_many_uses_one_query_and_projects_fields(repository):
+    for user_id in ("alice", "bob", "carol"):
+        await repository.save_characteristics(user_id, {"face_shape": user_id})
+    repository.collection.documents[0]["intentions"] = {"looking_for": "friends"}
+    finds_before = repository.collection.calls.get("find", 0)
+
+    users = await repository.get_many(["alice", "carol", "alice", "dave"], fields=("characteristics", "intentions"))
+
+    assert repository.collection.calls["find"] == finds_before + 1
+    assert set(users) == {"alice", "carol"}
+    assert users["alice"] == {
+        "user_id": "alice",
+        "characteristics": {"face_shape": "alice"},
+        "intentions": {"looking_for": "friends"},
+    }
+    assert "_id" not in users["carol"] and "characteristics_updated_at" not in users["carol"]
+
+
+async def test_get_many_without_ids_skips_the_query(repository):
+    assert await repository.get_many([]) == {}
+    assert "find" not in repository.collection.calls
+
+
+async def test_save_many_upserts_in_bulk_batches(repository, monkeypatch):
+    monkeypatch.setattr(user_repository, "MONGO_BULK_BATCH_SIZE", 2)
+    await repository.save_characteristics("alice", {"face_shape": "oval"})
+
+    written = await repository.save_many({
+        "alice": {"face_shape": "round"},
+        "bob": {"face_shape": "square"},
+        "carol": {"face_shape": "heart"},
+    })
+
+    assert written == 3
+    assert repository.collection.calls["bulk_write"] == 2
+    stored = {document["user_id"]: document["characteristics"] for document in repository.collection.documents}
+    assert stored == {"alice": {"face_shape": "round"}, "bob": {"face_shape": "square"}, "carol": {"face_shape": "heart"}}
+
@@ -0,0 +1,23 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api import routes
+
+pytestmark = pytest.mark.anyio
+
+
+async def post(path: str, params: dict) -> httpx.Response:
+    app = FastAPI()
+    app.include_router(routes.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post(path, params=params, files={"file": ("page.png", b"\x89PNG", "image/png")})
+
+
+@pytest.mark.parametrize("path", ["/validate-document", "/validate-document/jobs"])
+@pytest.mark.parametrize("params", [{"max_image_pixels": -1}, {"max_image_pixels": 0}, {"max_image_bytes": -5}])
+async def test_non_positive_image_limits_are_rejected(path, params):
+    response = await post(path, params)
+
+    assert response.status_code == 422
+    assert list(params) == [error["loc"][-1] for error in response.json()["detail"]]